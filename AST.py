@@ -1,15 +1,37 @@
-from env import Env
+from env import Env, Frame, global_env
 from decimal import Decimal
+from itertools import islice, zip_longest
+from array import array
+import hamt
 
 INDENT_SPACES = 4
 
+_slot_names = {}
+
+def slot_names(cls):
+    """
+    Returns the names of the slots of `cls` and of its bases, which hold
+    all of the state of an `Expression`.
+    """
+    names = _slot_names.get(cls)
+    if names is None:
+        names = _slot_names[cls] = tuple(
+            name for c in reversed(cls.__mro__)
+            for name in c.__dict__.get("__slots__", ()))
+    return names
+
 
 class Expression:
+    # Each subclass lists its attributes in `__slots__`, so instances have
+    # no `__dict__`, which would more than double the size of small ones
+    __slots__ = ()
+
     def __eq__(self, other):
         if not isinstance(other, Expression):
             return False
         return (type(self) == type(other)) and \
-            (self.__dict__ == other.__dict__)
+            all(getattr(self, name, None) == getattr(other, name, None)
+                for name in slot_names(type(self)))
 
     def __ne__(self, other):
         return not (self == other)
@@ -17,10 +39,28 @@ class Expression:
     def evaluate(self, env):
         raise NotImplementedError()
 
+    def compile(self, scope=None, tail=False):
+        """
+        Returns a closure `code(env)` equivalent to `self.evaluate(env)`.
+        Subclasses override this to do their dispatching once, up front,
+        instead of on every evaluation. `scope` is the `Scope` of the
+        frames `env` will be, or `None` for code run in any `Env`.
+
+        If `tail` is set, the expression is in tail position of a
+        procedure body, and `code` may return a `TailCall` for the
+        enclosing `Procedure.apply` to make instead of recursing.
+        """
+        return self.evaluate
+
 class Atom(Expression):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
 
+    def __eq__(self, other):
+        return type(self) is type(other) and self.value == other.value
+
     def __str__(self):
         return self.value if type(self.value) is str else str(self.value)
 
@@ -40,15 +80,134 @@ class Atom(Expression):
     def evaluate(self, env):
         return self
 
-class Symbol(Atom):
+    def compile(self, scope=None, tail=False):
+        return lambda env: self
+
+class InternedAtom(Atom):
+    """
+    An atom with exactly one instance per value: constructing it again
+    returns the existing instance, so equality and hashing can be by
+    identity. Each subclass needs its own `instances` table.
+    """
+    __slots__ = ()
+    instances = None
+
+    def __new__(cls, value):
+        try:
+            return cls.instances[value]
+        except KeyError:
+            atom = super().__new__(cls)
+            atom.value = value
+            cls.instances[value] = atom
+            return atom
+
+    def __init__(self, value):
+        pass # Already initialized by `__new__`
+
+    def __reduce__(self):
+        return type(self), (self.value,)
+
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = object.__hash__
+
+class Symbol(InternedAtom):
+    __slots__ = ()
+    instances = {}
+
     def evaluate(self, env):
         return env[self]
 
-class Keyword(Atom):
+    def compile(self, scope=None, tail=False):
+        if scope is None:
+            return lambda env: env[self]
+
+        address = scope.resolve(self)
+
+        if address is None:
+            # A global: skip every frame and go straight to hashed lookup
+            def lookup_global(env):
+                try:
+                    return env.top[self]
+                except KeyError:
+                    # Or a local declared since this was compiled (eg. by
+                    # a `Def` run by `Eval`), looked up by name
+                    return env[self]
+            return lookup_global
+
+        depth, slot = address
+
+        if depth == 0:
+            return lambda env: env.slots[slot]
+        elif depth == 1:
+            return lambda env: env.parent.slots[slot]
+        elif depth == 2:
+            return lambda env: env.parent.parent.slots[slot]
+
+        # Found in the display of the parent, which outlives the frame
+        # this runs in when a closure is called over and over
+        level = scope.level - depth
+        return lambda env: env.parent.display()[level].slots[slot]
+
+    def compile_assign(self, scope=None):
+        """
+        Returns a closure `assign(env, value)` that `Set!`s the variable
+        this symbol resolves to in `scope`.
+        """
+        if scope is None:
+            def assign(env, value):
+                env[self] = value
+            return assign
+
+        address = scope.resolve(self)
+
+        if address is None:
+            def assign(env, value):
+                try:
+                    env.top[self] = value
+                except KeyError:
+                    env[self] = value # See `compile`
+            return assign
+
+        depth, slot = address
+
+        if depth == 0:
+            def assign(env, value):
+                env.slots[slot] = value
+            return assign
+
+        level = scope.level - depth
+
+        def assign(env, value):
+            env.parent.display()[level].slots[slot] = value
+        return assign
+
+class Keyword(InternedAtom):
+    __slots__ = ()
+    instances = {}
+
     def evaluate(self, env):
         return self
 
+def exact_div(a, b):
+    """
+    Divides Python numbers, keeping the quotient of two `int`s exact:
+    an `int` if `b` divides `a`, otherwise a `Decimal`.
+    """
+    if type(a) is int and type(b) is int:
+        q, r = divmod(a, b)
+        if not r:
+            return q
+        return Decimal(a) / Decimal(b)
+    return a / b
+
 class Number(Atom):
+    """
+    Holds an `int` for exact integers, a `Decimal` once a fractional
+    value appears, or a `float` in float mode (see `lexer.Lexer`).
+    """
+    __slots__ = ()
+
     def __add__(self, other):
         return Number(self.value + other.value)
 
@@ -59,7 +218,7 @@ class Number(Atom):
         return Number(self.value * other.value)
 
     def __truediv__(self, other):
-        return Number(self.value / other.value)
+        return Number(exact_div(self.value, other.value))
 
     def __mod__(self, other):
         return Number(self.value % other.value)
@@ -68,52 +227,388 @@ class Number(Atom):
         return Number(self.value ** other.value)
 
 class String(Atom):
+    __slots__ = ()
+
     def __str__(self):
         return repr(self.value)
 
-from proc import Procedure
-from builtin import BuiltIn
+class Vec(Expression):
+    """
+    A packed vector of numbers: `data` is a `memoryview` of an `array` of
+    machine integers, or of floats once any element isn't an integer, or
+    of the bytes of a file `MapFile` mapped. Slices share the buffer of the
+    vector they are taken from. Its elements are `float`s rather than
+    `Decimal`s, which the builtins make `Decimal`s again when they are
+    mixed (see `utils.exact_values`).
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+
+    @staticmethod
+    def pack(values):
+        """
+        Returns the `Vec` of the Python numbers `values`.
+        """
+        values = values if type(values) is list else list(values)
+        if not all(type(v) is int for v in values):
+            return Vec(array("d", values))
+        try:
+            return Vec(array("q", values))
+        except OverflowError:
+            msg = "Integers in a `Vec` must fit in 64 bits"
+            raise AssertionError(msg) from None
+
+    def __eq__(self, other):
+        if type(other) is Vec:
+            return self.data == other.data
+        if type(other) is SExpression:
+            return len(self) == len(other) and \
+                all(type(n) is Number and n.value == v
+                    for n, v in zip(other, self.data))
+        return NotImplemented
+
+    def __hash__(self):
+        # Agrees with the hash of an `SExpression` of the same `Number`s
+        return hash(tuple(self.data))
+
+    def __reduce__(self):
+        return Vec, (array(self.data.format, self.data),)
+
+    def __str__(self):
+        return "Vec[{}]".format(" ".join(str(v) for v in self.data))
+
+    def __repr__(self):
+        return self.tree_repr()
+
+    def __iter__(self):
+        return map(Number, self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, i):
+        if type(i) is slice:
+            return Vec(self.data[i])
+        return Number(self.data[i])
+
+    def tree_repr(self, level=0):
+        return "{indent}{}".format(str(self),
+                                   indent=(" " * INDENT_SPACES * level))
+
+    def head(self):
+        return Number(self.data[0])
+
+    def rest(self):
+        return Vec(self.data[1:])
+
+    def evaluate(self, env):
+        return self
+
+class Seq(Expression):
+    """
+    A lazy sequence of the items of the iterator `source`, each computed
+    only once `head`, `rest` or iteration reach it, then kept so the
+    sequence can be walked again. Its `rest` is a `Seq` reading the same
+    `source`, and no cell refers back to the ones before it, so a walk
+    that lets go of the first cell runs in constant memory.
+
+    A `Seq` is `owned` once it is handed to the only builtin that will
+    ever reach it (see `owning`), which then reads its items straight
+    from `source`, without keeping them in cells.
+    """
+    __slots__ = ("source", "first", "next", "owned")
+
+    PRINT_LIMIT = 100 # Items shown by `str`, as the sequence may be endless
+
+    def __init__(self, source):
+        self.source = source # `None` once `first` and `next` are computed
+        self.first = None
+        self.next = None # The rest of the sequence, `None` if it is empty
+        self.owned = False
+
+    def force(self):
+        """
+        Computes the first item, if need be, and returns whether there is
+        one.
+        """
+        source = self.source
+        if source is not None:
+            try:
+                self.first = next(source)
+                self.next = Seq(source)
+            except StopIteration:
+                pass
+            self.source = None
+        return self.next is not None
+
+    def __eq__(self, other):
+        if type(other) not in (Seq, SExpression, Vec):
+            return False
+        missing = object()
+        return all(a == b for a, b in zip_longest(self, other,
+                                                  fillvalue=missing))
+
+    __hash__ = None # Hashing would force the whole, maybe endless, sequence
+
+    def __str__(self):
+        items = [str(x) for x in islice(self, Seq.PRINT_LIMIT + 1)]
+        if len(items) > Seq.PRINT_LIMIT:
+            items[-1] = "..."
+        return "{{{}}}".format(" ".join(items))
+
+    def __repr__(self):
+        return self.tree_repr()
+
+    def __iter__(self):
+        return walk(self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def tree_repr(self, level=0):
+        return "{indent}Seq{}".format(str(self),
+                                      indent=(" " * INDENT_SPACES * level))
+
+    def head(self):
+        if not self.force():
+            raise IndexError("Head of an empty sequence")
+        return self.first
+
+    def rest(self):
+        if not self.force():
+            return NIL
+        return self.next
+
+    def evaluate(self, env):
+        return self
+
+def walk(seq):
+    """
+    Yields the items of the `Seq` `seq`, without keeping the cells it has
+    passed alive.
+    """
+    if seq.owned and seq.source is not None:
+        # Nothing else could see the items kept in its cells
+        yield from seq.source
+        return
+    while True:
+        if not seq.force():
+            return
+        yield seq.first
+        seq = seq.next
+
+class Dict(Expression):
+    """
+    A persistent hash map, from keys (such as keywords, strings, numbers
+    and lists of them, which hash by value) to values. It is stored as a
+    hash array mapped trie (see `hamt`), so lookups take a few steps at
+    most, and `assoc` and `dissoc` return a new `Dict` that shares all but
+    a few nodes with this one, which is left as it was.
+    """
+    __slots__ = ("root", "count")
+    empty = None # The shared empty dict
+
+    def __new__(cls, root=None, count=0):
+        if root is None and cls.empty is not None:
+            return cls.empty
+        return super().__new__(cls)
+
+    def __init__(self, root=None, count=0):
+        self.root = root
+        self.count = count
+
+    @staticmethod
+    def of(pairs):
+        """
+        Returns the `Dict` of the (key, value) `pairs`, the last value of
+        a key given more than once winning.
+        """
+        root, count = None, 0
+        for key, value in pairs:
+            root, added = hamt.assoc(root, hashed(key), key, value)
+            count += added
+        return Dict(root, count)
+
+    def get(self, key, default=None):
+        value = hamt.find(self.root, hashed(key), key)
+        return default if value is hamt.MISSING else value
+
+    def assoc(self, key, value):
+        root, added = hamt.assoc(self.root, hashed(key), key, value)
+        return self if root is self.root else Dict(root, self.count + added)
+
+    def dissoc(self, key):
+        root = hamt.dissoc(self.root, hashed(key), key)
+        return self if root is self.root else Dict(root, self.count - 1)
+
+    def items(self):
+        return hamt.items(self.root)
+
+    def __contains__(self, key):
+        return hamt.find(self.root, hashed(key), key) is not hamt.MISSING
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+    def __len__(self):
+        return self.count
+
+    def __eq__(self, other):
+        if type(other) is not Dict:
+            return False
+        missing = hamt.MISSING
+        return self.count == other.count and \
+            all(other.get(key, missing) == value
+                for key, value in self.items())
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    def __reduce__(self):
+        # Rebuilt rather than copied node by node, as the hashes of the
+        # keys differ from one process to the next
+        return Dict.of, (tuple(self.items()),)
+
+    def __str__(self):
+        # Sorted, as the order of the trie differs from one run to the next
+        pairs = sorted(f"{key} {value}" for key, value in self.items())
+        return "#{{{}}}".format(" ".join(pairs))
+
+    def __repr__(self):
+        return self.tree_repr()
+
+    def tree_repr(self, level=0):
+        return "{indent}{}".format(str(self),
+                                   indent=(" " * INDENT_SPACES * level))
+
+    def evaluate(self, env):
+        return self
+
+def hashed(key):
+    try:
+        return hash(key)
+    except TypeError:
+        raise AssertionError(f"Keys of a `Dict` must be hashable: {key}")
 
 class SExpression(Expression):
+    """
+    A list, stored as a view of `items` (a tuple) from index `start` on.
+    `rest` shares `items` with the list it is taken from instead of
+    copying it, so walking a list with `Head` and `Body` is linear.
+    """
+    # The last (macro, expansion) of this call in `expansion`, see `expand`
+    __slots__ = ("items", "start", "expansion")
+    empty = None # The shared empty list, `NIL`
+
+    def __new__(cls, *values):
+        if not values and cls.empty is not None:
+            return cls.empty
+        return super().__new__(cls)
+
     def __init__(self, *values):
-        self.values = values
+        self.items = values
+        self.start = 0
+        self.expansion = None
+
+    @classmethod
+    def view(cls, items, start=0):
+        """
+        Returns the list of `items[start:]` without copying `items`.
+        """
+        if start >= len(items):
+            return cls.empty
+        sexpr = super().__new__(cls)
+        sexpr.items = items
+        sexpr.start = start
+        sexpr.expansion = None
+        return sexpr
+
+    @property
+    def values(self):
+        if self.start:
+            return self.items[self.start:]
+        return self.items
+
+    def __eq__(self, other):
+        if type(other) is not SExpression:
+            return NotImplemented # Let eg. `Vec` compare itself to lists
+        if self.items is other.items and self.start == other.start:
+            return True
+        return len(self) == len(other) and \
+            all(a == b for a, b in zip(self, other))
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __reduce__(self):
+        return SExpression, self.values
 
     def __str__(self):
-        return "{{{}}}".format(" ".join(str(v) for v in self.values))
+        return "{{{}}}".format(" ".join(str(v) for v in self))
 
     def __repr__(self):
         return self.tree_repr()
 
     def __iter__(self):
-        return iter(self.values)
+        if self.start:
+            return islice(self.items, self.start, None)
+        return iter(self.items)
 
     def __len__(self):
-        return len(self.values)
+        return len(self.items) - self.start
 
     def __getitem__(self, i):
-        return self.values[i]
+        if type(i) is not int:
+            return self.values[i]
+        if i < 0:
+            i += len(self)
+            if i < 0:
+                raise IndexError("SExpression index out of range")
+        return self.items[self.start + i]
     
     def tree_repr(self, level=0):
         class_name = self.__class__.__name__
         level_str = lambda child: child.tree_repr(level+1)
-        children = (level_str(child) for child in self.values)
+        children = (level_str(child) for child in self)
         return "{indent}{}(\n{}\n{indent})".format(
             class_name,
             ",\n".join(children),
             indent=(" " * INDENT_SPACES * level))
 
     def head(self):
-        return self.values[0]
+        return self.items[self.start]
 
     def body(self):
         return self.values[1:]
 
+    def rest(self):
+        """
+        Returns the list of all but the first element in O(1).
+        """
+        return SExpression.view(self.items, self.start + 1)
+
+    def expand(self, macro):
+        """
+        Returns the code this call to `macro` stands for, expanding it
+        only the first time (unless the call is to another macro since).
+        """
+        expansion = self.expansion
+        if expansion is None or expansion[0] is not macro:
+            expansion = self.expansion = (macro, macro.expand(self.rest()))
+        return expansion[1]
+
     def evaluate(self, env):
 
         head, *body = self.values
 
         if isinstance(head, Symbol):
             res = head.evaluate(env)
+            if type(res) is BuiltIn:
+                return res.apply(body, env)
+            if type(res) is Macro:
+                return self.expand(res).evaluate(env)
             return SExpression(res, *body).evaluate(env)
 
         elif isinstance(head, SExpression):
@@ -127,7 +622,252 @@ class SExpression(Expression):
         elif type(head) is BuiltIn:
             return head.apply(body, env)
 
+        elif type(head) is Macro:
+            return self.expand(head).evaluate(env)
+
         else:
             msg = f"Un-callable S-expression head: {head}"
             raise TypeError(msg)
 
+    def compile(self, scope=None, tail=False):
+
+        if not self:
+            return self.evaluate # Let the tree-walker report the error
+
+        head, *body = self.values
+        known = known_builtin(head, body, scope)
+
+        if type(head) is Symbol and head in special_forms and \
+                (scope is None or scope.resolve(head) is None):
+            code = special_forms[head](body, scope, tail)
+            if code is not None:
+                return code
+
+        head_code = head.compile(scope)
+
+        if type(global_value(head, scope)) is Macro or \
+                known is not None and known.proc_fn is None:
+            # The arguments are data for the macro or special form, not
+            # code to compile
+            arg_codes = [compiled_when_run(arg, scope) for arg in body]
+        elif known is None:
+            # `head` may still turn out to be a macro when called
+            arg_codes = [unchecked(arg, scope) for arg in body]
+        else:
+            arg_codes = [arg.compile(scope) for arg in body]
+
+        if known is not None and known.primitive is not None:
+            if known in seq_walkers:
+                arg_codes = [owning(arg, code, scope)
+                             for arg, code in zip(body, arg_codes)]
+            return builtin_call(known, head_code, arg_codes, self)
+
+        expanded = None # The macro last called here, and its compiled expansion
+
+        def call(env):
+            nonlocal expanded
+            fn = head_code(env)
+
+            if type(fn) is Procedure:
+                # The argument list becomes the callee's frame, so isn't
+                # kept in a local here that would outlive it
+                if tail:
+                    return TailCall(fn, [arg(env) for arg in arg_codes])
+                return fn.apply([arg(env) for arg in arg_codes])
+
+            elif type(fn) is BuiltIn:
+                if fn.proc_fn is not None:
+                    return fn.proc_fn([arg(env) for arg in arg_codes], env)
+                return fn.apply(body, env)
+
+            elif type(fn) is Macro:
+                if expanded is None or expanded[0] is not fn:
+                    expanded = fn, self.expand(fn).compile(scope, tail)
+                if type(env) is Frame:
+                    env.fit() # The expansion may have declared new locals
+                return expanded[1](env)
+
+            else:
+                return SExpression(fn, *body).evaluate(env)
+
+        return call
+
+
+def global_value(head, scope):
+    """
+    Returns the value of the global variable `head` names, if it is a
+    `Symbol` that isn't a local variable in `scope`, otherwise `None`.
+    """
+    if type(head) is not Symbol or \
+            (scope is not None and scope.resolve(head) is not None):
+        return None
+    return global_env().locals.get(head)
+
+def unchecked(arg, scope):
+    """
+    Returns `arg` compiled in `scope`, or, if compiling it reports a bad
+    call (see `known_builtin`), a closure raising that error once run.
+    """
+    try:
+        return arg.compile(scope)
+    except AssertionError as e:
+        error = e
+        def fail(env):
+            raise error
+        return fail
+
+def compiled_when_run(arg, scope):
+    """
+    Returns a closure running `arg`, compiled in `scope` (as by
+    `unchecked`) only once it is first run.
+    """
+    code = None
+
+    def run(env):
+        nonlocal code
+        if code is None:
+            code = unchecked(arg, scope)
+            if type(env) is Frame:
+                env.fit() # `arg` may have declared new locals
+        return code(env)
+    return run
+
+def known_builtin(head, args, scope):
+    """
+    Returns the builtin that a call of `head` with the unevaluated `args`,
+    compiled in `scope`, is to, if `head` names a global variable bound
+    to one, after checking the call against it (see `BuiltIn.check_call`).
+    """
+    fn = global_value(head, scope)
+    if type(fn) is not BuiltIn:
+        return None
+    fn.check_call(args)
+    return fn
+
+def owning(arg, code, scope):
+    """
+    Returns `code`, the compiled argument `arg` of a call to a builtin in
+    `seq_walkers`. If `arg` is a call to a builtin in `seq_makers`, the
+    `Seq` it returns can only be reached through the call's argument
+    list, so `code` marks it as `owned` by the builtin it is given to.
+    """
+    if type(arg) is not SExpression or not arg:
+        return code
+    maker = known_builtin(arg.head(), arg.body(), scope)
+    if maker not in seq_makers:
+        return code
+    head_code = arg.head().compile(scope)
+
+    def owned(env):
+        made = head_code(env) is maker # Not if it was redefined since
+        value = code(env)
+        if made and type(value) is Seq:
+            value.owned = True
+        return value
+    return owned
+
+def builtin_call(builtin, head_code, arg_codes, form):
+    """
+    Returns a call to `builtin` that calls its `primitive` directly, as
+    the call's arguments were checked when it was compiled. Leaves `form`
+    to the tree-walker if `head_code` no longer gives `builtin` when it
+    runs (ie. if the builtin's name has been bound to something else).
+    """
+    if len(arg_codes) == 1:
+        [a] = arg_codes
+
+        def call_builtin(env):
+            if head_code(env) is builtin:
+                return builtin.primitive([a(env)], env)
+            return form.evaluate(env)
+
+    elif len(arg_codes) == 2:
+        a, b = arg_codes
+
+        def call_builtin(env):
+            if head_code(env) is builtin:
+                return builtin.primitive([a(env), b(env)], env)
+            return form.evaluate(env)
+
+    else:
+        def call_builtin(env):
+            if head_code(env) is builtin:
+                return builtin.primitive([arg(env) for arg in arg_codes], env)
+            return form.evaluate(env)
+
+    return call_builtin
+
+class Guarded(Expression):
+    """
+    Code that the optimizer (see `optimizer`) rewrote into `optimized`,
+    assuming that each of the globals in `assumptions`, a tuple of
+    (`Symbol`, value) pairs, is still bound to that value. Runs `original`
+    instead if any has been bound to something else since.
+    """
+    __slots__ = ("assumptions", "optimized", "original")
+
+    def __init__(self, assumptions, optimized, original):
+        self.assumptions = assumptions
+        self.optimized = optimized
+        self.original = original
+
+    def __str__(self):
+        return str(self.optimized)
+
+    def __repr__(self):
+        return self.tree_repr()
+
+    def tree_repr(self, level=0):
+        return "{indent}Guarded(\n{},\n{}\n{indent})".format(
+            self.optimized.tree_repr(level + 1),
+            self.original.tree_repr(level + 1),
+            indent=(" " * INDENT_SPACES * level))
+
+    def holds(self, env):
+        return all(env[sym] is value for sym, value in self.assumptions)
+
+    def evaluate(self, env):
+        if self.holds(env):
+            return self.optimized.evaluate(env)
+        return self.original.evaluate(env)
+
+    def compile_check(self, scope=None):
+        """
+        Returns a closure `holds(env)` telling whether the assumptions
+        still hold, looking each global up by name only if it isn't
+        defined in the top-level environment itself.
+        """
+        assumptions = self.assumptions
+
+        def holds(env):
+            top = env.top if scope is not None else env
+            defined = top.locals
+            for sym, value in assumptions:
+                if defined.get(sym) is not value and top[sym] is not value:
+                    return False
+            return True
+        return holds
+
+    def compile(self, scope=None, tail=False):
+        holds = self.compile_check(scope)
+        optimized = self.optimized.compile(scope, tail)
+        original = None # Only compiled once needed, which it rarely is
+
+        def code(env):
+            nonlocal original
+            if holds(env):
+                return optimized(env)
+            if original is None:
+                original = self.original.compile(scope, tail)
+            if type(env) is Frame:
+                env.fit() # `original` may have declared new locals
+            return original(env)
+        return code
+
+TRUE = Keyword(":T")
+FALSE = Keyword(":F")
+NIL = SExpression.empty = SExpression()
+Dict.empty = Dict()
+
+from proc import Procedure, TailCall, Macro
+from builtin import BuiltIn, special_forms, seq_walkers, seq_makers
@@ -0,0 +1,70 @@
+"""
+Times single calls to builtins, the way each evaluator makes them, to
+show the overhead of calling a builtin. Run from the repository root:
+`python benchmarks/builtin_calls.py`
+"""
+
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from misp import environment, execute, parser, lexer
+from proc import Procedure
+import vm
+
+NUMBER = 200000
+
+DEFINITIONS = """
+Def[x 41]
+Def[xs '(1 2 3)]
+"""
+
+CASES = [
+    ("variable", "x"), # The cost of evaluating the arguments alone
+    ("+", "+[x 1]"),
+    ("Inc", "Inc[x]"),
+    ("<", "<[x 1]"),
+    ("Head", "Head[xs]"),
+    ("If", "If[x 1 2]"),
+]
+
+
+def compiled(ast):
+    code = ast.compile()
+    return lambda: code(environment)
+
+
+def on_vm(ast):
+    code = vm.compile_vm(ast)
+    return lambda: vm.run(code, environment)
+
+
+def tree_walked(ast):
+    def run():
+        Procedure.tree_walk = True
+        try:
+            return ast.evaluate(environment)
+        finally:
+            Procedure.tree_walk = False
+    return run
+
+
+def main():
+    for ast in parser.parse(lexer.tokenize(DEFINITIONS)):
+        execute(ast, environment)
+
+    print(f"{'call':>10} {'compiled (ns)':>14} {'vm (ns)':>10} "
+          f"{'tree-walk (ns)':>15}")
+    for name, source in CASES:
+        [ast] = parser.parse(lexer.tokenize(source))
+        times = [min(timeit.repeat(run(ast), number=NUMBER, repeat=3))
+                 / NUMBER * 1e9
+                 for run in (compiled, on_vm, tree_walked)]
+        print(f"{name:>10} {times[0]:>14.0f} {times[1]:>10.0f} "
+              f"{times[2]:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Times walking lists of growing length with `Head` and `Body`, which
+should scale linearly now that `Body` shares its list's items. Run from
+the repository root: `python benchmarks/list_walk.py`
+"""
+
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from misp import environment, execute, parser, lexer
+from AST import SExpression, Number, Symbol
+
+LENGTHS = [1000, 10000, 100000]
+
+DEFINITIONS = """
+Defn[walk-sum[xs acc]
+    If[=[xs '()]
+        acc
+        walk-sum[Body[xs] +[acc Head[xs]]]]]
+"""
+
+
+def run(source):
+    result = None
+    for ast in parser.parse(lexer.tokenize(source)):
+        result = execute(ast, environment)
+    return result
+
+
+def main():
+    run(DEFINITIONS)
+
+    print(f"{'length':>7} {'walk (ms)':>10} {'ns/element':>11}")
+    for length in LENGTHS:
+        environment.declare(Symbol("xs"))
+        environment[Symbol("xs")] = SExpression(*map(Number, range(length)))
+        start = time.perf_counter()
+        total = run("walk-sum[xs 0]")
+        secs = time.perf_counter() - start
+        assert total.value == length * (length - 1) // 2
+        print(f"{length:>7} {secs * 1e3:>10.1f} {secs / length * 1e9:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Times variable lookups from a procedure nested `depth` scopes deep, for
+a local of the outermost scope and for a global. Run from the repository
+root: `python benchmarks/lookup_depth.py`
+"""
+
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from misp import environment, execute, parser, lexer
+from proc import Procedure
+
+DEPTHS = [1, 2, 4, 8, 16, 32]
+CALLS = 20000
+
+
+def nested_proc(depth):
+    """
+    Returns a procedure that reads `v0` (bound `depth` scopes out) and
+    the global `g`.
+    """
+    source = "Fn['() Do[v0 g v0 g v0 g v0 g]]"
+    for i in reversed(range(depth)):
+        source = f"Let['(v{i} {i}) {source}]"
+    [ast] = parser.parse(lexer.tokenize(source))
+    return execute(ast, environment)
+
+
+def main():
+    [ast] = parser.parse(lexer.tokenize("Def[g 1]"))
+    execute(ast, environment)
+
+    print(f"{'depth':>5} {'compiled (us)':>14} {'tree-walk (us)':>15}")
+    for depth in DEPTHS:
+        times = []
+        for tree_walk in (False, True):
+            Procedure.tree_walk = tree_walk
+            proc = nested_proc(depth)
+            secs = timeit.timeit(lambda: proc.apply([]), number=CALLS)
+            times.append(secs / CALLS * 1e6)
+        Procedure.tree_walk = False
+        print(f"{depth:>5} {times[0]:>14.2f} {times[1]:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Measures the memory that parsed programs take up, in bytes per node of
+their syntax trees, for a generated program of about a million nodes.
+Run from the repository root: `python benchmarks/memory.py`
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from misp import parser, lexer
+from reader import read_forms
+from AST import SExpression
+
+# A top-level form of generated code, and quoted data, with 29 nodes
+FORM = ("Defn[f{i}[x y]\n"
+        "    If[=[x {i}] {{x y \"s{i}\" :k}} "
+        "+[x *[y {i}.5] '(a b c {i})]]]\n")
+
+
+def lines(forms):
+    for i in range(forms):
+        yield FORM.format(i=i)
+
+
+def nodes(expr):
+    """
+    Returns the number of nodes in `expr`, counting shared ones (such as
+    interned symbols) once per place they appear.
+    """
+    if type(expr) is not SExpression:
+        return 1
+    return 1 + sum(nodes(e) for e in expr)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    argparser.add_argument("--nodes", type=int, default=1000000,
+                           help="about how many nodes to parse")
+    args = argparser.parse_args()
+
+    forms = -(-args.nodes // nodes(next(read_forms(lines(1), lexer, parser))))
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    program = list(read_forms(lines(forms), lexer, parser))
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    count = sum(nodes(form) for form in program)
+    print(f"{count} nodes in {forms} forms, parsed in {elapsed:.1f}s")
+    print(f"{used / count:.1f} bytes per node ({used // 1024} KiB)")
+
+
+if __name__ == "__main__":
+    main()
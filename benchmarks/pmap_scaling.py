@@ -0,0 +1,54 @@
+"""
+Times `PMap` with growing numbers of worker processes, against `Map`, to
+show how it scales across cores. Run from the repository root:
+`python benchmarks/pmap_scaling.py`
+"""
+
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from misp import environment, execute, parser, lexer
+import parallel
+
+SOURCE = """
+Defn[pfib[n]
+    If[<[n 2]
+       n
+       +[pfib[Dec[n]] pfib[-[n 2]]]]]
+Def[inputs Map[Fn['(i) 18] Range[64]]]
+"""
+
+
+def run(source):
+    result = None
+    for ast in parser.parse(lexer.tokenize(source)):
+        result = execute(ast, environment)
+    return result
+
+
+def timed(source):
+    start = time.perf_counter()
+    run(source)
+    return time.perf_counter() - start
+
+
+def main():
+    run(SOURCE)
+    serial = timed("Map[pfib inputs]")
+    print(f"{'workers':>7} {'time (s)':>9} {'speedup':>8}")
+    print(f"{'Map':>7} {serial:>9.2f} {1:>8.2f}")
+
+    n = 1
+    while n <= (os.cpu_count() or 1):
+        parallel.set_workers(n)
+        run("PMap[Inc '(1)]") # Start the workers before timing
+        secs = timed("PMap[pfib inputs]")
+        print(f"{n:>7} {secs:>9.2f} {serial / secs:>8.2f}")
+        n *= 2
+
+
+if __name__ == "__main__":
+    main()
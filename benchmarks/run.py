@@ -0,0 +1,252 @@
+"""
+Runs the benchmark suite, reporting the operations per second and the
+peak memory of each benchmark, and flagging regressions against a stored
+baseline. Run from the repository root:
+
+    python benchmarks/run.py                    # Run and report
+    python benchmarks/run.py --json out.json    # Also save the results
+    python benchmarks/run.py --baseline benchmarks/baseline.json
+
+With `--baseline`, exits with status 1 if any benchmark got slower, or
+used more memory, by more than the tolerance.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PROGRAMS = os.path.join(ROOT, "benchmarks", "programs")
+
+sys.path.insert(0, ROOT)
+
+from misp import environment, execute, parser, lexer
+from reader import read_forms
+from env import Env
+import image
+import optimizer
+
+
+def load(program, optimized=False):
+    """
+    Runs the definitions in `benchmarks/programs/<program>.msp`, rewritten
+    by `optimizer` if `optimized` is set.
+    """
+    with open(os.path.join(PROGRAMS, program + ".msp")) as f:
+        for ast in read_forms(f, lexer, parser):
+            if optimized:
+                ast = optimizer.optimize(ast, environment)
+            execute(ast, environment)
+
+
+def misp_op(program, source, optimized=False):
+    """
+    Returns an operation that runs `source` once `program` is loaded.
+    """
+    def setup():
+        load(program, optimized)
+        [ast] = parser.parse(lexer.tokenize(source))
+        if optimized:
+            ast = optimizer.optimize(ast, environment)
+        code = ast.compile()
+        return lambda: code(environment)
+    return setup
+
+
+def generated_source(forms=1000):
+    lines = []
+    for i in range(forms):
+        lines.append(f"Defn[f{i}[x y]\n")
+        lines.append(f"    If[=[x {i}] {{x y \"s{i}\" :k{i}}} "
+                     f"+[x *[y {i}.5] '(a b c)]]]\n")
+    return "".join(lines)
+
+
+def parse_op():
+    source = generated_source()
+
+    def op():
+        forms = read_forms(io.StringIO(source), lexer, parser)
+        return sum(1 for _ in forms)
+    return op
+
+
+def load_source_op(env=None):
+    source = generated_source()
+
+    def op():
+        for ast in read_forms(io.StringIO(source), lexer, parser):
+            execute(ast, env)
+    return op
+
+
+def load_image_op():
+    # Only the library, not what other benchmarks have defined
+    library = Env(parent=environment)
+    load_source_op(library)()
+    path = os.path.join(tempfile.mkdtemp(), "library.img")
+    image.dump(path, library)
+    return lambda: image.load(path, library)
+
+
+# Prints the peak memory of running the command in its arguments
+PEAK_MEMORY_SCRIPT = """
+import os, subprocess, sys
+proc = subprocess.Popen(sys.argv[1:], stdout=subprocess.DEVNULL)
+_, status, usage = os.wait4(proc.pid, 0)
+assert status == 0, "misp exited with an error"
+print(usage.ru_maxrss)
+"""
+
+
+def startup_op():
+    args = [sys.executable, os.path.join(ROOT, "misp.py"), "-e", "+[1 2]"]
+
+    def op():
+        subprocess.run(args, stdout=subprocess.DEVNULL, check=True)
+
+    def peak_kb():
+        # Of the child, which tracemalloc can't see. A process's peak
+        # survives `exec`, so it is started from a new interpreter rather
+        # than from this one, which is large by now
+        script = [sys.executable, "-c", PEAK_MEMORY_SCRIPT]
+        return int(subprocess.check_output(script + args))
+    op.peak_kb = peak_kb
+    return op
+
+
+BENCHMARKS = {
+    "fib": misp_op("fib", "fib[20]"),
+    "tak": misp_op("tak", "tak[12 8 4]"),
+    "ackermann": misp_op("ackermann", "ack[2 50]"),
+    "list-walk": misp_op("list_walk", "walk-sum[numbers 0]"),
+    "list-length": misp_op("list_walk", "walk-len[numbers 0]"),
+    "quasiquote": misp_op("quasiquote", "codegen[100]"),
+    "template": misp_op("template", "render[200]"),
+    # The same loop, with its code generated once by macros, and by
+    # `Quasiquote` and `Eval` on every iteration
+    "macro": misp_op("macro", "macro-sum[200 0]"),
+    "macro-eval": misp_op("macro", "eval-sum[200 0]"),
+    # The same code, as written and as rewritten by `misp -O`
+    "generated": misp_op("generated", "generated-sum[200 0]"),
+    "generated-O": misp_op("generated", "generated-sum[200 0]", True),
+    # The same lookups, in an association list and in a `Dict`
+    "alist-lookup": misp_op("lookup", "alist-sum[500 0]"),
+    "dict-lookup": misp_op("lookup", "dict-sum[500 0]"),
+    # The ratio of these two shows how `PMap` scales across the cores
+    "map": misp_op("pmap", "Map[pfib inputs]"),
+    "pmap": misp_op("pmap", "PMap[pfib inputs]"),
+    "parse": parse_op,
+    # The ratio of these two shows what starting from an image saves
+    "load-source": load_source_op,
+    "load-image": load_image_op,
+    "startup": startup_op,
+}
+
+
+def measure(op, min_time, repeat):
+    """
+    Returns the best operations per second of `repeat` rounds of running
+    `op` for at least `min_time` seconds, and its peak memory in KiB.
+    """
+    best = 0
+    for _ in range(repeat):
+        runs = 0
+        start = time.perf_counter()
+        while True:
+            op()
+            runs += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, runs / elapsed)
+
+    if hasattr(op, "peak_kb"):
+        peak_kb = op.peak_kb()
+    else:
+        tracemalloc.start()
+        op()
+        peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+
+    return {"ops_per_sec": best, "peak_memory_kb": peak_kb}
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Returns a description of each result worse than its baseline by more
+    than `tolerance`, a fraction.
+    """
+    found = []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        speed = result["ops_per_sec"] / base["ops_per_sec"]
+        if speed < 1 - tolerance:
+            found.append(f"{name}: {1 / speed:.2f}x slower")
+        memory = result["peak_memory_kb"] / max(base["peak_memory_kb"], 1)
+        if memory > 1 + tolerance:
+            found.append(f"{name}: {memory:.2f}x the peak memory")
+    return found
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argparser.add_argument("names", nargs="*", metavar="NAME",
+                           help="benchmarks to run (all by default): " +
+                                ", ".join(BENCHMARKS))
+    argparser.add_argument("--json", metavar="FILE",
+                           help="saves the results to `FILE`")
+    argparser.add_argument("--baseline", metavar="FILE",
+                           help="flags regressions against the results " +
+                                "saved in `FILE`")
+    argparser.add_argument("--tolerance", type=float, default=0.15,
+                           help="the slowdown or memory growth, as a " +
+                                "fraction, to flag (default 0.15)")
+    argparser.add_argument("--min-time", type=float, default=0.5,
+                           help="seconds to run each round for")
+    argparser.add_argument("--repeat", type=int, default=3,
+                           help="rounds to take the best of")
+    args = argparser.parse_args()
+
+    names = args.names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        argparser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    sys.setrecursionlimit(10000) # For the non-tail recursion of `ack`
+
+    results = {}
+    print(f"{'benchmark':<12} {'ops/sec':>12} {'peak memory (KiB)':>18}")
+    for name in names:
+        op = BENCHMARKS[name]()
+        results[name] = measure(op, args.min_time, args.repeat)
+        print(f"{name:<12} {results[name]['ops_per_sec']:>12.2f} "
+              f"{results[name]['peak_memory_kb']:>18}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "results": results}, f, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline, args.tolerance)
+        for regression in found:
+            print("REGRESSION:", regression)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
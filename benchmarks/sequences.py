@@ -0,0 +1,59 @@
+"""
+Times the native `Range`, `Map`, `Filter` and `Reduce` against the same
+traversals written as misp recursion over `Head` and `Body`. Run from the
+repository root: `python benchmarks/sequences.py`
+"""
+
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from misp import environment, execute, parser, lexer
+
+LENGTH = 10000
+RUNS = 5
+
+DEFINITIONS = f"""
+Def[xs Range[{LENGTH}]]
+Defn[sq[x] *[x x]]
+Defn[sum[xs acc]
+    If[=[xs Nil] acc sum[Body[xs] +[acc Head[xs]]]]]
+Defn[sum-sq[xs acc]
+    If[=[xs Nil] acc sum-sq[Body[xs] +[acc sq[Head[xs]]]]]]
+Defn[count-small[xs acc]
+    If[=[xs Nil]
+       acc
+       count-small[Body[xs] If[=[Head[xs] 1] Inc[acc] acc]]]]
+Defn[count-up[i n acc]
+    If[=[i n] acc count-up[Inc[i] n +[acc i]]]]
+"""
+
+CASES = [
+    ("sum", "sum[xs 0]", "Reduce[+ xs]"),
+    ("sum of squares", "sum-sq[xs 0]", "Reduce[+ Map[sq xs]]"),
+    ("filter", "count-small[xs 0]", "Filter[Fn['(x) =[x 1]] xs]"),
+    ("range", f"count-up[0 {LENGTH} 0]", f"Reduce[+ Range[{LENGTH}]]"),
+]
+
+
+def compile_source(source):
+    [ast] = parser.parse(lexer.tokenize(source))
+    code = ast.compile()
+    return lambda: code(environment)
+
+
+def main():
+    for ast in parser.parse(lexer.tokenize(DEFINITIONS)):
+        execute(ast, environment)
+
+    print(f"{'case':>15} {'recursion (ms)':>15} {'native (ms)':>12}")
+    for name, recursive, native in CASES:
+        times = [timeit.timeit(compile_source(source), number=RUNS) / RUNS
+                 for source in (recursive, native)]
+        print(f"{name:>15} {times[0] * 1e3:>15.2f} {times[1] * 1e3:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Times `misp -e '+[1 2]'` end to end, against a bare Python start for
+reference. Run from the repository root: `python benchmarks/startup.py`
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RUNS = 20
+
+
+def time_command(args):
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=ROOT, check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    commands = [
+        ("python -c pass", [sys.executable, "-c", "pass"]),
+        ("misp -e '+[1 2]'", [sys.executable, "misp.py", "-e", "+[1 2]"]),
+    ]
+    print(f"{'command':<20} {'min (ms)':>9} {'median (ms)':>12}")
+    for name, args in commands:
+        times = time_command(args)
+        print(f"{name:<20} {min(times) * 1e3:>9.1f} "
+              f"{statistics.median(times) * 1e3:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
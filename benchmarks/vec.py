@@ -0,0 +1,49 @@
+"""
+Times summing and scaling a million-element series held as a list of
+`Number`s against the same series as a `Vec`. Run from the repository
+root: `python benchmarks/vec.py`
+"""
+
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from misp import environment, parser, lexer
+
+LENGTH = 1000000
+RUNS = 5
+
+CASES = [
+    ("sum", "Apply[+ xs]", "VSum[v]"),
+    ("dot", None, "Dot[v v]"),
+    ("scale", None, "VMap[* v 3]"),
+    ("add", None, "VMap[+ v v]"),
+]
+
+
+def compile_source(source):
+    [ast] = parser.parse(lexer.tokenize(source))
+    code = ast.compile()
+    return lambda: code(environment)
+
+
+def main():
+    compile_source(f"Def[xs Range[{LENGTH}]]")()
+    compile_source("Def[v Vec[xs]]")()
+
+    print(f"{'op':>6} {'list (ms)':>10} {'Vec (ms)':>9}")
+    for name, list_source, vec_source in CASES:
+        times = []
+        for source in (list_source, vec_source):
+            if source is None:
+                times.append("-")
+                continue
+            secs = timeit.timeit(compile_source(source), number=RUNS) / RUNS
+            times.append(f"{secs * 1e3:.1f}")
+        print(f"{name:>6} {times[0]:>10} {times[1]:>9}")
+
+
+if __name__ == "__main__":
+    main()
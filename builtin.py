@@ -1,13 +1,77 @@
-from AST import Expression
+from AST import Expression, String, Keyword
+
+# Maps the `Symbol` naming a special form to a function that compiles
+# the form's (unevaluated) arguments into a closure. See `utils.compiles`.
+special_forms = {}
+
+# Maps each builtin's name to it, so builtins can be pickled by name
+registry = {}
+
+# The builtins that only walk the `Seq`s they are given, and those that
+# return a new `Seq` nothing else refers to (see `AST.owning`)
+seq_walkers = set()
+seq_makers = set()
+
+def named_builtin(name):
+    """
+    Returns the builtin called `name`, as unpickling a `BuiltIn` does.
+    """
+    import prelude # Defines all of the builtins
+    return registry[name]
+
+
+def arity_error(name, arity, got):
+    argc, ellipsis = arity
+    addendum = "at least " if got < argc and ellipsis is ... else ""
+    msg = f"Wrong number of arguments to `{name}`. " + \
+          f"Expected {addendum}{argc}, got {got}"
+    return AssertionError(msg)
 
 
 class BuiltIn(Expression):
-    def __init__(self, fn, name=None):
+    __slots__ = ("fn", "name", "proc_fn", "arity", "primitive", "numeric")
+
+    def __init__(self, fn, name=None, proc_fn=None, arity=None,
+                 primitive=None, numeric=False):
         self.fn = fn
         self.name = name if name is not None else f"@ {id(self)}"
+        # For builtins that evaluate their arguments, the underlying
+        # function accepting the already-evaluated argument list
+        self.proc_fn = proc_fn
+        # The `(argc, ellipsis)` accepted, as given to `utils.arity`
+        self.arity = arity
+        # `proc_fn` without its arity check
+        self.primitive = primitive
+        # Whether its arguments must all be numbers
+        self.numeric = numeric
 
     def apply(self, args, env):
         return self.fn(args, env)
 
+    def check_call(self, args):
+        """
+        Raises the error that a call with the unevaluated `args` will, if
+        the call alone shows it: the wrong number of arguments, or a
+        literal that isn't a number given to a numeric builtin.
+        """
+        if self.arity is not None:
+            argc, ellipsis = self.arity
+            if len(args) != argc and (ellipsis is not ... or len(args) < argc):
+                raise arity_error(self.name, self.arity, len(args))
+
+        if self.numeric and any(type(arg) in (String, Keyword) for arg in args):
+            msg = f"Arguments to `{self.name}` must all be numbers: " + \
+                  " ".join(str(arg) for arg in args)
+            raise AssertionError(msg)
+
+    def __reduce__(self):
+        # Stands for the same builtin in the process it is unpickled in
+        return named_builtin, (self.name,)
+
+    # Each builtin is defined once, so it is only equal to itself
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = object.__hash__
+
     def __str__(self):
         return f"<BuiltIn {self.name}>"
@@ -3,15 +3,18 @@ class Env:
     Represents a scoped variable environment. See assertion
     tests at bottom of module for examples.
     """
+    __slots__ = ("parent", "locals", "top")
 
     def __init__(self, parent=None, locals_=None):
         self.parent = parent if parent is not None else EmptyDict()
         self.locals = locals_ if locals_ is not None else dict()
+        # Where compiled code looks up globals (see `Frame`)
+        self.top = self
 
     def __getitem__(self, name):
-        if name in self.locals.keys():
+        try:
             return self.locals[name]
-        else:
+        except KeyError:
             return self.parent[name]
 
     def declare(self, name):
@@ -29,12 +32,128 @@ class Env:
     def __contains__(self, name):
         return name in self.locals or name in self.parent
 
+    def __reduce_ex__(self, protocol):
+        # The global environment stands for the one in the process it is
+        # unpickled in, which has the same builtins
+        if self is global_env():
+            return global_env, ()
+        return super().__reduce_ex__(protocol)
+
     def __repr__(self):
         fmt = "Env(parent: {}, local: {})"
         return fmt.format(self.parent, self.locals)
 
 
+def global_env():
+    """
+    Returns the global environment, holding the prelude's builtins and the
+    top-level definitions of the program.
+    """
+    import prelude
+    return prelude.builtins
+
+
+class Frame(Env):
+    """
+    The local variables of a single procedure application (or `Let`),
+    stored in a list. Compiled code addresses them by the slots that
+    `scope` assigned them, and looks up globals directly in `top`, the
+    nearest enclosing `Env` that isn't a frame. Lookup by name still
+    works, for `Eval` and the tree-walker.
+    """
+    # Bar `locals`, which frames don't use. `frames` is set on first use
+    __slots__ = ("scope", "slots", "frames")
+
+    def __init__(self, scope, slots, parent):
+        self.scope = scope
+        self.slots = slots
+        self.parent = parent
+        self.top = parent.top
+
+    def display(self):
+        """
+        Returns the frames this one is nested in, outermost first and
+        ending with itself, so that compiled code finds a variable of any
+        enclosing scope by that scope's `level`, without walking the
+        frames in between. Built the first time it is needed, from the
+        display of the parent.
+        """
+        try:
+            return self.frames
+        except AttributeError:
+            parent = self.parent
+            outer = parent.display() if type(parent) is Frame else ()
+            self.frames = outer + (self,)
+            return self.frames
+
+    def fit(self):
+        """
+        Adds slots for variables declared in `scope` since this frame
+        was created (eg. by code passed to `Eval`).
+        """
+        missing = len(self.scope.names) - len(self.slots)
+        if missing > 0:
+            self.slots.extend([None] * missing)
+
+    def __getitem__(self, name):
+        slot = self.scope.slots.get(name)
+        if slot is None:
+            return self.parent[name]
+        return self.slots[slot] if slot < len(self.slots) else None
+
+    def declare(self, name):
+        self.scope.declare(name)
+        self.fit()
+
+    def declare_all(self, *names):
+        for name in names:
+            self.declare(name)
+
+    def __setitem__(self, name, value):
+        slot = self.scope.slots.get(name)
+        if slot is None:
+            self.parent[name] = value
+        else:
+            self.fit()
+            self.slots[slot] = value
+
+    def __contains__(self, name):
+        return name in self.scope.slots or name in self.parent
+
+    def __repr__(self):
+        fmt = "Frame(parent: {}, slots: {})"
+        return fmt.format(self.parent, dict(zip(self.scope.names, self.slots)))
+
+
+class ReadOnly:
+    """
+    A view of `env` through which code can look variables up, but not
+    assign or declare them. Used as the parent of an `Env`, definitions
+    go in that `Env` instead.
+    """
+    __slots__ = ("env",)
+
+    def __init__(self, env):
+        self.env = env
+
+    def __getitem__(self, name):
+        return self.env[name]
+
+    def __setitem__(self, name, value):
+        if name not in self.env:
+            raise KeyError(f"Unbound symbol '{name}'")
+        raise KeyError(f"Cannot assign to read-only variable '{name}'")
+
+    def __contains__(self, name):
+        return name in self.env
+
+    def __repr__(self):
+        return "ReadOnly(...)"
+
+
 class EmptyDict:
+    __slots__ = ()
+
     def __getitem__(self, name):
         raise KeyError(f"Unbound symbol '{name}'")
 
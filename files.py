@@ -0,0 +1,124 @@
+"""
+Reads and writes files for the file builtins in `prelude`, a line or a
+chunk at a time, so that files larger than memory can be processed. A
+file is opened when the builtin is called, but only read as the `Seq` it
+returns is walked, and closed once it has been read to the end.
+
+Files opened while a `With-File` form runs are closed when it is done,
+even if it raises, so a `Seq` of one of them must be walked inside it.
+"""
+
+import mmap
+import threading
+from array import array
+from contextlib import contextmanager
+
+from AST import String, Vec
+
+# The size of `ReadChunks`'s chunks, in characters, unless given
+CHUNK_SIZE = 1 << 16
+
+# The buffer of `WriteLines`, in bytes
+WRITE_BUFFER = 1 << 16
+
+# The files opened by each `With-File` running in a thread, innermost last
+_scopes = threading.local()
+
+
+@contextmanager
+def closing():
+    """
+    Closes the files opened in the `with` block when it is left.
+    """
+    if not hasattr(_scopes, "stack"):
+        _scopes.stack = []
+    opened = []
+    _scopes.stack.append(opened)
+    try:
+        yield
+    finally:
+        _scopes.stack.pop()
+        for f in reversed(opened):
+            try:
+                f.close()
+            except BufferError:
+                pass # A mapped file still viewed, unmapped once it isn't
+
+
+def opened(f):
+    """
+    Returns `f`, to be closed by the innermost `With-File` running, if any.
+    """
+    stack = getattr(_scopes, "stack", None)
+    if stack:
+        stack[-1].append(f)
+    return f
+
+
+def read_lines(path):
+    """
+    Returns an iterator of the lines of the file at `path`, as `String`s
+    without their newlines.
+    """
+    f = opened(open(path))
+
+    def lines():
+        with reading(f, path), f:
+            for line in f:
+                yield String(line[:-1] if line.endswith("\n") else line)
+    return lines()
+
+
+def read_chunks(path, size=CHUNK_SIZE):
+    """
+    Returns an iterator of the file at `path` as `String`s of `size`
+    characters, the last one shorter.
+    """
+    f = opened(open(path))
+
+    def chunks():
+        with reading(f, path), f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    return
+                yield String(chunk)
+    return chunks()
+
+
+@contextmanager
+def reading(f, path):
+    try:
+        yield
+    except ValueError:
+        if not f.closed:
+            raise
+        msg = f"File read after the `With-File` it was opened in: {path}"
+        raise AssertionError(msg) from None
+
+
+def map_file(path):
+    """
+    Returns a `Vec` of the bytes of the file at `path`, mapped into memory
+    read-only rather than read, so that only the pages used are loaded.
+    """
+    with open(path, "rb") as f:
+        if not f.seek(0, 2):
+            return Vec(array("B")) # Empty files can't be mapped
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return Vec(opened(mapped))
+
+
+def write_lines(path, items):
+    """
+    Writes each of `items` to the file at `path` on a line of its own,
+    replacing what it held. `String`s are written without quotes. Returns
+    the number of lines written.
+    """
+    count = 0
+    with open(path, "w", buffering=WRITE_BUFFER) as f:
+        for item in items:
+            f.write(item.value if type(item) is String else str(item))
+            f.write("\n")
+            count += 1
+    return count
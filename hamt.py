@@ -0,0 +1,198 @@
+"""
+The nodes of a hash array mapped trie, the persistent hash table behind
+`AST.Dict`. Each level of the trie branches on the next `BITS` bits of a
+key's hash, and a node only allocates the branches it uses: `bitmap` has
+a bit set for each, and `array` holds them in order, as a key and value
+pair, or as `None` and the node below. Updates copy the nodes on the path
+to the key, which is a few levels deep even for millions of keys, and
+share all of the others with the trie they were made from.
+
+Nodes are never changed once made. An empty trie is `None`.
+"""
+
+BITS = 5
+MASK = (1 << BITS) - 1
+
+# Returned by `find` for keys that aren't in the trie
+MISSING = object()
+
+
+def find(node, h, key):
+    """
+    Returns the value of `key`, whose hash is `h`, in the trie `node`, or
+    `MISSING`.
+    """
+    shift = 0
+    while type(node) is BitmapNode:
+        bit = 1 << ((h >> shift) & MASK)
+        if not node.bitmap & bit:
+            return MISSING
+        i = 2 * (node.bitmap & (bit - 1)).bit_count()
+        k = node.array[i]
+        if k is None:
+            node = node.array[i + 1]
+            shift += BITS
+        elif k is key or k == key:
+            return node.array[i + 1]
+        else:
+            return MISSING
+    if node is None:
+        return MISSING
+    return node.find(h, key)
+
+
+def assoc(node, h, key, value):
+    """
+    Returns the trie `node` with `key` mapped to `value`, and whether
+    `key` is new to it.
+    """
+    if node is None:
+        return BitmapNode(1 << (h & MASK), (key, value)), True
+    return node.assoc(0, h, key, value)
+
+
+def dissoc(node, h, key):
+    """
+    Returns the trie `node` without `key`, or `node` itself if it doesn't
+    have `key`.
+    """
+    if node is None:
+        return None
+    return node.dissoc(0, h, key)
+
+
+def items(node):
+    """
+    Yields the (key, value) pairs of the trie `node`, in the order of
+    their hashes.
+    """
+    if node is None:
+        return
+    array = node.array
+    for i in range(0, len(array), 2):
+        if array[i] is None:
+            yield from items(array[i + 1])
+        else:
+            yield array[i], array[i + 1]
+
+
+def replaced(array, i, value):
+    return array[:i] + (value,) + array[i + 1:]
+
+
+def pair(shift, k1, v1, h2, k2, v2):
+    """
+    Returns the node, for level `shift`, of two different keys.
+    """
+    h1 = hash(k1)
+    if h1 == h2:
+        return CollisionNode(h1, (k1, v1, k2, v2))
+    node = BitmapNode(1 << ((h1 >> shift) & MASK), (k1, v1))
+    return node.assoc(shift, h2, k2, v2)[0]
+
+
+class BitmapNode:
+    __slots__ = ("bitmap", "array")
+
+    def __init__(self, bitmap, array):
+        self.bitmap = bitmap
+        self.array = array
+
+    def assoc(self, shift, h, key, value):
+        bit = 1 << ((h >> shift) & MASK)
+        i = 2 * (self.bitmap & (bit - 1)).bit_count()
+        array = self.array
+
+        if not self.bitmap & bit:
+            array = array[:i] + (key, value) + array[i:]
+            return BitmapNode(self.bitmap | bit, array), True
+
+        k, v = array[i], array[i + 1]
+        if k is None:
+            child, added = v.assoc(shift + BITS, h, key, value)
+            if child is v:
+                return self, False
+            return BitmapNode(self.bitmap, replaced(array, i + 1, child)), \
+                added
+        if k is key or k == key:
+            if v is value:
+                return self, False
+            return BitmapNode(self.bitmap, replaced(array, i + 1, value)), \
+                False
+
+        child = pair(shift + BITS, k, v, h, key, value)
+        array = array[:i] + (None, child) + array[i + 2:]
+        return BitmapNode(self.bitmap, array), True
+
+    def dissoc(self, shift, h, key):
+        bit = 1 << ((h >> shift) & MASK)
+        if not self.bitmap & bit:
+            return self
+        i = 2 * (self.bitmap & (bit - 1)).bit_count()
+        array = self.array
+
+        k, v = array[i], array[i + 1]
+        if k is None:
+            child = v.dissoc(shift + BITS, h, key)
+            if child is v:
+                return self
+            if child is not None:
+                if type(child) is BitmapNode and len(child.array) == 2 and \
+                        child.array[0] is not None:
+                    # Its only key moves up, where it no longer collides
+                    array = array[:i] + child.array + array[i + 2:]
+                else:
+                    array = replaced(array, i + 1, child)
+                return BitmapNode(self.bitmap, array)
+        elif not (k is key or k == key):
+            return self
+
+        if self.bitmap == bit:
+            return None
+        return BitmapNode(self.bitmap ^ bit, array[:i] + array[i + 2:])
+
+
+class CollisionNode:
+    """
+    The keys with the same hash `hash`, which no number of levels could
+    tell apart, searched one by one.
+    """
+    __slots__ = ("hash", "array")
+
+    def __init__(self, h, array):
+        self.hash = h
+        self.array = array
+
+    def index(self, key):
+        array = self.array
+        for i in range(0, len(array), 2):
+            if array[i] is key or array[i] == key:
+                return i
+        return -1
+
+    def find(self, h, key):
+        if h != self.hash:
+            return MISSING
+        i = self.index(key)
+        return MISSING if i < 0 else self.array[i + 1]
+
+    def assoc(self, shift, h, key, value):
+        if h != self.hash:
+            # Moves down a level, below a node that tells the hashes apart
+            node = BitmapNode(1 << ((self.hash >> shift) & MASK), (None, self))
+            return node.assoc(shift, h, key, value)
+
+        i = self.index(key)
+        if i < 0:
+            return CollisionNode(h, self.array + (key, value)), True
+        if self.array[i + 1] is value:
+            return self, False
+        return CollisionNode(h, replaced(self.array, i + 1, value)), False
+
+    def dissoc(self, shift, h, key):
+        i = self.index(key) if h == self.hash else -1
+        if i < 0:
+            return self
+        if len(self.array) == 2:
+            return None
+        return CollisionNode(h, self.array[:i] + self.array[i + 2:])
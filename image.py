@@ -0,0 +1,140 @@
+"""
+Saves the definitions in the global environment to an image file, and
+loads them back, so a program can start with a library already defined
+(`misp --image`) instead of reading and running its source again.
+
+An image is a header followed by the definitions, pickled and compressed.
+Procedures keep their ASTs and closures, and are compiled again when
+first applied; builtins are saved by name, and the environment itself is
+saved as a reference to the one the image is loaded into. The header holds a signature
+of the interpreter that wrote the image, which any other interpreter
+(whose ASTs, procedures or builtins may differ) rejects.
+"""
+
+import hashlib
+import io
+import os
+import pickle
+import platform
+import zlib
+
+from builtin import BuiltIn, registry
+from env import global_env
+
+MAGIC = b"MISPIMG\n"
+
+# Bumped when the layout of images changes
+FORMAT = 1
+
+# The modules defining what an image holds
+SOURCES = ("AST.py", "builtin.py", "env.py", "proc.py", "prelude.py", "scope.py")
+
+_signature = None
+
+
+class ImageError(Exception):
+    pass
+
+
+def signature():
+    """
+    Returns a digest of the image format, the Python version and the
+    source of the modules in `SOURCES`.
+    """
+    global _signature
+    if _signature is None:
+        digest = hashlib.sha1(f"{FORMAT}\n{platform.python_version()}\n".encode())
+        root = os.path.dirname(os.path.abspath(__file__))
+        for name in SOURCES:
+            with open(os.path.join(root, name), "rb") as f:
+                digest.update(f.read())
+        _signature = digest.digest()
+    return _signature
+
+
+class Pickler(pickle.Pickler):
+    """
+    Pickles references to the environment being saved as references to
+    the one loaded into, see `Unpickler`.
+    """
+    def __init__(self, file, env):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.env = env
+
+    def persistent_id(self, obj):
+        return "env" if obj is self.env else None
+
+
+class Unpickler(pickle.Unpickler):
+    def __init__(self, file, env):
+        super().__init__(file)
+        self.env = env
+
+    def persistent_load(self, pid):
+        if pid != "env":
+            raise pickle.UnpicklingError(f"Unknown reference {pid!r}")
+        return self.env
+
+
+def pickled(obj, env):
+    f = io.BytesIO()
+    Pickler(f, env).dump(obj)
+    return f.getvalue()
+
+
+def definitions(env):
+    """
+    Returns the variables of `env` an image needs, ie. all but the
+    builtins bound to their own names, which every interpreter has.
+    """
+    return {name: value for name, value in env.locals.items()
+            if type(value) is not BuiltIn or
+            registry.get(name.value) is not value}
+
+
+def dump(path, env=None):
+    """
+    Writes the definitions in `env` (by default the global environment)
+    to an image at `path`. Raises `ImageError` if one can't be saved, such
+    as a lazy sequence, which holds a Python iterator.
+    """
+    env = env if env is not None else global_env()
+    found = definitions(env)
+    try:
+        data = pickled(found, env)
+    except (TypeError, AttributeError, pickle.PicklingError):
+        raise ImageError(f"Cannot save '{unpicklable(found, env)}' in an image")
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(signature())
+        f.write(zlib.compress(data))
+
+
+def unpicklable(found, env):
+    for name, value in found.items():
+        try:
+            pickled(value, env)
+        except (TypeError, AttributeError, pickle.PicklingError):
+            return name
+
+
+def load(path, env=None):
+    """
+    Defines the variables saved in the image at `path` in `env` (by
+    default the global environment). Raises `ImageError` if the file
+    isn't an image, or was written by a different interpreter.
+    """
+    env = env if env is not None else global_env()
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ImageError(f"'{path}' is not a misp image")
+        if f.read(len(signature())) != signature():
+            raise ImageError(f"'{path}' was saved by a different version " +
+                             "of misp, and must be saved again")
+        data = f.read()
+
+    try:
+        data = zlib.decompress(data)
+        env.locals.update(Unpickler(io.BytesIO(data), env).load())
+    except (zlib.error, pickle.UnpicklingError, EOFError) as e:
+        raise ImageError(f"'{path}' is corrupt: {e}")
@@ -1,5 +1,8 @@
+import pytest
 import AST
-from misp import environment, evaluate
+from misp import environment, evaluate, execute, parser, lexer
+from proc import Procedure
+import vm
 from decimal import Decimal
 
 def fn_type(): pass
@@ -7,6 +10,29 @@ def fn_type(): pass
 def EVAL(source, env=environment):
     return evaluate(source, env)
 
+def RUN(source, env=environment):
+    """
+    Returns the value of the last top-level form in `source`.
+    """
+    res = None
+    for ast in parser.parse(lexer.tokenize(source)):
+        res = execute(ast, env)
+    return res
+
+def RUN_BOTH(source):
+    """
+    Runs `source` compiled and with the reference tree-walker, checking
+    that both agree.
+    """
+    compiled = RUN(source)
+    Procedure.tree_walk = True
+    try:
+        walked = RUN(source)
+    finally:
+        Procedure.tree_walk = False
+    assert str(compiled) == str(walked)
+    return compiled
+
 def test_fn_creation():
     res = EVAL("Fn[{x} *[x x]]")
     assert type(res) is type(fn_type)
@@ -50,5 +76,794 @@ def test_classic_lisp_fn_application():
     assert EVAL("+[1 2 3]") == EVAL("(+ 1 2 3)")
     assert EVAL("Fn[{x} *[x x]][12]") == EVAL("((Fn {x} (* x x)) 12)")
 
+def test_compiled_matches_tree_walker():
+    assert str(RUN_BOTH("+[1 2 3]")) == "6"
+    assert str(RUN_BOTH("Let['(x 2 y 3) *[x y]]")) == "6"
+    assert str(RUN_BOTH("Do[Def[a 1] Set![a +[a 1]] a]")) == "2"
+    assert str(RUN_BOTH("If[=[1 2] 'yes 'no]")) == "no"
+    assert str(RUN_BOTH("And[:T Or[Nil 3]]")) == "3"
+    assert str(RUN_BOTH("~(1 $+[1 1] 3)")) == "{1 2 3}"
+    assert str(RUN_BOTH("Eval['+[1 2]]")) == "3"
+
+def test_compiled_closures():
+    RUN("Defn[adder[n] Fn['(x) +[x n]]]")
+    assert str(RUN_BOTH("adder[10][5]")) == "15"
+    assert str(RUN_BOTH("Apply[adder[1] {2}]")) == "3"
+
+def test_compiled_fib():
+    RUN("""
+    Defn[fib[n]
+        If[Or[=[n 0] =[n 1]]
+           n
+           +[fib[Dec[n]] fib[-[n 2]]]]]
+    """)
+    assert str(RUN_BOTH("fib[15]")) == "610"
+
+def test_lexical_scoping():
+    RUN("Def[depth 'global]")
+    assert str(RUN_BOTH("Let['(a 1) Let['(b 2) Let['(c 3) +[a b c]]]]")) == "6"
+    assert str(RUN_BOTH("Let['(depth 'local) Fn['() depth]][]")) == "local"
+    assert str(RUN_BOTH("Fn['() depth][]")) == "global"
+
+def test_local_definitions():
+    RUN("""
+    Defn[parity[n]
+        Do[Defn[ev?[k] If[=[k 0] :T od?[Dec[k]]]]
+           Defn[od?[k] If[=[k 0] :F ev?[Dec[k]]]]
+           ev?[n]]]
+    """)
+    assert str(RUN_BOTH("parity[10]")) == ":T"
+    assert str(RUN_BOTH("parity[7]")) == ":F"
+
+def test_closure_set_bang():
+    RUN("""
+    Defn[counter[]
+        Let['(n 0) Fn['() Set![n Inc[n]]]]]
+    """)
+    assert str(RUN_BOTH("Let['(c counter[]) Do[c[] c[] c[]]]")) == "3"
+
+def test_deep_closures():
+    source = """
+    Let['(a 1) Let['(b 2) Let['(c 3) Let['(d 4)
+        Let['(bump Fn['() Let['(e 5) Do[Set![a +[a e]] Set![b Inc[b]] a]]])
+            Do[bump[] bump[] +[a b c d]]]]]]]
+    """
+    assert str(RUN_BOTH(source)) == "22"
+    assert str(RUN_VM(source)) == "22"
+
+def test_eval_sees_locals():
+    assert str(RUN_BOTH("Let['(x 5) Eval['*[x x]]]")) == "25"
+    assert str(RUN_BOTH("Let['(x 5) Do[Eval['Def[y 2]] Eval['+[x y]]]]")) == "7"
+
+    # Defined by `Eval` after the body referring to them was compiled
+    source = """
+    Defn[eval-def[]
+        Do[Eval['Def[eval-q 7]] Set![eval-q Inc[eval-q]] eval-q]]
+    """
+    RUN(source)
+    assert str(RUN_BOTH("eval-def[]")) == "8"
+    assert str(RUN_VM(source + "eval-def[]")) == "8"
+
+def test_tail_calls_run_in_constant_stack():
+    RUN("""
+    Defn[count[n acc]
+        If[=[n 0]
+           acc
+           count[Dec[n] Inc[acc]]]]
+    """)
+    assert str(RUN("count[1000000 0]")) == "1000000"
+
+def test_tail_calls_through_special_forms():
+    RUN("""
+    Defn[loop[n]
+        Let['(m Dec[n])
+            Do[Or[And[=[m 0] 'done]
+                  loop[m]]]]]
+    """)
+    assert str(RUN("loop[100000]")) == "done"
+    assert str(RUN_BOTH("loop[10]")) == "done"
+
+def test_symbols_and_keywords_are_interned():
+    assert AST.Symbol("x") is AST.Symbol("x")
+    assert AST.Keyword(":T") is AST.TRUE
+    assert AST.Symbol(":T") is not AST.TRUE
+    assert AST.SExpression() is AST.NIL
+    assert RUN("'foo") is AST.Symbol("foo")
+    assert RUN("=[1 2]") is AST.FALSE
+    assert RUN("Body[{1}]") is AST.NIL
+
+def test_exact_numbers():
+    assert type(RUN("+[1 2]").value) is int
+    assert type(RUN("*[2 Inc[3]]").value) is int
+    assert RUN("/[10 5 2]").value == 1 and type(RUN("/[10 5 2]").value) is int
+    assert RUN("/[1 4]").value == Decimal("0.25")
+    assert RUN("+[0.5 1]").value == Decimal("1.5")
+    assert RUN("=[4 +[2 2] *[2 2]]") is AST.TRUE
+    assert RUN("=[3 3 100]") is AST.FALSE
+
+def test_float_numbers():
+    float_lexer = type(lexer)(numeric="float")
+    [ast] = parser.parse(float_lexer.tokenize("/[1 4]"))
+    assert execute(ast).value == 0.25
+    assert type(execute(ast).value) is float
+
+def RUN_FLOAT(source):
+    float_lexer = type(lexer)(numeric="float")
+    res = None
+    for ast in parser.parse(float_lexer.tokenize(source)):
+        res = execute(ast)
+    return res
+
+def test_float_mode_counts(tmp_path):
+    data = tmp_path / "data.txt"
+    data.write_text("alpha\nbeta")
+    assert str(RUN_FLOAT("Range[1 7 2]")) == "{1 3 5}"
+    assert str(RUN_FLOAT("Take[2 Range[]]")) == "{0 1}"
+    assert str(RUN_FLOAT("Drop[1 '(a b)]")) == "{b}"
+    assert str(RUN_FLOAT("VSlice[Vec[1 2 3] 1]")) == "Vec[2.0 3.0]"
+    assert str(RUN_FLOAT("PMap[Fn['(x) *[x 2]] '(1 2 3) 2]")) == \
+        "{2.0 4.0 6.0}"
+    assert str(RUN_FLOAT(f"ReadChunks[\"{data}\" 6]")) == \
+        "{'alpha\\n' 'beta'}"
+    RUN_FLOAT("Def[memo-inc Memo[Fn['(x) Inc[x]] 2]] memo-inc[1]")
+    assert str(RUN_FLOAT("MemoStats[memo-inc]")) == \
+        "{:hits 0 :misses 1 :entries 1 :size 2}"
+    with pytest.raises(AssertionError):
+        RUN_FLOAT("Range[1.5]")
+
+def RUN_VM(source, env=environment):
+    res = None
+    for ast in parser.parse(lexer.tokenize(source)):
+        res = vm.run(vm.compile_vm(ast), env)
+    return res
+
+def test_vm_matches_compiled():
+    sources = [
+        "+[1 2 3]",
+        "Let['(x 2 y 3) *[x y]]",
+        "Do[Def[vm-a 1] Set![vm-a +[vm-a 1]] vm-a]",
+        "If[=[1 2] 'yes 'no]",
+        "And[:T Or[Nil 3]]",
+        "And[:T Nil 3]",
+        "~(1 $+[1 1] 3)",
+        "Let['(x 5) Eval['*[x x]]]",
+        "Let['(n 0) Let['(inc Fn['() Set![n Inc[n]]]) Do[inc[] inc[] n]]]",
+    ]
+    for source in sources:
+        assert str(RUN_VM(source)) == str(RUN(source))
+
+def test_vm_procedures():
+    RUN_VM("""
+    Defn[vm-fib[n]
+        If[Or[=[n 0] =[n 1]]
+           n
+           +[vm-fib[Dec[n]] vm-fib[-[n 2]]]]]
+    Defn[vm-count[n acc]
+        If[=[n 0] acc vm-count[Dec[n] Inc[acc]]]]
+    """)
+    assert str(RUN_VM("vm-fib[15]")) == "610"
+    assert str(RUN("vm-fib[15]")) == "610"
+    assert str(RUN_VM("vm-count[100000 0]")) == "100000"
+    assert str(RUN_VM("Apply[vm-fib {10}]")) == "55"
+
+def test_vm_disassembly():
+    listing = vm.disassemble(vm.compile_vm(parser.parse(lexer.tokenize(
+        "Defn[sq[x] sq-of[x x]]"))[0]))
+    assert "MAKE_PROC" in listing
+    assert "TAIL_CALL" in listing
+
+    # Calls to known builtins skip the generic call
+    listing = vm.disassemble(vm.compile_vm(parser.parse(lexer.tokenize(
+        "Defn[sq[x] *[x x]]"))[0]))
+    assert "BUILTIN_ON" in listing
+    assert "CALLABLE" not in listing
+    listing = vm.disassemble(vm.compile_vm(parser.parse(lexer.tokenize(
+        "Defn[cube[x] *[x sq[x]]]"))[0]))
+    assert "CALL_BUILTIN" in listing
+
+def test_vm_builtin_rebound():
+    RUN("Def[vm-plus +]")
+    RUN_VM("Defn[vm-add[a b] vm-plus[a b]] Defn[vm-inc[a] vm-plus[Inc[a] 1]]")
+    assert str(RUN_VM("List[vm-add[1 2] vm-inc[1]]")) == "{3 3}"
+    RUN("Set![vm-plus Fn['(a b) List[a b]]]")
+    assert str(RUN_VM("List[vm-add[1 2] vm-inc[1]]")) == "{{1 2} {2 1}}"
+
+def test_reader_yields_forms_as_they_complete():
+    import io
+    from reader import read_forms
+
+    source = io.StringIO('Def[s "two\nlines"]\n+[1\n2]\nInc\n[1] \'x\n(a b)')
+    forms = [str(f) for f in read_forms(source, lexer, parser)]
+    assert forms == ["{Def s 'two\\nlines'}", "{+ 1 2}", "{Inc 1}",
+                     "{Quote x}", "{a b}"]
+
+    read = []
+    def lines():
+        for line in ["+[1 2]\n", "+[3 4]\n"]:
+            read.append(line)
+            yield line
+        raise AssertionError("read past the end")
+
+    forms = read_forms(lines(), lexer, parser)
+    assert str(next(forms)) == "{+ 1 2}"
+    assert read == ["+[1 2]\n", "+[3 4]\n"]
+
+    # Typed in, a form is read as soon as the line ending it is
+    read.clear()
+    forms = read_forms(lines(), lexer, parser, interactive=True)
+    assert str(next(forms)) == "{+ 1 2}"
+    assert read == ["+[1 2]\n"]
+    assert str(next(forms)) == "{+ 3 4}"
+    assert read == ["+[1 2]\n", "+[3 4]\n"]
+    source = io.StringIO("Inc\n(1) '\nx +[1\n2]\n")
+    forms = [str(f) for f in read_forms(source, lexer, parser, True)]
+    assert forms == ["Inc", "{1}", "{Quote x}", "{+ 1 2}"]
+
+def test_body_shares_the_list():
+    from AST import SExpression, Number
+
+    xs = SExpression(*map(Number, range(5)))
+    rest = xs.rest().rest()
+    assert rest.items is xs.items
+    assert rest == SExpression(Number(2), Number(3), Number(4))
+    assert len(rest) == 3 and rest[0] == Number(2) and rest[-1] == Number(4)
+    assert str(rest) == "{2 3 4}"
+    assert rest.rest().rest().rest() is AST.NIL
+
+    RUN("""
+    Defn[walk-len[xs n] If[=[xs '()] n walk-len[Body[xs] Inc[n]]]]
+    """)
+    environment.declare(AST.Symbol("long-list"))
+    environment[AST.Symbol("long-list")] = \
+        SExpression(*map(Number, range(100000)))
+    assert str(RUN("walk-len[long-list 0]")) == "100000"
+    assert str(RUN("Body[Body[{1 2 3}]]")) == "{3}"
+    assert str(RUN("Body[{}]")) == "{}"
+
+def test_memoized_procedures():
+    RUN("""
+    Defmemo[memo-fib[n]
+        If[Or[=[n 0] =[n 1]]
+           n
+           +[memo-fib[Dec[n]] memo-fib[-[n 2]]]]]
+    """)
+    assert str(RUN("memo-fib[80]")) == "23416728348467685"
+    assert str(RUN("MemoStats[memo-fib]")) == \
+        "{:hits 78 :misses 81 :entries 81 :size 1024}"
+
+    RUN("""
+    Defn[list-len[xs] If[=[xs Nil] 0 Inc[list-len[Body[xs]]]]]
+    Def[memo-len Memo[list-len 2]]
+    """)
+    RUN("memo-len['(a b)] memo-len[List['a 'b]] memo-len['(c)] memo-len['()]")
+    assert str(RUN("MemoStats[memo-len]")) == \
+        "{:hits 1 :misses 3 :entries 2 :size 2}"
+
+    assert hash(RUN("'(1 (2 \"x\") :k)")) == hash(RUN("List[1 '(2 \"x\") :k]"))
+
+def test_vectors():
+    RUN("Def[vec Vec[1 2 3 4]]")
+    assert str(RUN("VSum[vec]")) == "10"
+    assert str(RUN("Dot[vec Vec['(4 3 2 1)]]")) == "20"
+    assert str(RUN("VMap[* vec 2]")) == "Vec[2 4 6 8]"
+    assert str(RUN("VMap[+ vec vec]")) == "Vec[2 4 6 8]"
+    assert str(RUN("VMap[/ vec 2]")) == "Vec[0.5 1.0 1.5 2.0]"
+    assert str(RUN("VMap[Fn['(x) -[x 1]] vec]")) == "Vec[0 1 2 3]"
+    assert str(RUN("Head[vec]")) == "1"
+    assert str(RUN("Body[Body[vec]]")) == "Vec[3 4]"
+    assert str(RUN("Apply[List vec]")) == "{1 2 3 4}"
+    assert RUN("=[vec '(1 2 3 4)]") == AST.TRUE
+    assert RUN("=['(1 2 3 4) vec]") == AST.TRUE
+    assert RUN("=[vec Vec[1 2 3]]") == AST.FALSE
+    assert hash(RUN("vec")) == hash(RUN("'(1 2 3 4)"))
+
+    sliced = RUN("VSlice[vec 1 3]")
+    assert str(sliced) == "Vec[2 3]"
+    assert sliced.data.obj is RUN("vec").data.obj
+
+def test_vectors_mix_with_literals():
+    assert str(RUN("+[Head[Vec[1.5 2]] 0.5]")) == "2.0"
+    assert str(RUN("Reduce[+ 0.5 Vec[1.5 2]]")) == "4.0"
+    assert str(RUN("Map[Fn['(x) +[x 0.5]] Vec[1.5 2.5]]")) == "{2.0 3.0}"
+    assert str(RUN("+[Dot[Vec[1 2] Vec[0.5 0.5]] 0.5]")) == "2.0"
+    assert str(RUN("VMap[+ Vec[1.5 2] 0.5]")) == "Vec[2.0 2.5]"
+    assert RUN("=[Head[Vec[0.1]] 0.1]") == AST.TRUE
+    assert RUN("<[Head[Vec[0.1]] 0.2]") == AST.TRUE
+    with pytest.raises(AssertionError, match="64 bits"):
+        RUN("Vec[100000000000000000000 1]")
+
+def test_sequence_builtins():
+    assert str(RUN("Range[5]")) == "{0 1 2 3 4}"
+    assert str(RUN("Range[2 10 3]")) == "{2 5 8}"
+    assert str(RUN("Map[Inc '(1 2 3)]")) == "{2 3 4}"
+    assert str(RUN("Map[+ '(1 2) Vec[10 20]]")) == "{11 22}"
+    assert str(RUN("Map[Fn['(x) List[x]] '(a b)]")) == "{{a} {b}}"
+    assert str(RUN("Filter[Fn['(x) Not[=[x 2]]] Range[4]]")) == "{0 1 3}"
+    assert str(RUN("Reduce[+ Range[101]]")) == "5050"
+    assert str(RUN("Reduce[* 2 '(3 4)]")) == "24"
+    assert str(RUN("Reduce[Fn['(a b) List[b a]] '(1 2 3)]")) == "{3 {2 1}}"
+    assert str(RUN("Reduce[+ 0 '()]")) == "0"
+    with pytest.raises(AssertionError):
+        RUN("Map[Inc '(1) '(2)]")
+
+def test_lazy_sequences():
+    assert str(RUN("Take[3 Range[]]")) == "{0 1 2}"
+    assert str(RUN("Take[3 Drop[5 Range[]]]")) == "{5 6 7}"
+    assert str(RUN("Take[4 Iterate[Fn['(x) *[x 2]] 1]]")) == "{1 2 4 8}"
+    assert str(RUN("Take[3 Filter[Fn['(x) Not[=[x 1]]] Map[Inc Range[]]]]")) \
+        == "{2 3 4}"
+    assert str(RUN("Head[Body[Body[Range[]]]]")) == "2"
+    assert RUN("=[Take[2 Range[]] '(0 1)]") == AST.TRUE
+    assert RUN("=[Body[Take[1 Range[]]] Nil]") == AST.TRUE
+    assert str(RUN("Drop[1 '(1 2 3)]")) == "{2 3}"
+
+    # Only as much as is consumed is computed, and only once
+    RUN("""
+    Def[calls 0]
+    Def[counted Map[Fn['(x) Do[Set![calls Inc[calls]] x]] Range[]]]
+    """)
+    assert str(RUN("Take[3 counted]")) == "{0 1 2}"
+    assert str(RUN("Head[Body[counted]]")) == "1"
+    assert str(RUN("calls")) == "3"
+
+def test_lazy_pipeline_runs_in_flat_memory():
+    import resource
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert str(RUN("Reduce[+ Take[10000000 Drop[1 Range[]]]]")) == \
+        "50000005000000"
+    grown_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    assert grown_kb < 50000
+
+def test_used_up_sequences_are_false():
+    RUN("Defn[seq-len[xs n] If[xs seq-len[Body[xs] Inc[n]] n]]")
+    assert str(RUN_BOTH("seq-len[Take[3 Range[]] 0]")) == "3"
+    assert str(RUN_BOTH("seq-len[Drop[2 Take[5 Range[]]] 0]")) == "3"
+    small = "Filter[Fn['(x) <[x 2]] Take[5 Range[]]]"
+    assert str(RUN_BOTH(f"seq-len[{small} 0]")) == "2"
+    assert str(RUN_BOTH("If[Take[0 Range[]] 'yes 'no]")) == "no"
+    assert str(RUN_BOTH("If[Drop[3 Take[3 Range[]]] 'yes 'no]")) == "no"
+    assert str(RUN_BOTH("If[Body[Take[1 Range[]]] 'yes 'no]")) == "no"
+    assert str(RUN_VM("If[Take[0 Range[]] 'yes 'no]")) == "no"
+    assert str(RUN_BOTH("Not[Take[0 Range[]]]")) == ":T"
+
+    # A sequence held by a variable keeps its items for later walks, even
+    # when a pipeline of builtins reads it
+    RUN("Def[held Map[Inc Range[]]]")
+    assert str(RUN("Reduce[+ Take[3 Filter[Fn['(x) :T] held]]]")) == "6"
+    assert str(RUN("Take[4 held]")) == "{1 2 3 4}"
+
+def test_profiler():
+    import profiler
+
+    RUN("""
+    Defn[prof-fib[n]
+        If[Or[=[n 0] =[n 1]]
+           n
+           +[prof-fib[Dec[n]] prof-fib[-[n 2]]]]]
+    """)
+    profile = profiler.enable(environment)
+    try:
+        assert str(RUN("prof-fib[10]")) == "55"
+    finally:
+        profiler.disable()
+
+    assert profile.stats["prof-fib"].calls == 177
+    assert profile.stats["+"].calls == 88
+    assert profile.stats["prof-fib"].cumulative_ns >= \
+        profile.stats["prof-fib"].self_ns
+    assert "\nprof-fib;prof-fib;Dec " in profile.collapsed()
+    assert Procedure.apply is not Procedure.apply_memoized
+
+def test_comparisons():
+    assert RUN("<[1 2 3]") == AST.TRUE
+    assert RUN("<[1 3 2]") == AST.FALSE
+    assert RUN(">[3 2.5 0]") == AST.TRUE
+    assert RUN(">[1 1]") == AST.FALSE
+
+def test_pmap():
+    import pickle
+    from env import Env
+
+    RUN("""
+    Def[offset 100]
+    Defn[pmap-fib[n] If[<[n 2] n +[pmap-fib[Dec[n]] pmap-fib[-[n 2]]]]]
+    Defn[pmap-job[n] +[pmap-fib[n] offset]]
+    """)
+    assert str(RUN("PMap[pmap-job Range[10]]")) == \
+        "{100 101 101 102 103 105 108 113 121 134}"
+    assert str(RUN("PMap[Let['(m 3) Fn['(x) *[x m]]] Vec[1 2 3] 2]")) == \
+        "{3 6 9}"
+    assert str(RUN("PMap[Fn['(x) List[x \"s\" :k]] '(1 2)]")) == \
+        "{{1 's' :k} {2 's' :k}}"
+
+    # Definitions in a child environment, next to ones that can't be sent
+    session = Env(parent=environment)
+    RUN("""
+    Def[scale 10] Defn[scaled[x] *[x scale]] Def[plus +]
+    Def[pending Map[Inc Range[]]]
+    """, session)
+    assert str(RUN("PMap[scaled '(1 2 3)]", session)) == "{10 20 30}"
+    assert str(RUN("PMap[Let['(m 3) Fn['(x) plus[scaled[x] m]]] '(1 2)]",
+                   session)) == "{13 23}"
+
+    # Globals named like the procedure's own variables aren't sent
+    RUN("Def[xs Map[Inc Range[]]] Def[ys xs] Def[d xs]", session)
+    assert str(RUN("PMap[Fn['(xs) Inc[xs]] '(1 2 3)]", session)) == "{2 3 4}"
+    source = """
+    PMap[Let['(ys 1)
+             Fn['(x) Do[Def[d 2]
+                        Let['(xs x) Fn['(xs) +[xs ys d]][xs]]]]]
+         '(1 2)]
+    """
+    assert str(RUN(source, session)) == "{4 5}"
+
+    proc, plus = pickle.loads(pickle.dumps(RUN("List[pmap-fib +]")))
+    assert proc.creation_env is environment
+    assert plus is RUN("+")
+    assert str(proc.apply([AST.Number(10)])) == "55"
+
+def test_server(tmp_path):
+    import asyncio
+    import json
+    import server
+
+    address = str(tmp_path / "misp.sock")
+    srv = server.Server(execute, lambda source: parser.parse(lexer.tokenize(source)),
+                        environment, timeout=0.5)
+
+    async def talk():
+        listener = await srv.start(address)
+        async with listener:
+            a = await asyncio.open_unix_connection(address)
+            b = await asyncio.open_unix_connection(address)
+
+            async def ask(client, source):
+                reader, writer = client
+                writer.write(source.encode() + b"\n")
+                await writer.drain()
+                return (await reader.readline()).decode().rstrip("\n")
+
+            replies = [
+                await ask(a, "Def[served 1] +[served 2]"),
+                await ask(b, "served"),
+                await ask(b, "Set![+ 1]"),
+                await ask(a, "Defn[spin[] spin[]] spin[]"),
+                await ask(a, "+[served 1]"),
+            ]
+            metrics = json.loads(await ask(b, server.METRICS_COMMAND))
+            for _, writer in (a, b):
+                writer.close()
+            return replies, metrics
+
+    replies, metrics = asyncio.run(talk())
+    assert replies[0] == "--> 3"
+    assert replies[1].startswith("ERROR: ")
+    assert "read-only" in replies[2]
+    assert replies[3] == "ERROR: timed out after 0.5s"
+    assert replies[4] == "--> 2"
+    assert metrics["requests"] == 5
+    assert metrics["timeouts"] == 1
+    assert metrics["errors"] == 3
+    assert metrics["sessions"] == 2
+    assert "served" not in environment.locals
+
+def test_images(tmp_path):
+    import image
+    from env import Env
+
+    # The global environment holds lazy sequences, which can't be saved
+    library = Env(parent=environment)
+    RUN("""
+    Defn[square[x] *[x x]]
+    Def[counter Let['(n 0) Fn['() Set![n Inc[n]]]]]
+    Def[data List[:k "s" 1.5 Vec[1 2]]]
+    Def[plus +]
+    """, library)
+    path = tmp_path / "lib.img"
+    image.dump(path, library)
+
+    env = Env(parent=environment)
+    image.load(path, env)
+    assert str(RUN("square[7]", env)) == "49"
+    assert str(RUN("List[counter[] counter[]]", env)) == "{1 2}"
+    assert str(RUN("data", env)) == "{:k 's' 1.5 Vec[1 2]}"
+    assert RUN("data", env)[0] is AST.Keyword(":k")
+    assert RUN("plus", env) is RUN("+")
+    assert RUN("square", env).creation_env is env
+
+    RUN("Def[lazy Map[Fn['(x) x] Range[]]]", library)
+    with pytest.raises(image.ImageError, match="'lazy'"):
+        image.dump(path, library)
+
+    stale = path.read_bytes().replace(image.signature(), bytes(20))
+    path.write_bytes(stale)
+    with pytest.raises(image.ImageError):
+        image.load(path, env)
+
+def test_macros():
+    RUN("""
+    Def[expansions 0]
+    Defmacro[twice[x] Do[Set![expansions Inc[expansions]] ~Do[$x $x]]]
+    Defmacro[unless[c x y] ~If[$c $y $x]]
+    Def[ticks 0]
+    Defn[tick-loop[n]
+        unless[=[n 0] Do[twice[Set![ticks Inc[ticks]]] tick-loop[Dec[n]]] ticks]]
+    """)
+    assert str(RUN("tick-loop[3000]")) == "6000" # Expanded in tail position
+    assert str(RUN("expansions")) == "1" # Once for the call site
+
+    assert str(RUN("MacroExpand['unless[c x y]]")) == "{If c y x}"
+    assert str(RUN("MacroExpand['List[c]]")) == "{List c}"
+
+    # Procedures defined before the macro expand it when first run
+    assert str(RUN("""
+    Defn[swapped[a b] Do[swap![a b] List[a b]]]
+    Defmacro[swap![a b] ~Let['(tmp $a) Do[Set![$a $b] Set![$b tmp]]]]
+    swapped[1 2]
+    """)) == "{2 1}"
+    assert str(RUN_BOTH("unless[:F 1 2]")) == "1"
+
+    vm.run(vm.compile_vm(parser.parse(lexer.tokenize(
+        "Defn[vm-loop[n] unless[=[n 0] vm-loop[Dec[n]] :done]]"))[0]),
+        environment)
+    code = vm.compile_vm(parser.parse(lexer.tokenize("vm-loop[3000]"))[0])
+    assert str(vm.run(code, environment)) == ":done"
+
+def test_quasiquote_templates():
+    assert str(RUN_BOTH("~(a (b c) $+[1 2] (d $@List[1 2] e))")) == \
+        "{a {b c} 3 {d 1 2 e}}"
+    assert str(RUN_BOTH("Let['(xs '(1 2)) ~(f $@xs $@'() $xs ~(g $xs))]")) == \
+        "{f 1 2 {1 2} {Quasiquote {g {Unquote xs}}}}"
+    assert str(RUN_BOTH("~(v $@Vec[1 2])")) == "{v 1 2}"
+    assert str(RUN_VM("Let['(x 1) ~(a (b) $x)]")) == "{a {b} 1}"
+
+    # Only the lists leading to a hole are rebuilt
+    RUN("Defn[qq-page[x] ~(page (head (title t)) (body (p $x)))]")
+    first, second = RUN("qq-page[1]"), RUN("qq-page[2]")
+    assert str(second) == "{page {head {title t}} {body {p 2}}}"
+    assert first[1] is second[1]
+    assert first[2] is not second[2]
+
+    with pytest.raises(AssertionError, match="inside a list"):
+        RUN("~$@'(1)")
+
+def test_builtin_calls_checked_when_compiled():
+    from env import Env
+
+    # Reported when `bad` is defined, not when it is called
+    with pytest.raises(AssertionError, match="Expected at least 2, got 1"):
+        RUN("Defn[bad-plus[] +[1]]")
+    with pytest.raises(AssertionError, match="must all be numbers"):
+        RUN("Defn[bad-inc[] Inc[\"a\"]]")
+    with pytest.raises(AssertionError, match="Expected 1, got 2"):
+        RUN_VM("Head['(1) '(2)]")
+
+    assert str(RUN_BOTH("Let['(+ -) +[5 1]]")) == "4"
+    env = Env(parent=environment)
+    RUN("Def[Inc Dec]", env)
+    assert str(RUN("Inc[1]", env)) == "0"
+    assert str(RUN_BOTH("+[Inc[1] Head['(3 4)]]")) == "5"
+    with pytest.raises(AssertionError, match="must be a procedure"):
+        RUN("Map[Def '(1 2)]")
+
+def test_macro_arguments_are_not_checked():
+    RUN("""
+    Defmacro[quoted[x] ~'$x]
+    Defmacro[ignore[x] 1]
+    Defn[uses-macros[] List[quoted[+[1]] quoted[Head[1 2]] ignore[Inc["a"]]]]
+    Defn[uses-later[] later[+[1]]]
+    Defmacro[later[x] ~'$x]
+    """)
+    for source in ["quoted[+[1]]", "quoted[Head[1 2]]", "ignore[Inc[\"a\"]]",
+                   "uses-macros[]", "uses-later[]"]:
+        walked = RUN_BOTH(source)
+        assert str(RUN_VM(source)) == str(walked)
+    assert str(RUN("uses-macros[]")) == "{{+ 1} {Head 1 2} 1}"
+
+    # Still reported, once run, if the head isn't a macro after all
+    RUN("Defn[not-macro[x] x] Defn[calls-it[] not-macro[+[1]]]")
+    with pytest.raises(AssertionError, match="Expected at least 2, got 1"):
+        RUN("calls-it[]")
+
+def test_special_form_arguments_are_not_checked():
+    def walked(source, env=environment):
+        Procedure.tree_walk = True
+        try:
+            for ast in parser.parse(lexer.tokenize(source)):
+                res = ast.evaluate(env)
+        finally:
+            Procedure.tree_walk = False
+        return res
+
+    # The macros shadow builtins taking one argument
+    source = """
+    Defmacro[Dec[a b] ~List[$a $b]] Defmacro[Inc[a b] ~List[$b $a]]
+    List[Dec[1 2] Inc[1 2]]
+    """
+    names = [AST.Symbol("Dec"), AST.Symbol("Inc")]
+    builtins = [environment[name] for name in names]
+    try:
+        for run in (RUN, RUN_VM, walked):
+            assert str(run(source)) == "{{1 2} {2 1}}"
+            for name, builtin in zip(names, builtins):
+                environment[name] = builtin
+    finally:
+        for name, builtin in zip(names, builtins):
+            environment[name] = builtin
+
+def RUN_OPTIMIZED(source, env=environment):
+    import misp
+    misp.optimize = True
+    try:
+        return RUN(source, env)
+    finally:
+        misp.optimize = False
+
+def test_optimizer():
+    from env import Env
+    import optimizer
+
+    def optimized(source, env=environment):
+        [ast] = parser.parse(lexer.tokenize(source))
+        return optimizer.optimize(ast, env)
+
+    folded = optimized("*[2 +[1 2] Inc[0]]")
+    assert type(folded) is AST.Guarded and str(folded.optimized) == "6"
+    assert str(optimized("If[<[2 1] 'a Or[:F 'b]]").optimized) == "{Quote b}"
+    assert str(optimized("And[:T x :F y]")) == "{And x :F}"
+    assert str(optimized("'+[1 2]")) == "{Quote {+ 1 2}}"
+
+    env = Env(parent=environment)
+    RUN("""
+    Defn[sq[x] *[x x]]
+    Defn[hyp[a b] +[sq[a] sq[b]]]
+    Defn[count[n] If[=[n 0] 0 count[-[n 1]]]]
+    """, env)
+    assert str(optimized("hyp[x 4]", env)) == \
+        "{Let {Quote {a x}} {+ {* a a} 16}}"
+    assert str(optimized("hyp[3 4]", env)) == "25"
+    assert str(optimized("count[3]", env)) == "{count 3}" # Recursive
+
+    # Variables given for parameters the body doesn't always use are
+    # still looked up, and fail if they are unbound
+    RUN("Defn[k[x] 1] Defn[twice[x] +[x x]] Defn[pick[x y] If[x 1 y]]", env)
+    assert str(optimized("twice[y]", env).optimized) == "{+ y y}"
+    assert str(optimized("k[undefined]", env).optimized) == \
+        "{Let {Quote {x undefined}} 1}"
+    for source in ["k[undefined]", "pick[:T undefined]"]:
+        for run in (RUN, RUN_OPTIMIZED):
+            with pytest.raises(KeyError, match="undefined"):
+                run(source, env)
+
+    # An argument redefining what a later one was inlined with
+    source = """
+    Defn[g[] 1] Defn[redef[] Do[Set![g Fn['() 2]] 0]] Defn[h2[a b] +[a b]]
+    h2[redef[] g[]]
+    """
+    assert str(RUN(source, Env(parent=environment))) == "2"
+    assert str(RUN_OPTIMIZED(source, Env(parent=environment))) == "2"
+
+    source = """
+    Defn[sq[x] *[x x]]
+    Defn[hyp[a b] +[sq[a] sq[b]]]
+    Defn[norm[v] hyp[Head[v] Head[Body[v]]]]
+    Def[results List[norm['(3 4)] hyp[1 2] If[:T sq[3] undefined]]]
+    Defn[sq[x] +[x x]]
+    Def[before List[norm['(3 4)] hyp[2 5] *[2 3]]]
+    Def[* -]
+    List[results before norm['(3 4)] *[2 3]]
+    """
+    # The calls made after a redefinition see it
+    expected = "{{25 5 9} {14 14 6} 14 -1}"
+    assert str(RUN(source, Env(parent=environment))) == expected
+    assert str(RUN_OPTIMIZED(source, Env(parent=environment))) == expected
+    import misp
+    misp.use_vm = True
+    try:
+        assert str(RUN_OPTIMIZED(source, Env(parent=environment))) == expected
+    finally:
+        misp.use_vm = False
+
+def test_nodes_have_no_dict():
+    import pickle
+    from env import Env, Frame
+    from scope import Scope
+
+    proc = RUN("Fn['(x) '(1 \"s\" :k 2.5)]")
+    values = [RUN("'(1 \"s\" :k 2.5 x)"), proc, RUN("+"), AST.Vec.pack([1]),
+              environment, Frame(Scope([]), [], environment)]
+    values += list(proc.body[1])
+    for value in values:
+        assert not hasattr(value, "__dict__"), type(value)
+
+    assert AST.Number(1) == AST.Number(1) and AST.Number(1) != AST.String(1)
+    assert RUN("'(1 (\"s\"))") == RUN("'(1 (\"s\"))")
+    copy = pickle.loads(pickle.dumps(proc))
+    assert copy.code is None and copy.body == proc.body
+    assert str(copy.apply([AST.Number(0)])) == "{1 's' :k 2.5}"
+
+def test_dicts():
+    import pickle
+
+    RUN("Def[dict #{:a 1 \"b\" 2 {1 :x} 3 2.5 :c}]")
+    assert str(RUN("dict")) == "#{'b' 2 2.5 :c :a 1 {1 :x} 3}"
+    assert str(RUN("Get[dict :a]")) == "1"
+    assert str(RUN("Get[dict \"b\"]")) == "2"
+    assert str(RUN("Get[dict List[1 :x]]")) == "3"
+    assert str(RUN("Get[dict 2.50]")) == ":c"
+    assert RUN("Get[dict :missing]") is AST.NIL
+    assert str(RUN("Get[dict :missing 0]")) == "0"
+    assert RUN("Contains?[dict :a]") == AST.TRUE
+    assert RUN("Contains?[dict :missing]") == AST.FALSE
+    assert sorted(map(str, RUN("Keys[dict]"))) == \
+        sorted(["'b'", "2.5", ":a", "{1 :x}"])
+
+    # Updates leave the dict they are made from as it was
+    assert str(RUN("Assoc[dict :a 10 :d 4]")) == \
+        "#{'b' 2 2.5 :c :a 10 :d 4 {1 :x} 3}"
+    assert str(RUN("Dissoc[dict :a \"b\" :missing]")) == "#{2.5 :c {1 :x} 3}"
+    assert str(RUN("Get[dict :a]")) == "1"
+    assert RUN("=[dict Dict[:a 1 \"b\" 2 '(1 :x) 3 2.5 :c]]") == AST.TRUE
+    assert RUN("=[dict Assoc[dict :a 2]]") == AST.FALSE
+    assert str(RUN("Type[#{}]")) == ":Dict"
+    assert str(RUN_VM("Get[Assoc[dict :e 5] :e]")) == "5"
+
+    RUN("""
+    Defn[fill[d i] If[=[i 0] d fill[Assoc[d i *[i i]] -[i 1]]]]
+    Def[squares fill[Dict[] 2000]]
+    """)
+    assert len(RUN("squares")) == 2000
+    assert str(RUN("Get[squares 1234]")) == "1522756"
+    assert len(RUN("Dissoc[squares 1 2 3]")) == 1997
+    assert pickle.loads(pickle.dumps(RUN("squares"))) == RUN("squares")
+
+    with pytest.raises(AssertionError, match="in pairs"):
+        RUN("Dict[:a 1 :b]")
+    with pytest.raises(AssertionError, match="must be a dict"):
+        RUN("Get['(1 2) 1]")
+    with pytest.raises(AssertionError, match="hashable"):
+        RUN("Assoc[dict Fn['() 1] 1]")
+
+def test_file_io(tmp_path):
+    import tracemalloc
+
+    data = tmp_path / "data.txt"
+    copy = tmp_path / "copy.txt"
+    data.write_text("alpha\nbeta\ngamma")
+    RUN(f"Def[data \"{data}\"] Def[copy \"{copy}\"]")
+
+    assert str(RUN("OpenLines[data]")) == "{'alpha' 'beta' 'gamma'}"
+    assert str(RUN("ReadChunks[data 6]")) == "{'alpha\\n' 'beta\\ng' 'amma'}"
+    lines = "Map[Fn['(l) List[l 1]] OpenLines[data]]"
+    assert str(RUN(f"WriteLines[copy {lines}]")) == "3"
+    assert copy.read_text() == "{'alpha' 1}\n{'beta' 1}\n{'gamma' 1}\n"
+
+    mapped = RUN("MapFile[data]")
+    assert str(RUN("VSlice[MapFile[data] 0 3]")) == "Vec[97 108 112]"
+    assert bytes(mapped.data) == data.read_bytes()
+    (tmp_path / "empty").write_text("")
+    assert len(RUN(f"MapFile[\"{tmp_path / 'empty'}\"]")) == 0
 
+    # Files opened in `With-File` are closed once it is done
+    count = "Reduce[Fn['(n l) Inc[n]] 0 lines]"
+    assert str(RUN(f"With-File['(lines OpenLines[data]) {count}]")) == "3"
+    assert str(RUN_VM(f"With-File['(lines OpenLines[data]) {count}]")) == "3"
+    escaped = RUN("With-File['(lines OpenLines[data]) lines]")
+    with pytest.raises(AssertionError, match="read after the `With-File`"):
+        list(escaped)
+    RUN("Def[kept Nil]")
+    with pytest.raises(IndexError): # Even when it raises
+        RUN("With-File['(lines OpenLines[data]) Do[Set![kept lines] "
+            "Head['()]]]")
+    with pytest.raises(AssertionError, match="read after the `With-File`"):
+        list(RUN("kept"))
 
+    # Large files stream through in constant memory, unless a variable
+    # holds on to the head of their lines
+    RUN("WriteLines[copy Take[200000 Range[]]]")
+    tracemalloc.start()
+    streamed = "Reduce[Fn['(n l) Inc[n]] 0 OpenLines[copy]]"
+    assert str(RUN(f"With-File['() {streamed}]")) == "200000"
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 1000000
@@ -5,10 +5,11 @@ class Lexer(Lexer):
     tokens = {
         PIPE, NAME, KEYWORD,
         NUM, STR,
-        QUOTE, QUASIQUOTE, UNQUOTE,
+        QUOTE, QUASIQUOTE, UNQUOTE_SPLICING, UNQUOTE,
         LPAREN, RPAREN,
         LBRACK, RBRACK,
-        LBRACE, RBRACE
+        LBRACE, RBRACE,
+        HASHBRACE
     }
     
     ignore = " \t\n\r"
@@ -21,17 +22,29 @@ class Lexer(Lexer):
 
     QUOTE = r"'"
     QUASIQUOTE = r"~"
+    UNQUOTE_SPLICING = r"\$@" # Before `UNQUOTE`, which would match its `$`
     UNQUOTE = r"\$"
 
     LPAREN = r"\("
     RPAREN = r"\)"
     LBRACK = r"\["
     RBRACK = r"\]"
+    HASHBRACE = r"\#\{" # Opens a `Dict` literal, closed by `RBRACE`
     LBRACE = r"\{"
     RBRACE = r"\}"
 
+    def __init__(self, numeric="exact"):
+        # "exact": integer literals become `int`s and the others `Decimal`s
+        # "float": every literal becomes a `float`, for throughput
+        self.numeric = numeric
+
     def NUM(self, t):
-        t.value = Decimal(t.value)
+        if self.numeric == "float":
+            t.value = float(t.value)
+        elif "." in t.value:
+            t.value = Decimal(t.value)
+        else:
+            t.value = int(t.value)
         return t
 
     def STR(self, t):
@@ -1,26 +1,87 @@
-#!/usr/bin/python3.6
+#!/usr/bin/env python3
 
 import argparse as ap
+import sys
 
 from parser import Parser
 from lexer import Lexer
-import prelude
+from proc import Procedure
+from reader import read_forms, parse_form
 
 parser = Parser()
 lexer = Lexer()
 
-environment = prelude.builtins
+# Run top-level forms on the bytecode VM instead of as compiled closures
+use_vm = False
 
-def evaluate(source, debug=True):
+# Rewrite top-level forms with `optimizer` before running them
+optimize = False
+
+_environment = None
+
+def global_env():
+    """
+    Returns the global environment, importing the prelude (which builds
+    all of the builtins) the first time it is needed.
+    """
+    global _environment
+    if _environment is None:
+        import prelude
+        _environment = prelude.builtins
+    return _environment
+
+def __getattr__(name):
+    # Build `misp.environment` on first access, see `global_env`
+    if name == "environment":
+        return global_env()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def execute(ast, env=None):
+    """
+    Evaluates a single parsed top-level form, by compiling it unless the
+    reference tree-walker has been selected.
+    """
+    # Also makes sure the prelude's special forms are registered
+    environment = global_env()
+    env = env if env is not None else environment
+
+    if optimize:
+        import optimizer
+        ast = optimizer.optimize(ast, env)
+    if Procedure.tree_walk:
+        return ast.evaluate(env)
+    if use_vm:
+        import vm
+        return vm.run(vm.compile_vm(ast), env)
+    return ast.compile()(env)
+
+def evaluate(source, debug=True, dis=False):
     source = source.strip()
     ast_list = parser.parse(lexer.tokenize(source))
+    evaluate_forms(ast_list, debug, dis)
+
+def evaluate_stream(lines, debug=True, dis=False, interactive=False):
+    """
+    Evaluates the forms in the stream of lines `lines` (eg. a file) as
+    they are read, rather than reading all of it first. If `interactive`
+    is set, each is evaluated as soon as the line ending it is read (see
+    `read_forms`).
+    """
+    evaluate_forms(read_forms(lines, lexer, parser, interactive), debug, dis)
+
+def evaluate_forms(ast_list, debug=True, dis=False):
     for ast in ast_list:
         if debug:
             print()
             print(repr(ast))
             print()
+        if dis:
+            import vm
+            print()
+            print(vm.disassemble(vm.compile_vm(ast)))
+            print()
         try:
-            res = ast.evaluate(environment)
+            res = execute(ast)
             print("-->", str(res))
         except Exception as e:
             print("ERROR:", str(e))
@@ -31,7 +92,14 @@ if __name__ == "__main__":
         prog="misp",
         description="Executes misp code"
     )
-    argparser.add_argument("filename", nargs="?")
+    argparser.add_argument(
+        "filename", nargs="?",
+        help="the file to run, or `-` to run what is piped to stdin"
+    )
+    argparser.add_argument(
+        "-e", "--eval", metavar="SOURCE",
+        help="runs the code in `SOURCE` instead of a file"
+    )
     argparser.add_argument(
         "-a", "--ast", action="store_true",
         help="prints out the syntax tree of the given expression"
@@ -40,15 +108,98 @@ if __name__ == "__main__":
         "-i", "--interactive", action="store_true",
         help="runs the code in file `filename`, then opens repl"
     )
+    argparser.add_argument(
+        "--tree-walk", action="store_true",
+        help="evaluates with the reference tree-walking interpreter"
+    )
+    argparser.add_argument(
+        "--vm", action="store_true",
+        help="compiles to bytecode and runs it on the virtual machine "
+             "(experimental, and not yet as fast as the default compiler)"
+    )
+    argparser.add_argument(
+        "-d", "--dis", action="store_true",
+        help="prints out the bytecode of the given expression"
+    )
+    argparser.add_argument(
+        "-O", "--optimize", action="store_true",
+        help="folds constants, prunes constant branches and inlines " +
+             "small procedures before running each top-level form"
+    )
+    argparser.add_argument(
+        "--numeric", choices=["exact", "float"], default="exact",
+        help="reads number literals as exact ints/decimals, or as floats"
+    )
+    argparser.add_argument(
+        "--image", metavar="FILE",
+        help="starts with the definitions saved in the image `FILE`"
+    )
+    argparser.add_argument(
+        "--dump-image", metavar="FILE",
+        help="saves the global definitions to the image `FILE` after " +
+             "running `filename`"
+    )
+    argparser.add_argument(
+        "--serve", metavar="ADDRESS",
+        help="serves misp on a Unix socket at path `ADDRESS`, or on " +
+             "port `ADDRESS` of localhost, after running `filename`"
+    )
+    argparser.add_argument(
+        "--timeout", type=float, default=5.0, metavar="SECONDS",
+        help="how long `--serve` lets each request run (default 5)"
+    )
+    argparser.add_argument(
+        "--profile", action="store_true",
+        help="prints the calls to each procedure and builtin, and the " +
+             "time spent in them, to stderr on exit"
+    )
+    argparser.add_argument(
+        "--profile-stacks", metavar="FILE",
+        help="profiles, writing the time spent in each stack of calls " +
+             "to `FILE` in the collapsed format of flamegraph tools"
+    )
 
     args = argparser.parse_args()
+    lexer.numeric = args.numeric
+    use_vm = args.vm
+    optimize = args.optimize
+    Procedure.tree_walk = args.tree_walk
+
+    profile = None
+    if args.profile or args.profile_stacks:
+        import profiler
+        profile = profiler.enable(global_env())
+
+    if args.image:
+        import image
+        try:
+            image.load(args.image)
+        except (OSError, image.ImageError) as e:
+            sys.exit(f"misp: {e}")
+
+    if args.eval is not None:
+        evaluate(args.eval, args.ast, args.dis)
 
-    if args.filename:
+    if args.filename == "-":
+        evaluate_stream(sys.stdin, args.ast, args.dis, sys.stdin.isatty())
+    elif args.filename:
         with open(args.filename, "r") as f:
-            source = "".join(f)
-            evaluate(source, args.ast)
+            evaluate_stream(f, args.ast, args.dis)
 
-    if args.interactive or args.filename is None:
+    if args.dump_image:
+        import image
+        try:
+            image.dump(args.dump_image)
+        except (OSError, image.ImageError) as e:
+            sys.exit(f"misp: {e}")
+
+    if args.serve is not None:
+        import server
+        server.serve(args.serve, execute,
+                     lambda source: parse_form(list(lexer.tokenize(source)),
+                                               parser),
+                     global_env(), args.timeout)
+    elif args.interactive or (args.filename is None and args.eval is None):
         while True:
             try:
                 source = input("::> ")
@@ -56,4 +207,11 @@ if __name__ == "__main__":
                 print("\nExiting...")
                 break
             if source:
-                evaluate(source, args.ast)
+                evaluate(source, args.ast, args.dis)
+
+    if profile is not None:
+        if args.profile:
+            print(profile.report(), file=sys.stderr)
+        if args.profile_stacks:
+            with open(args.profile_stacks, "w") as f:
+                print(profile.collapsed(), file=f)
@@ -0,0 +1,504 @@
+"""
+Rewrites each top-level form before it is run, when misp is run with
+`-O`:
+    calls of pure builtins (see `prelude.PURE`) on constants are folded
+    into their values, eg. `+[1 2]` into `3`
+    the branches of `If`, `And` and `Or` that constant conditions rule
+    out are pruned, eg. `If[:T a b]` into `a`
+    calls of small, non-recursive procedures are replaced by their
+    bodies, with the arguments bound by a `Let`, or substituted for the
+    parameters if they are constants (or variables nothing in the body
+    could assign)
+
+A rewrite that assumes a global is still bound to what it was when the
+form was optimized is wrapped in a `Guarded`, which runs the original
+code instead once the global has been redefined (eg. by `Def`). Globals
+that the form itself defines or assigns are never assumed. Quoted code
+and the arguments of macros and special forms other than those below are
+left as written.
+"""
+
+from AST import (Symbol, Keyword, Number, String, Vec, Dict, SExpression,
+                 Guarded, BuiltIn, Procedure)
+from prelude import PURE, quoted_symbols, quoted_pairs, all_type
+from scope import Scope
+from utils import truthy
+
+# The most nodes a procedure's body can have for calls to it to be inlined
+INLINE_SIZE = 16
+
+# How many inlined bodies deep calls are still inlined
+INLINE_DEPTH = 4
+
+QUOTE = Symbol("Quote")
+QUASIQUOTE = Symbol("Quasiquote")
+LET = Symbol("Let")
+EVAL = Symbol("Eval")
+DO = Symbol("Do")
+BRANCHING = {Symbol("If"), Symbol("And"), Symbol("Or"), Symbol("Do")}
+DEFINING = {Symbol("Def"), Symbol("Set!"), Symbol("Defn"), Symbol("Defmemo"),
+            Symbol("Defmacro")}
+
+# Types of values that evaluate to themselves
+LITERALS = (Number, String, Keyword, Vec, Dict)
+
+
+def optimize(expr, env):
+    """
+    Returns the top-level form `expr` rewritten, to be run in `env`.
+    """
+    return Optimizer(expr, env).guarded(expr, frozenset())
+
+
+# Rewriters for special forms, taking the `Optimizer`, the form and its
+# arguments and the local variables in scope. Each returns the rewritten
+# form along with the globals it assumes, as `Optimizer.optimize` does.
+REWRITES = {}
+
+def rewrites(name):
+    def decorated_fn(f):
+        REWRITES[Symbol(name)] = f
+        return f
+    return decorated_fn
+
+
+class Optimizer:
+    def __init__(self, form, env):
+        self.env = env
+        self.assigned = set() # Globals the form defines or assigns
+        self.procedures = set() # The ones it defines with `Defn`
+        assignments(form, self.assigned, self.procedures)
+        self.inlining = [] # The procedures whose bodies are being inlined
+
+    def optimize(self, expr, locals_):
+        """
+        Returns `expr` rewritten, and a dict of the globals the rewrite
+        assumes to each of their values, which the caller is left to
+        guard. `locals_` are the local variables in scope.
+        """
+        if type(expr) is not SExpression or not expr:
+            return expr, {}
+
+        head, *args = expr
+
+        if type(head) is not Symbol:
+            return expr, {}
+
+        if head in locals_:
+            return self.call(expr, None, args, locals_)
+
+        rewrite = REWRITES.get(head)
+        if rewrite is not None:
+            return rewrite(self, expr, args, locals_)
+
+        if head in self.procedures:
+            return self.call(expr, None, args, locals_)
+
+        fn = self.global_value(head)
+        if type(fn) is Procedure or \
+                (type(fn) is BuiltIn and fn.primitive is not None):
+            return self.call(expr, fn, args, locals_)
+
+        # A special form, a macro, or not yet defined
+        return expr, {}
+
+    def guarded(self, expr, locals_):
+        """
+        Returns `expr` rewritten, guarding any assumptions it makes.
+        """
+        optimized, assumed = self.optimize(expr, locals_)
+        return guard(optimized, assumed, expr)
+
+    def global_value(self, sym):
+        """
+        Returns the value of the global `sym`, or `None` if the form
+        defines or assigns it, or it isn't bound.
+        """
+        if sym in self.assigned:
+            return None
+        try:
+            return self.env[sym]
+        except KeyError:
+            return None
+
+    def call(self, expr, fn, args, locals_):
+        """
+        Rewrites a call to `fn`, the value of the call's head if it is a
+        global, `None` otherwise.
+        """
+        optimized = [self.optimize(arg, locals_) for arg in args]
+
+        if type(fn) is BuiltIn and fn in PURE and \
+                all(is_constant(arg) for arg, _ in optimized):
+            value = fold(fn, [value_of(arg) for arg, _ in optimized], self.env)
+            if value is not None:
+                return value, merged(expr.head(), fn, optimized)
+
+        # The assumptions of an inlined call are checked before any of its
+        # arguments run, so none of them may assign a variable
+        if type(fn) is Procedure and \
+                all(self.pure(arg, ()) for arg in args):
+            inlined = self.inline(fn, [arg for arg, _ in optimized], locals_)
+            if inlined is not None:
+                body, assumed = inlined
+                return body, merged(expr.head(), fn, optimized, assumed)
+
+        new_args = [guard(arg, assumed, original)
+                    for (arg, assumed), original in zip(optimized, args)]
+        return rebuilt(expr, [expr.head()] + new_args), {}
+
+    def inline(self, proc, args, locals_):
+        """
+        Returns the body of `proc` rewritten to run in place of a call to
+        it with the (rewritten) `args`, and the globals it assumes, or
+        `None` if it can't be.
+        """
+        params = proc.formals
+        body = unguarded(proc.body) # Optimized again for this call
+
+        if proc.memo is not None or proc.creation_env is not self.env or \
+                len(args) != len(params) or \
+                any(p is proc for p in self.inlining) or \
+                len(self.inlining) >= INLINE_DEPTH or \
+                size(body) > INLINE_SIZE:
+            return None
+
+        free = mentioned(body) - set(params)
+        name = Symbol(proc.name) if proc.name is not None else None
+        if name in free or free & locals_ or not self.inlinable(body, params):
+            return None # Recursive, or would see the caller's locals
+
+        self.inlining.append(proc)
+        try:
+            substitutes, bound = self.split_arguments(body, params, args)
+            body = substituted(body, substitutes)
+            if not bound:
+                return self.optimize(body, locals_)
+
+            if LET in locals_:
+                return None
+            body, assumed = self.optimize(body, locals_ |
+                                          {param for param, _ in bound})
+            bindings = SExpression(*(x for pair in bound for x in pair))
+            return SExpression(LET, SExpression(QUOTE, bindings), body), assumed
+        finally:
+            self.inlining.pop()
+
+    def split_arguments(self, body, params, args):
+        """
+        Returns the arguments of an inlined call that can be substituted
+        for their parameters in `body`, as a dict, and the (parameter,
+        argument) pairs left for a `Let` to bind, so that they are still
+        evaluated once, and before the body. Constants can always be
+        substituted. If the body is pure, so can variables whose parameters
+        it uses unconditionally (so that looking them up, which fails if
+        they are unbound, still happens), or a single other argument whose
+        parameter the body uses once, unconditionally.
+        """
+        constant = [is_constant(arg) for arg in args]
+        if self.pure(body, params):
+            others = [param for param, c in zip(params, constant) if not c]
+            if all(c or type(arg) is Symbol and False in uses(body, param)
+                   for param, arg, c in zip(params, args, constant)) \
+                    or (len(others) == 1 and
+                        list(uses(body, others[0])) == [False]):
+                return dict(zip(params, args)), []
+
+        return ({param: arg for param, arg, c in zip(params, args, constant)
+                 if c},
+                [(param, arg) for param, arg, c in zip(params, args, constant)
+                 if not c])
+
+    def inlinable(self, expr, params):
+        """
+        Returns whether `expr`, a procedure body, may run in place of a
+        call to the procedure: whether it defines nothing, and only calls
+        the parameters, procedures, builtins that evaluate their arguments
+        (bar `Eval`, which sees the frame it is called from) and `If`,
+        `And`, `Or` and `Do`.
+        """
+        if type(expr) is not SExpression:
+            return True
+        if not expr:
+            return False
+
+        head = expr.head()
+        if head is QUOTE:
+            return len(expr) == 2
+        if type(head) is Symbol and head not in params and \
+                head not in BRANCHING:
+            fn = self.global_value(head)
+            if head is EVAL or not (type(fn) is Procedure or
+                                    (type(fn) is BuiltIn and
+                                     fn.primitive is not None)):
+                return False
+
+        return all(self.inlinable(e, params) for e in expr)
+
+    def pure(self, expr, params):
+        """
+        Returns whether `expr`, an inlinable procedure body, only calls
+        pure builtins, so nothing it runs can assign a variable.
+        """
+        if type(expr) is not SExpression:
+            return True
+
+        head = expr.head()
+        if head is QUOTE:
+            return True
+        if type(head) is not Symbol or head in params:
+            return False
+        if head not in BRANCHING:
+            fn = self.global_value(head)
+            if type(fn) is not BuiltIn or fn not in PURE:
+                return False
+
+        return all(self.pure(e, params) for e in expr.rest())
+
+
+@rewrites("Quote")
+@rewrites("Quasiquote")
+def rewrite_quoted(opt, expr, args, locals_):
+    return expr, {}
+
+@rewrites("If")
+def rewrite_if(opt, expr, args, locals_):
+    if len(args) != 3:
+        return expr, {}
+
+    condition, assumed = opt.optimize(args[0], locals_)
+    if is_constant(condition):
+        taken, skipped = args[1:]
+        if not truthy(value_of(condition)):
+            taken, skipped = skipped, taken
+        if not defines(skipped):
+            taken, taken_assumed = opt.optimize(taken, locals_)
+            return taken, {**assumed, **taken_assumed}
+
+    return rebuilt(expr, [expr.head(), guard(condition, assumed, args[0])] +
+                   [opt.guarded(arg, locals_) for arg in args[1:]]), {}
+
+@rewrites("And")
+def rewrite_and(opt, expr, args, locals_):
+    return rewrite_short_circuit(opt, expr, args, locals_, stops_on=False)
+
+@rewrites("Or")
+def rewrite_or(opt, expr, args, locals_):
+    return rewrite_short_circuit(opt, expr, args, locals_, stops_on=True)
+
+def rewrite_short_circuit(opt, expr, args, locals_, stops_on):
+    """
+    Drops the constant arguments of `And` or `Or` that are passed over,
+    and those after one that is returned. The form returns the first
+    argument whose truthiness is `stops_on`, or the last one.
+    """
+    if not args:
+        return expr, {}
+
+    kept = []
+    assumed = {} # By the constant arguments, deciding what is kept
+    for i, arg in enumerate(args):
+        optimized, arg_assumed = opt.optimize(arg, locals_)
+        last = i == len(args) - 1
+        if not is_constant(optimized) or last:
+            kept.append(guard(optimized, arg_assumed, arg))
+            continue
+
+        assumed.update(arg_assumed)
+        if truthy(value_of(optimized)) != stops_on:
+            continue # Passed over
+        kept.append(optimized)
+        if not defines(SExpression(*args[i + 1:])):
+            break # The rest are never run
+
+    if len(kept) == 1:
+        return kept[0], assumed
+    return rebuilt(expr, [expr.head()] + kept), assumed
+
+@rewrites("Do")
+def rewrite_do(opt, expr, args, locals_):
+    if not args:
+        return expr, {}
+
+    *init, last = args
+    kept = [opt.guarded(arg, locals_) for arg in init]
+    kept = [arg for arg in kept if not is_constant(arg)]
+    last, assumed = opt.optimize(last, locals_)
+    if not kept:
+        return last, assumed
+    return rebuilt(expr, [expr.head()] + kept +
+                   [guard(last, assumed, args[-1])]), {}
+
+@rewrites("Def")
+@rewrites("Set!")
+def rewrite_assignment(opt, expr, args, locals_):
+    if len(args) != 2 or type(args[0]) is not Symbol:
+        return expr, {}
+    return rebuilt(expr, [expr.head(), args[0],
+                          opt.guarded(args[1], locals_)]), {}
+
+@rewrites("Fn")
+def rewrite_fn(opt, expr, args, locals_):
+    if len(args) != 2 or not quoted_symbols(args[0]):
+        return expr, {}
+    params, body = args
+    inner = locals_ | set(params[1]) | set(defines(body))
+    return rebuilt(expr, [expr.head(), params, opt.guarded(body, inner)]), {}
+
+@rewrites("Defn")
+@rewrites("Defmemo")
+def rewrite_defn(opt, expr, args, locals_):
+    if len(args) < 2:
+        return expr, {}
+    header, body, *size = args
+    if type(header) is not SExpression or not header or \
+            not all_type(header, Symbol):
+        return expr, {}
+    inner = locals_ | set(header.rest()) | set(defines(body))
+    return rebuilt(expr, [expr.head(), header, opt.guarded(body, inner)] +
+                   [opt.guarded(arg, locals_) for arg in size]), {}
+
+@rewrites("Let")
+def rewrite_let(opt, expr, args, locals_):
+    if len(args) != 2 or not quoted_pairs(args[0]):
+        return expr, {}
+    [quote, defs], body = args
+    names, values = defs[::2], defs[1::2]
+    values = [opt.guarded(value, locals_) for value in values]
+    bindings = rebuilt(defs, [x for pair in zip(names, values) for x in pair])
+    inner = locals_ | set(names) | set(defines(body))
+    return rebuilt(expr, [expr.head(), rebuilt(args[0], [quote, bindings]),
+                          opt.guarded(body, inner)]), {}
+
+
+def guard(optimized, assumed, original):
+    if not assumed:
+        return optimized
+    return Guarded(tuple(assumed.items()), optimized, original)
+
+def merged(head, fn, optimized, *more):
+    """
+    Returns the assumptions of a rewritten call: that its head, if a
+    global, is still `fn`, and those of its rewritten arguments and of
+    `more`.
+    """
+    assumed = {head: fn} if fn is not None else {}
+    for _, arg_assumed in optimized:
+        assumed.update(arg_assumed)
+    for extra in more:
+        assumed.update(extra)
+    return assumed
+
+def rebuilt(expr, items):
+    """
+    Returns the list of `items`, or `expr` itself if they are its own.
+    """
+    if len(items) == len(expr) and all(a is b for a, b in zip(items, expr)):
+        return expr
+    return SExpression(*items)
+
+def fold(fn, values, env):
+    """
+    Returns the value of `fn` applied to `values`, or `None` if it raises
+    (so the call raises when run, as it would have) or isn't a literal.
+    """
+    try:
+        value = fn.proc_fn(values, env)
+    except Exception:
+        return None
+    return value if type(value) in (Number, String, Keyword, Dict) else None
+
+def is_constant(expr):
+    if type(expr) in LITERALS:
+        return True
+    return type(expr) is SExpression and len(expr) == 2 and \
+        expr.head() is QUOTE
+
+def value_of(constant):
+    return constant[1] if type(constant) is SExpression else constant
+
+def size(expr):
+    if type(expr) is not SExpression:
+        return 1
+    return 1 + sum(size(e) for e in expr)
+
+def mentioned(expr):
+    """
+    Returns the symbols in `expr`, outside of quoted code.
+    """
+    found = set()
+
+    def walk(e):
+        if type(e) is Symbol:
+            found.add(e)
+        elif type(e) is SExpression and e and \
+                e.head() is not QUOTE and e.head() is not QUASIQUOTE:
+            for item in e:
+                walk(item)
+
+    walk(expr)
+    return found
+
+def uses(expr, sym, conditional=False):
+    """
+    Yields, for each use of `sym` in `expr` outside of quoted code, whether
+    it is only evaluated on some runs of `expr` (eg. in a branch of `If`).
+    """
+    if expr is sym:
+        yield conditional
+    elif type(expr) is SExpression and expr and expr.head() is not QUOTE:
+        head = expr.head()
+        branches = head in BRANCHING and head is not DO
+        for i, e in enumerate(expr):
+            yield from uses(e, sym, conditional or (branches and i > 1))
+
+def substituted(expr, bindings):
+    """
+    Returns `expr` with each symbol in `bindings` replaced by its value,
+    outside of quoted code.
+    """
+    if type(expr) is Symbol:
+        return bindings.get(expr, expr)
+    if type(expr) is not SExpression or not expr or expr.head() is QUOTE:
+        return expr
+    return rebuilt(expr, [substituted(e, bindings) for e in expr])
+
+def unguarded(expr):
+    """
+    Returns `expr` with each `Guarded` in it replaced by its original code.
+    """
+    if type(expr) is Guarded:
+        return expr.original
+    if type(expr) is not SExpression or not expr or expr.head() is QUOTE:
+        return expr
+    return rebuilt(expr, [unguarded(e) for e in expr])
+
+def defines(expr):
+    """
+    Returns the local variables that `Def` and `Defn` forms in `expr`
+    define, if run in a procedure.
+    """
+    scope = Scope([])
+    scope.declare_definitions(expr)
+    return scope.names
+
+def assignments(expr, assigned, procedures):
+    """
+    Adds the variables that `expr` defines or assigns to `assigned`, and
+    those it defines with `Defn` or `Defmemo` to `procedures`.
+    """
+    if type(expr) is not SExpression or not expr or expr.head() is QUOTE:
+        return
+
+    head = expr.head()
+    if head in DEFINING and len(expr) > 1:
+        target = expr[1]
+        if type(target) is SExpression and target:
+            target = target.head()
+            if head is not Symbol("Defmacro"):
+                procedures.add(target)
+        if type(target) is Symbol:
+            assigned.add(target)
+
+    for e in expr:
+        assignments(e, assigned, procedures)
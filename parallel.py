@@ -0,0 +1,214 @@
+"""
+Runs `PMap` across a pool of worker processes, each with the prelude
+loaded. A call is split into chunks of arguments, each sent to a worker
+along with the procedure and the definitions it may use, so that the cost
+of sending them is spread over the whole chunk.
+
+Definitions made in environments other than the global one (a server
+session's, or a procedure's in the tree-walker) are sent as globals of
+the worker, rather than with the rest of the environment they are in.
+"""
+
+import atexit
+import io
+import os
+import pickle
+from multiprocessing import Pool
+
+from AST import Symbol, SExpression, Guarded
+from proc import Procedure, Macro
+from builtin import BuiltIn
+from env import Env, Frame, global_env
+from scope import Scope
+
+FN, LET, DEFN = Symbol("Fn"), Symbol("Let"), Symbol("Defn")
+
+# The number of worker processes, or `None` for one per CPU
+workers = None
+
+# Chunks given to each worker per call, so that uneven chunks even out
+CHUNKS_PER_WORKER = 4
+
+_pool = None
+
+
+def pool():
+    global _pool
+    if _pool is None:
+        _pool = Pool(workers, initializer=global_env)
+        atexit.register(_pool.terminate)
+    return _pool
+
+
+def set_workers(n):
+    """
+    Sets the number of worker processes, replacing the pool if need be.
+    """
+    global workers, _pool
+    if n != workers and _pool is not None:
+        _pool.terminate()
+        _pool = None
+    workers = n
+
+
+def pmap(fn, items, chunk_size=None):
+    """
+    Returns the list of `fn` applied to each of `items`, applied in the
+    worker processes.
+    """
+    if not items:
+        return []
+
+    if chunk_size is None:
+        count = (workers or os.cpu_count() or 1) * CHUNKS_PER_WORKER
+        chunk_size = max(1, -(-len(items) // count))
+
+    uses = definitions(fn)
+    chunks = [dumps((fn, uses, items[i:i + chunk_size]))
+              for i in range(0, len(items), chunk_size)]
+
+    results = []
+    for chunk in pool().map(run_chunk, chunks, chunksize=1):
+        results.extend(chunk)
+    return results
+
+
+def run_chunk(task):
+    """
+    Applies `fn` to each item of a chunk, in a worker process.
+    """
+    from prelude import caller
+
+    fn, uses, items = pickle.loads(task)
+    env = global_env()
+    env.locals.update(uses)
+    call = caller(fn, 1, env, "PMap")
+    return [call([x]) for x in items]
+
+
+class Pickler(pickle.Pickler):
+    """
+    Pickles environments that aren't frames as the global environment of
+    the process they are unpickled in, which `definitions` are added to.
+    """
+    def reducer_override(self, obj):
+        if type(obj) is Env:
+            return global_env, ()
+        return NotImplemented
+
+
+def dumps(obj):
+    out = io.BytesIO()
+    Pickler(out).dump(obj)
+    return out.getvalue()
+
+
+def definitions(fn):
+    """
+    Returns the definitions `fn` may use: those named by any symbol in its
+    body, in the bodies of procedures it closes over, or in the bodies of
+    those definitions, and so on. Each is looked up from the environment
+    of the procedure naming it, outside of the frames sent along with it.
+    """
+    env = global_env()
+    found = {}
+    seen = set()
+    pending = [fn]
+
+    while pending:
+        value = pending.pop()
+
+        if type(value) is SExpression:
+            pending.extend(value)
+        elif type(value) is Macro: # Expanded again in the workers
+            pending.append(value.proc)
+
+        if type(value) is not Procedure or id(value) in seen:
+            continue
+        seen.add(id(value))
+
+        for sym in free_symbols(value):
+            defined = lookup(value.creation_env, sym)
+            if defined is None or defined is env.locals.get(sym) and \
+                    type(defined) is BuiltIn:
+                continue
+            if sym not in found:
+                found[sym] = defined
+                pending.append(defined)
+            elif found[sym] is not defined:
+                msg = f"`PMap` can't send the two definitions of `{sym}` " + \
+                      "its procedures use"
+                raise AssertionError(msg)
+
+        # The frames it closes over are sent along with it
+        frame = value.creation_env
+        while type(frame) is Frame:
+            pending.extend(frame.slots)
+            frame = frame.parent
+
+    return found
+
+
+def lookup(env, sym):
+    """
+    Returns the value of `sym` in the first environment from `env` up that
+    defines it, or `None` if that is a frame (sent along with the procedure)
+    or there is none.
+    """
+    while isinstance(env, Env):
+        if type(env) is Frame:
+            if sym in env.scope.slots:
+                return None
+        elif sym in env.locals:
+            return env.locals[sym]
+        env = env.parent
+    return None
+
+
+def free_symbols(proc):
+    """
+    Yields the symbols in the body of `proc` that it doesn't bind itself:
+    bar its parameters and local definitions, and the variables of the
+    `Fn`s, `Defn`s and `Let`s in it, within them.
+    """
+    yield from symbols(proc.body, local_names(proc.formals, proc.body, set()))
+
+
+def local_names(params, body, bound):
+    """
+    Returns `bound` with the parameters `params` of the procedure (or
+    `Let`) with `body`, and the variables that `body` defines in it.
+    """
+    scope = Scope([p for p in params if type(p) is Symbol])
+    scope.declare_definitions(body)
+    return bound | set(scope.names)
+
+
+def symbols(expr, bound):
+    if type(expr) is Symbol:
+        if expr not in bound:
+            yield expr
+        return
+    if type(expr) is Guarded: # Its optimized code calls no others
+        yield from symbols(expr.original, bound)
+        return
+    if type(expr) is not SExpression or not expr:
+        return
+
+    head = expr.head()
+    binding = len(expr) == 3 and type(expr[1]) is SExpression
+    if head is FN and binding and len(expr[1]) == 2 and \
+            type(expr[1][1]) is SExpression:
+        yield from symbols(expr[2], local_names(expr[1][1], expr[2], bound))
+    elif head is LET and binding and len(expr[1]) == 2 and \
+            type(expr[1][1]) is SExpression:
+        pairs = expr[1][1]
+        for value in pairs[1::2]:
+            yield from symbols(value, bound)
+        yield from symbols(expr[2], local_names(pairs[::2], expr[2], bound))
+    elif head is DEFN and binding and len(expr[1]) > 0:
+        yield from symbols(expr[2],
+                           local_names(expr[1][1:], expr[2], bound))
+    else:
+        for e in expr:
+            yield from symbols(e, bound)
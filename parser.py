@@ -1,10 +1,70 @@
+import os
+import pickle
+import hashlib
+
+import sly
 from sly import Parser
 from lexer import Lexer
 import AST
 
+# Where the LR tables generated for the grammar below are cached
+PARSETAB = os.path.join(os.path.dirname(__file__), "__pycache__", "parsetab.pickle")
+
+
+class CachedLRTable:
+    """
+    The parts of a `sly.yacc.LRTable` that `sly.Parser.parse` uses.
+    """
+    def __init__(self, lr_action, lr_goto, defaulted_states):
+        self.lr_action = lr_action
+        self.lr_goto = lr_goto
+        self.defaulted_states = defaulted_states
+
+
 class Parser(Parser):
     tokens = Lexer.tokens
 
+    # Otherwise sly keeps the position of every node it ever parsed, in
+    # tables keyed by `id` that outlive the nodes, and nothing reads them
+    track_positions = False
+
+    @classmethod
+    def __build_lrtables(cls):
+        """
+        Overrides sly's table construction (the name is mangled to match)
+        to reuse the tables in `PARSETAB` when they were generated for
+        exactly this grammar, and to save them there otherwise.
+        """
+        signature = "\n".join([
+            sly.__version__,
+            repr(cls.precedence),
+            *(str(p) for p in cls._grammar.Productions),
+        ])
+        signature = hashlib.sha1(signature.encode()).hexdigest()
+
+        try:
+            with open(PARSETAB, "rb") as f:
+                cached_signature, tables = pickle.load(f)
+            if cached_signature == signature:
+                cls._lrtable = CachedLRTable(*tables)
+                return True
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            pass
+
+        if not super().__build_lrtables():
+            return False
+
+        table = cls._lrtable
+        tables = (table.lr_action, table.lr_goto, table.defaulted_states)
+        try:
+            os.makedirs(os.path.dirname(PARSETAB), exist_ok=True)
+            with open(PARSETAB, "wb") as f:
+                pickle.dump((signature, tables), f)
+        except OSError:
+            pass # Tables are rebuilt next time instead
+
+        return True
+
 #    @_("expression")
 #    def program(self, p):
 #        return p.expression
@@ -38,6 +98,14 @@ class Parser(Parser):
     def brace_expression(self, p):
         return AST.SExpression(AST.Symbol("List"))
 
+    @_("HASHBRACE expressions RBRACE")
+    def brace_expression(self, p):
+        return AST.SExpression(AST.Symbol("Dict"), *p.expressions)
+
+    @_("HASHBRACE RBRACE")
+    def brace_expression(self, p):
+        return AST.SExpression(AST.Symbol("Dict"))
+
     @_("QUOTE expression")
     def quoted_expression(self, p):
         return AST.SExpression(AST.Symbol("Quote"), p.expression)
@@ -50,6 +118,10 @@ class Parser(Parser):
     def quoted_expression(self, p):
         return AST.SExpression(AST.Symbol("Unquote"), p.expression)
 
+    @_("UNQUOTE_SPLICING expression")
+    def quoted_expression(self, p):
+        return AST.SExpression(AST.Symbol("UnquoteSplicing"), p.expression)
+
     @_("expressions expression")
     def expressions(self, p):
         return p.expressions + [p.expression]
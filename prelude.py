@@ -1,53 +1,136 @@
 from functools import reduce
-from operator import add, mul, eq
+from itertools import repeat, chain, count, islice
+from operator import add, sub, mul, truediv, eq, lt, gt
 
 from AST import *
-from proc import Procedure
-from env import Env
-from builtin import BuiltIn
+from proc import Procedure, Memo, Macro
+from env import Env, Frame
+from scope import Scope
+from builtin import BuiltIn, seq_walkers, seq_makers
 
 from utils import *
+import files
 
 # Define empty list for use in these fn definitions
-nil = SExpression()
+nil = NIL
 
 def all_type(seq, typ):
     return all(type(x) is typ for x in seq)
 
+def quoted_symbols(e):
+    """
+    Checks that `e` has the form `Quote[(x y z ...)]`, as the parameter
+    lists of `Fn` must.
+    """
+    return type(e) is SExpression and len(e) == 2 \
+        and type(e[1]) is SExpression and all_type(e[1], Symbol)
+
+def quoted_pairs(e):
+    """
+    Checks that `e` has the form `Quote[(x v1 y v2 ...)]`, as the
+    bindings of `Let` must.
+    """
+    return type(e) is SExpression and len(e) == 2 \
+        and type(e[1]) is SExpression and len(e[1]) % 2 == 0 \
+        and all_type(e[1][::2], Symbol)
+
+def caller(fn, argc, env, name):
+    """
+    Returns a function that calls `fn` with a list of `argc` evaluated
+    arguments, as a call site would, for builtins that call `fn` in a
+    loop. A builtin's arity is checked once, here, instead of per call.
+    """
+    if type(fn) is Procedure:
+        return fn.apply
+
+    if type(fn) is BuiltIn and fn.primitive is not None:
+        expected, ellipsis = fn.arity
+        if argc != expected and (ellipsis is not ... or argc < expected):
+            raise arity_error(fn.name, fn.arity, argc)
+        primitive = fn.primitive
+        return lambda args: primitive(args, env)
+
+    if type(fn) is BuiltIn and fn.proc_fn is not None:
+        proc_fn = fn.proc_fn
+        return lambda args: proc_fn(args, env)
+
+    msg = f"First argument to `{name}` must be a procedure or builtin " + \
+          f"that evaluates its arguments, got {fn}"
+    raise AssertionError(msg)
+
+# Builtins without side effects, whose calls on constants `misp -O` folds
+# into their values (see `optimizer`)
+PURE = set()
+
 @builtin
 @procedure
 @arity(2, ...)
 @named("+")
 def plus(args, env):
-    return reduce(add, args)
+    numbers = number_values(args)
+    if numbers is None:
+        return reduce(add, args)
+    return Number(sum(numbers))
 
 @builtin
 @procedure
 @arity(2, ...)
 @named("-")
 def minus(args, env):
-    return args[0] - reduce(add, args[1:])
+    numbers = number_values(args)
+    if numbers is None:
+        return args[0] - reduce(add, args[1:])
+    return Number(numbers[0] - sum(numbers[1:]))
 
 @builtin
 @procedure
 @arity(2, ...)
 @named("*")
 def times(args, env):
-    return reduce(mul, args)
+    numbers = number_values(args)
+    if numbers is None:
+        return reduce(mul, args)
+    return Number(reduce(mul, numbers))
 
 @builtin
 @procedure
 @arity(2, ...)
 @named("/")
 def divide(args, env):
-    return args[0] / reduce(mul, args[1:])
+    numbers = number_values(args)
+    if numbers is None:
+        return args[0] / reduce(mul, args[1:])
+    return Number(exact_div(numbers[0], reduce(mul, numbers[1:])))
 
 @builtin
 @procedure
 @arity(2, ...)
 @named("=")
 def all_eq(args, env):
-    return pybool_into_kwbool(reduce(eq, args))
+    numbers = number_values(args)
+    if numbers is None:
+        return pybool_into_kwbool(all(map(eq, args, args[1:])))
+    return pybool_into_kwbool(all(map(eq, numbers, numbers[1:])))
+
+@builtin
+@procedure
+@arity(2, ...)
+@named("<")
+def less(args, env):
+    numbers = number_values(args)
+    if numbers is None:
+        raise AssertionError(f"Arguments to `<` must all be numbers: {args}")
+    return pybool_into_kwbool(all(map(lt, numbers, numbers[1:])))
+
+@builtin
+@procedure
+@arity(2, ...)
+@named(">")
+def greater(args, env):
+    numbers = number_values(args)
+    if numbers is None:
+        raise AssertionError(f"Arguments to `>` must all be numbers: {args}")
+    return pybool_into_kwbool(all(map(gt, numbers, numbers[1:])))
 
 @builtin
 @procedure
@@ -61,7 +144,7 @@ def head(args, env):
 @arity(1)
 @named("Body")
 def body(args, env):
-    return SExpression(*args[0].body())
+    return args[0].rest()
 
 @builtin
 @arity(2)
@@ -78,6 +161,21 @@ def fn(args, env):
 
     return Procedure(formals=params, body=body, creation_env=env)
 
+@compiles(fn)
+def compile_fn(args, scope, tail):
+    if len(args) != 2 or not quoted_symbols(args[0]):
+        return None
+
+    [quote, params], body = args
+    fn_scope = Scope(params, scope)
+    fn_scope.declare_definitions(body)
+    body_code = body.compile(fn_scope, tail=True)
+
+    def code(env):
+        return Procedure(formals=params, body=body, creation_env=env,
+                         code=body_code, scope=fn_scope)
+    return code
+
 @builtin
 @arity(2)
 @named("Def")
@@ -93,6 +191,32 @@ def define(args, env):
     env[sym] = val
     return val
 
+@compiles(define)
+def compile_define(args, scope, tail):
+    if len(args) != 2 or type(args[0]) is not Symbol:
+        return None
+
+    sym, val = args
+
+    if scope is None:
+        val_code = val.compile()
+
+        def code(env):
+            env.declare(sym)
+            val = val_code(env)
+            env[sym] = val
+            return val
+        return code
+
+    slot = scope.declare(sym)
+    val_code = val.compile(scope)
+
+    def code(env):
+        val = val_code(env)
+        env.slots[slot] = val
+        return val
+    return code
+
 @builtin
 @arity(2)
 @named("Defn")
@@ -113,10 +237,128 @@ def defn(args, env):
     params = SExpression(Symbol("Quote"), SExpression(*params))
     sexpr_fn = SExpression(params, body)
     proc = fn.apply(sexpr_fn, env)
+    proc.name = str(name)
 
     # Call `define`, which is `def`d right above
     return define.apply(SExpression(name, proc), env)
 
+@compiles(defn)
+def compile_defn(args, scope, tail):
+    if len(args) != 2:
+        return None
+
+    header, body = args
+
+    if type(header) is not SExpression or len(header) == 0 \
+            or not all_type(header, Symbol):
+        return None
+
+    name, *params = header
+    params = SExpression(*params)
+
+    if scope is not None:
+        slot = scope.declare(name)
+
+    fn_scope = Scope(params, scope)
+    fn_scope.declare_definitions(body)
+    body_code = body.compile(fn_scope, tail=True)
+
+    def code(env):
+        proc = Procedure(formals=params, body=body, creation_env=env,
+                         code=body_code, scope=fn_scope, name=str(name))
+        if scope is None:
+            env.declare(name)
+            env[name] = proc
+        else:
+            env.slots[slot] = proc
+        return proc
+    return code
+
+def memo_size(n):
+    msg = "Size of a memo must be a positive integer"
+    size = integer(n)
+    assert size is not None and size > 0, msg
+    return size
+
+@builtin
+@arity(2, ...)
+@named("Defmemo")
+def defmemo(args, env):
+    """
+    Defmemo[fib[n] ...]
+    Defmemo[fib[n] ... 100]
+    """
+    if len(args) > 3:
+        msg = f"Wrong number of arguments to `Defmemo`. " + \
+              f"Expected 2 or 3, got {len(args)}"
+        raise AssertionError(msg)
+
+    header, body, *size = args
+    size = memo_size(size[0].evaluate(env)) if size else None
+
+    proc = defn.apply(SExpression(header, body), env)
+    proc.memo = Memo(size)
+    return proc
+
+@compiles(defmemo)
+def compile_defmemo(args, scope, tail):
+    if len(args) not in (2, 3):
+        return None
+
+    header, body, *size = args
+    defn_code = compile_defn([header, body], scope, tail)
+    if defn_code is None:
+        return None
+    size_code = size[0].compile(scope) if size else None
+
+    def code(env):
+        size = memo_size(size_code(env)) if size_code else None
+        proc = defn_code(env)
+        proc.memo = Memo(size)
+        return proc
+    return code
+
+@builtin
+@procedure
+@arity(1, ...)
+@named("Memo")
+def memo(args, env):
+    """
+    Memo[f]
+    Memo[f 100]
+    """
+    if len(args) > 2:
+        msg = f"Wrong number of arguments to `Memo`. " + \
+              f"Expected 1 or 2, got {len(args)}"
+        raise AssertionError(msg)
+
+    fn, *size = args
+
+    msg = "Argument to `Memo` must be a procedure"
+    assert type(fn) is Procedure, msg
+
+    return fn.memoized(memo_size(size[0]) if size else None)
+
+@builtin
+@procedure
+@arity(1)
+@named("MemoStats")
+def memo_stats(args, env):
+    """
+    MemoStats[f] => {:hits 10 :misses 5 :entries 5 :size 1024}
+    """
+    [fn] = args
+
+    msg = "Argument to `MemoStats` must be a memoized procedure"
+    assert type(fn) is Procedure and fn.memo is not None, msg
+
+    memo = fn.memo
+    return SExpression(
+        Keyword(":hits"), Number(memo.hits),
+        Keyword(":misses"), Number(memo.misses),
+        Keyword(":entries"), Number(len(memo.results)),
+        Keyword(":size"), Number(memo.size))
+
 @builtin
 @arity(2)
 @named("Set!")
@@ -126,6 +368,21 @@ def set_bang(args, env):
     env[sym] = val
     return val
 
+@compiles(set_bang)
+def compile_set_bang(args, scope, tail):
+    if len(args) != 2 or type(args[0]) is not Symbol:
+        return None
+
+    sym, val = args
+    assign = sym.compile_assign(scope)
+    val_code = val.compile(scope)
+
+    def code(env):
+        val = val_code(env)
+        assign(env, val)
+        return val
+    return code
+
 @builtin
 @arity(1, ...)
 @named("Do")
@@ -134,6 +391,21 @@ def do(args, env):
         arg.evaluate(env)
     return args[-1].evaluate(env)
 
+@compiles(do)
+def compile_do(args, scope, tail):
+    if len(args) < 1:
+        return None
+
+    *init, last = args
+    init = [arg.compile(scope) for arg in init]
+    last = last.compile(scope, tail)
+
+    def code(env):
+        for arg in init:
+            arg(env)
+        return last(env)
+    return code
+
 @builtin
 @arity(2)
 @named("Let")
@@ -160,13 +432,38 @@ def let(args, env):
     proc = Procedure(syms, body, env)
     return proc.apply(vals)
 
+@compiles(let)
+def compile_let(args, scope, tail):
+    if len(args) != 2 or not quoted_pairs(args[0]):
+        return None
+
+    [quote, defs], body = args
+    let_scope = Scope(defs[::2], scope)
+    let_scope.declare_definitions(body)
+    val_codes = [val.compile(scope) for val in defs[1::2]]
+    body_code = body.compile(let_scope, tail)
+
+    def code(env):
+        slots = [val(env) for val in val_codes]
+        missing = len(let_scope.names) - len(slots)
+        if missing:
+            slots.extend([None] * missing)
+        return body_code(Frame(let_scope, slots, env))
+    return code
+
 @builtin
 @procedure
 @arity(1)
 @named("Eval")
 def eval_(args, env):
     [expr] = args
-    return expr.evaluate(env)
+    if Procedure.tree_walk:
+        return expr.evaluate(env)
+    if type(env) is Frame:
+        code = expr.compile(env.scope)
+        env.fit() # `expr` may have declared new locals
+        return code(env)
+    return expr.compile()(env)
 
 @builtin
 @procedure
@@ -188,28 +485,98 @@ def apply_(args, env):
 def quote(args, env):
     return args[0]
 
+@compiles(quote)
+def compile_quote(args, scope, tail):
+    if len(args) != 1:
+        return None
+
+    [expr] = args
+    return lambda env: expr
+
+UNQUOTE = Symbol("Unquote")
+UNQUOTE_SPLICING = Symbol("UnquoteSplicing")
+QUASIQUOTE = Symbol("Quasiquote")
+
+def template(e, hole):
+    """
+    Returns `code(env)` building the value of the quasiquoted `e`, or
+    `None` if `e` has no `Unquote`s and so is its own value. Only the
+    lists leading to an `Unquote` are rebuilt, sharing the rest of `e`.
+    `hole(expr)` returns `code(env)` giving the value of an unquoted
+    `expr`.
+    """
+    if type(e) is not SExpression or len(e) == 0:
+        return None
+
+    head = e.head()
+    if head is UNQUOTE:
+        [unquoted] = unquote_args(e, "Unquote")
+        return hole(unquoted)
+    if head is QUASIQUOTE:
+        return None # Don't recurse inside nested quasiquote expressions
+    if head is UNQUOTE_SPLICING:
+        raise AssertionError("`UnquoteSplicing` must be inside a list")
+
+    holes = [] # The (index, code, splice) of each item that isn't constant
+    for i, item in enumerate(e):
+        if type(item) is SExpression and len(item) > 0 and \
+                item.head() is UNQUOTE_SPLICING:
+            [unquoted] = unquote_args(item, "UnquoteSplicing")
+            holes.append((i, hole(unquoted), True))
+        else:
+            code = template(item, hole)
+            if code is not None:
+                holes.append((i, code, False))
+
+    if not holes:
+        return None
+
+    if not any(splice for _, _, splice in holes):
+        def code(env):
+            items = list(e)
+            for i, fill, _ in holes:
+                items[i] = fill(env)
+            return SExpression(*items)
+        return code
+
+    def code(env):
+        items = list(e)
+        # From the end, so the indices of the holes left don't move
+        for i, fill, splice in reversed(holes):
+            if splice:
+                items[i:i + 1] = sequence(fill(env), "UnquoteSplicing")
+            else:
+                items[i] = fill(env)
+        return SExpression(*items)
+    return code
+
+def unquote_args(e, name):
+    if len(e) != 2:
+        raise arity_error(name, (1, None), len(e) - 1)
+    return e.rest()
+
 @builtin
 @arity(1)
 @named("Quasiquote")
 def quasiquote(args, env):
+    """
+    ~If[$c Do[$@body] Nil]
+    """
     [expr] = args
-    
-    def recurse(e) -> Expression:
-        if type(e) is SExpression:
-            head, *body = e
-            if head == Symbol("Unquote"):
-                [unquoted] = body
-                return unquoted.evaluate(env)
-            elif head == Symbol("Quasiquote"):
-                return e # Don't recurse inside nested quasiquote expressions
-            else:
-                return SExpression(*(recurse(ei) for ei in e))
-        elif isinstance(e, Atom):
-            return e
-        else:
-            raise Exception("Unreachable!")
+    code = template(expr, lambda unquoted: unquoted.evaluate)
+    return expr if code is None else code(env)
 
-    return recurse(expr)
+@compiles(quasiquote)
+def compile_quasiquote(args, scope, tail):
+    if len(args) != 1:
+        return None
+
+    [expr] = args
+    try:
+        code = template(expr, lambda unquoted: unquoted.compile(scope))
+    except AssertionError:
+        return None # Left to `quasiquote` to report at runtime
+    return code if code is not None else lambda env: expr
 
 
 @builtin
@@ -220,6 +587,48 @@ def unquote(args, env):
           "of `Quasiquote` or macros"
     raise Exception(msg)
 
+@builtin
+@arity(1)
+@named("UnquoteSplicing")
+def unquote_splicing(args, env):
+    msg = "`UnquoteSplicing` cannot be evaluated! It should only be used " + \
+          "inside of lists in `Quasiquote` or macros"
+    raise Exception(msg)
+
+@builtin
+@arity(2)
+@named("Defmacro")
+def defmacro(args, env):
+    """
+    Defmacro[unless[c x y] ~If[$c $y $x]]
+    A call to `unless` is replaced by the code its body returns, built
+    from the call's unevaluated arguments the first time it runs.
+    """
+    header, body = args
+    proc = defn.apply(SExpression(header, body), env)
+    macro = Macro(proc)
+    env[header[0]] = macro
+    return macro
+
+@builtin
+@procedure
+@arity(1)
+@named("MacroExpand")
+def macro_expand(args, env):
+    """
+    MacroExpand['unless[c x y]] => {If c y x}
+    Expands a call until its head is no longer a macro.
+    """
+    [form] = args
+    while type(form) is SExpression and len(form) > 0:
+        head = form.head()
+        if type(head) is Symbol and head in env:
+            head = env[head]
+        if type(head) is not Macro:
+            break
+        form = form.expand(head)
+    return form
+
 @builtin
 @procedure
 @arity(0, ...)
@@ -227,6 +636,420 @@ def unquote(args, env):
 def list_(args, env):
     return SExpression(*args)
 
+def sequence(arg, name):
+    """
+    Checks that `arg` can be iterated over by the sequence builtins.
+    """
+    if type(arg) not in (SExpression, Vec, Seq):
+        raise AssertionError(f"Arguments to `{name}` must be lists: {arg}")
+    return arg
+
+# The sequence builtins that walk a whole `Seq` first `clear` their
+# argument list, which is theirs alone, so that the walk doesn't keep the
+# head of the `Seq` (and with it every item computed) alive.
+
+@builtin
+@procedure
+@arity(2, ...)
+@named("Map")
+def map_(args, env):
+    """
+    Map[Inc '(1 2 3)]           => {2 3 4}
+    Map[+ '(1 2 3) '(10 20 30)] => {11 22 33}
+    Lazy if any of the lists is a `Seq`.
+    """
+    fn, *seqs = args
+    seqs = [sequence(seq, "Map") for seq in seqs]
+    call = caller(fn, len(seqs), env, "Map")
+
+    if any(type(seq) is Seq for seq in seqs):
+        if len(seqs) == 1:
+            return Seq(call([x]) for x in seqs[0])
+        return Seq(call(list(xs)) for xs in zip(*seqs))
+
+    if len(seqs) == 1:
+        return SExpression(*[call([x]) for x in seqs[0]])
+    return SExpression(*[call(list(xs)) for xs in zip(*seqs)])
+
+@builtin
+@procedure
+@arity(2)
+@named("Filter")
+def filter_(args, env):
+    """
+    Filter[Fn['(x) =[x 1]] '(1 2 1)] => {1 1}
+    Lazy if the list is a `Seq`.
+    """
+    fn, seq = args
+    call = caller(fn, 1, env, "Filter")
+    kept = (x for x in sequence(seq, "Filter") if truthy(call([x])))
+    return Seq(kept) if type(seq) is Seq else SExpression(*kept)
+
+# Builtins that `Reduce` runs on Python numbers, without boxing each result
+REDUCTIONS = {}
+
+@builtin
+@procedure
+@arity(2, ...)
+@named("Reduce")
+def reduce_(args, env):
+    """
+    Reduce[+ '(1 2 3)]      => 6
+    Reduce[+ 10 '(1 2 3)]   => 16
+    """
+    if len(args) > 3:
+        msg = f"Wrong number of arguments to `Reduce`. " + \
+              f"Expected 2 or 3, got {len(args)}"
+        raise AssertionError(msg)
+
+    fn, *init, seq = args
+    seq = sequence(seq, "Reduce")
+    call = caller(fn, 2, env, "Reduce")
+
+    op = REDUCTIONS.get(fn) if type(fn) is BuiltIn else None
+
+    if type(seq) is Seq:
+        args.clear()
+        items = chain(init, iter(seq))
+        del seq
+        acc = next(items, None)
+        msg = "`Reduce` of an empty list needs an initial value"
+        assert acc is not None, msg
+
+        if op is not None and type(acc) is Number:
+            value = acc.value
+            for x in items:
+                if type(x) is not Number:
+                    acc = call([Number(value), x])
+                    break
+                value = op(value, x.value)
+            else:
+                return Number(value)
+
+        for x in items:
+            acc = call([acc, x])
+        return acc
+
+    if op is not None:
+        values = number_values(init)
+        more = seq.data if type(seq) is Vec else number_values(seq)
+        if values is not None and more is not None and \
+                (values or len(more) > 0):
+            numbers = exact_values(values + list(more)) if values else more
+            return Number(reduce(op, numbers))
+
+    items = init + list(seq)
+    msg = "`Reduce` of an empty list needs an initial value"
+    assert len(items) > 0, msg
+
+    acc, *rest = items
+    for x in rest:
+        acc = call([acc, x])
+    return acc
+
+@builtin
+@procedure
+@arity(0, ...)
+@named("Range")
+def range_(args, env):
+    """
+    Range[3]        => {0 1 2}
+    Range[1 4]      => {1 2 3}
+    Range[0 10 5]   => {0 5}
+    Range[]         => {0 1 2 ...}, a `Seq` without end
+    """
+    values = integers(args)
+
+    msg = "Arguments to `Range` must be up to three integers"
+    assert values is not None and len(values) <= 3, msg
+
+    if not values:
+        return Seq(map(Number, count()))
+    return SExpression(*map(Number, range(*values)))
+
+def count_arg(n, name):
+    msg = f"First argument to `{name}` must be a non-negative integer"
+    value = integer(n)
+    assert value is not None and value >= 0, msg
+    return value
+
+@builtin
+@procedure
+@arity(2)
+@named("Take")
+def take(args, env):
+    """
+    Take[2 Range[]] => {0 1}
+    """
+    n, seq = args
+    n = count_arg(n, "Take")
+    seq = sequence(seq, "Take")
+
+    if type(seq) is Seq:
+        return Seq(islice(seq, n))
+    if type(seq) is Vec:
+        return seq[:n]
+    return SExpression(*islice(seq, n))
+
+@builtin
+@procedure
+@arity(2)
+@named("Drop")
+def drop(args, env):
+    """
+    Drop[2 Range[]] => {2 3 4 ...}
+    """
+    n, seq = args
+    n = count_arg(n, "Drop")
+    seq = sequence(seq, "Drop")
+
+    if type(seq) is Seq:
+        return Seq(islice(seq, n, None))
+    if type(seq) is Vec:
+        return seq[n:]
+    return SExpression.view(seq.items, seq.start + n)
+
+@builtin
+@procedure
+@arity(2)
+@named("Iterate")
+def iterate(args, env):
+    """
+    Iterate[Inc 5] => {5 6 7 ...}
+    """
+    fn, x = args
+    call = caller(fn, 1, env, "Iterate")
+
+    def iterations(x):
+        while True:
+            yield x
+            x = call([x])
+
+    return Seq(iterations(x))
+
+@builtin
+@procedure
+@arity(2, ...)
+@named("PMap")
+def pmap(args, env):
+    """
+    PMap[f xs]      => Map[f xs], with the calls spread over processes
+    PMap[f xs 10]   => the same, sending them 10 at a time
+    """
+    import parallel
+
+    if len(args) > 3:
+        msg = f"Wrong number of arguments to `PMap`. " + \
+              f"Expected 2 or 3, got {len(args)}"
+        raise AssertionError(msg)
+
+    fn, seq, *chunk_size = args
+    items = list(sequence(seq, "PMap"))
+
+    if chunk_size:
+        [n] = chunk_size
+        msg = "Chunk size of `PMap` must be a positive integer"
+        chunk_size = integer(n)
+        assert chunk_size is not None and chunk_size > 0, msg
+    else:
+        chunk_size = None
+
+    return SExpression(*parallel.pmap(fn, items, chunk_size))
+
+def vec_of(arg, name):
+    """
+    Returns `arg` as a `Vec` if it is a `Vec` or a list of numbers.
+    """
+    if type(arg) is Vec:
+        return arg
+    values = number_values(arg) if type(arg) is SExpression else None
+    if values is None:
+        raise AssertionError(f"Arguments to `{name}` must be vectors: {arg}")
+    return Vec.pack(values)
+
+@builtin
+@procedure
+@arity(0, ...)
+@named("Vec")
+def vec(args, env):
+    """
+    Vec[1 2 3]
+    Vec['(1 2 3)]
+    """
+    if len(args) == 1 and type(args[0]) in (SExpression, Vec):
+        return vec_of(args[0], "Vec")
+
+    values = number_values(args)
+    if values is None:
+        raise AssertionError(f"Arguments to `Vec` must all be numbers: {args}")
+    return Vec.pack(values)
+
+@builtin
+@procedure
+@arity(1)
+@named("VSum")
+def vsum(args, env):
+    [v] = args
+    return Number(sum(vec_of(v, "VSum").data))
+
+@builtin
+@procedure
+@arity(2)
+@named("Dot")
+def dot(args, env):
+    a, b = (vec_of(v, "Dot").data for v in args)
+
+    msg = "Arguments to `Dot` must be vectors of the same length"
+    assert len(a) == len(b), msg
+
+    return Number(sum(map(mul, a, b)))
+
+@builtin
+@procedure
+@arity(2, ...)
+@named("VSlice")
+def vslice(args, env):
+    """
+    VSlice[v 1]     => all but the first element
+    VSlice[v 1 3]   => the second and third elements
+    Shares the buffer of `v`.
+    """
+    v, *bounds = args
+    values = integers(bounds)
+
+    msg = "Bounds of `VSlice` must be one or two integers"
+    assert values is not None and len(values) <= 2, msg
+
+    start, stop = (values + [None])[:2]
+    return vec_of(v, "VSlice")[start:stop]
+
+# The builtins `VMap` applies at buffer speed instead of once per element
+VECTOR_OPS = {}
+
+@builtin
+@procedure
+@arity(2, ...)
+@named("VMap")
+def vmap(args, env):
+    """
+    VMap[+ v 1]     => adds 1 to each element of `v`
+    VMap[* v w]     => multiplies `v` and `w` elementwise
+    VMap[f v]       => calls `f` on each element of `v`
+    """
+    fn, *operands = args
+
+    columns = []
+    for operand in operands:
+        if type(operand) is Number:
+            # As a `Vec` would hold it, so it mixes with the floats in one
+            value = operand.value
+            columns.append(repeat(float(value) if type(value) is Decimal
+                                  else value))
+        else:
+            columns.append(vec_of(operand, "VMap").data)
+
+    lengths = {len(c) for c in columns if type(c) is memoryview}
+    msg = "Vectors given to `VMap` must have the same length"
+    assert len(lengths) == 1, msg
+
+    op = VECTOR_OPS.get(fn) \
+        if type(fn) is BuiltIn and len(columns) == 2 else None
+    if op is not None:
+        return Vec.pack(map(op, *columns))
+
+    call = caller(fn, len(columns), env, "VMap")
+    results = (call([Number(v) for v in row]) for row in zip(*columns))
+    values = [n.value for n in results if type(n) is Number]
+    msg = "Function given to `VMap` must return numbers"
+    assert len(values) == lengths.pop(), msg
+    return Vec.pack(values)
+
+def dict_of(arg, name):
+    if type(arg) is not Dict:
+        msg = f"First argument to `{name}` must be a dict: {arg}"
+        raise AssertionError(msg)
+    return arg
+
+def pairs(args, name):
+    """
+    Returns the (key, value) pairs of the flat list `args`.
+    """
+    msg = f"Arguments to `{name}` must be keys and values, in pairs"
+    assert len(args) % 2 == 0, msg
+    return zip(args[::2], args[1::2])
+
+@builtin
+@procedure
+@arity(0, ...)
+@named("Dict")
+def dict_(args, env):
+    """
+    Dict[:a 1 "b" 2]    => #{:a 1 "b" 2}
+    """
+    return Dict.of(pairs(args, "Dict"))
+
+@builtin
+@procedure
+@arity(2, ...)
+@named("Get")
+def get(args, env):
+    """
+    Get[d :a]           => the value of `:a` in `d`, or `Nil`
+    Get[d :a 0]         => the value of `:a` in `d`, or 0
+    """
+    d, key, *default = args
+    assert len(default) <= 1, "`Get` takes at most one default value"
+    return dict_of(d, "Get").get(key, default[0] if default else nil)
+
+@builtin
+@procedure
+@arity(2)
+@named("Contains?")
+def contains(args, env):
+    d, key = args
+    return pybool_into_kwbool(key in dict_of(d, "Contains?"))
+
+@builtin
+@procedure
+@arity(1, ...)
+@named("Assoc")
+def assoc(args, env):
+    """
+    Assoc[d :a 1 :b 2]  => `d` with `:a` mapped to 1 and `:b` to 2
+    Leaves `d` as it was.
+    """
+    d, *rest = args
+    d = dict_of(d, "Assoc")
+    for key, value in pairs(rest, "Assoc"):
+        d = d.assoc(key, value)
+    return d
+
+@builtin
+@procedure
+@arity(1, ...)
+@named("Dissoc")
+def dissoc(args, env):
+    """
+    Dissoc[d :a :b]     => `d` without `:a` and `:b`
+    Leaves `d` as it was.
+    """
+    d, *keys = args
+    d = dict_of(d, "Dissoc")
+    for key in keys:
+        d = d.dissoc(key)
+    return d
+
+@builtin
+@procedure
+@arity(1)
+@named("Keys")
+def keys(args, env):
+    """
+    The list of the keys of a dict, in no particular order.
+    """
+    [d] = args
+    return SExpression(*dict_of(d, "Keys"))
+
 @builtin
 @arity(3)
 @named("If")
@@ -237,16 +1060,51 @@ def if_(args, env):
     else:
         return alternative.evaluate(env)
 
+@compiles(if_)
+def compile_if(args, scope, tail):
+    if len(args) != 3:
+        return None
+
+    condition, consequent, alternative = args
+    condition = condition.compile(scope)
+    consequent = consequent.compile(scope, tail)
+    alternative = alternative.compile(scope, tail)
+
+    def code(env):
+        if truthy(condition(env)):
+            return consequent(env)
+        else:
+            return alternative(env)
+    return code
+
 @builtin
 @arity(1, ...)
 @named("Or")
 def or_(args, env):
-    for arg in args:
+    for arg in args[:-1]:
         arg = arg.evaluate(env)
         if truthy(arg):
             return arg
     else:
-        return Keyword(":F")
+        return args[-1].evaluate(env)
+
+@compiles(or_)
+def compile_or(args, scope, tail):
+    if len(args) < 1:
+        return None
+
+    *init, last = args
+    init = [arg.compile(scope) for arg in init]
+    last = last.compile(scope, tail)
+
+    def code(env):
+        for arg in init:
+            arg = arg(env)
+            if truthy(arg):
+                return arg
+        else:
+            return last(env)
+    return code
 
 @builtin
 @arity(1, ...)
@@ -259,6 +1117,24 @@ def and_(args, env):
     else:
         return args[-1].evaluate(env)
 
+@compiles(and_)
+def compile_and(args, scope, tail):
+    if len(args) < 1:
+        return None
+
+    *init, last = args
+    init = [arg.compile(scope) for arg in init]
+    last = last.compile(scope, tail)
+
+    def code(env):
+        for arg in init:
+            arg = arg(env)
+            if not truthy(arg):
+                return arg
+        else:
+            return last(env)
+    return code
+
 @builtin
 @procedure
 @arity(1)
@@ -280,6 +1156,98 @@ def print_(args, env):
 
     return args[-1] if args else nil
 
+def path_of(arg, name):
+    if type(arg) is not String:
+        msg = f"Path given to `{name}` must be a string: {arg}"
+        raise AssertionError(msg)
+    return arg.value
+
+@builtin
+@procedure
+@arity(1)
+@named("OpenLines")
+def open_lines(args, env):
+    """
+    OpenLines["data.txt"]   => the lazy `Seq` of the lines of the file
+    """
+    [path] = args
+    return Seq(files.read_lines(path_of(path, "OpenLines")))
+
+@builtin
+@procedure
+@arity(1, ...)
+@named("ReadChunks")
+def read_chunks(args, env):
+    """
+    ReadChunks["data.txt"]      => the lazy `Seq` of the file, in chunks
+    ReadChunks["data.txt" 100]  => the same, 100 characters at a time
+    """
+    path, *size = args
+    path = path_of(path, "ReadChunks")
+    if not size:
+        return Seq(files.read_chunks(path))
+
+    msg = "`ReadChunks` takes a path and a chunk size"
+    assert len(size) == 1, msg
+    [n] = size
+    msg = "Chunk size of `ReadChunks` must be a positive integer"
+    size = integer(n)
+    assert size is not None and size > 0, msg
+    return Seq(files.read_chunks(path, size))
+
+@builtin
+@procedure
+@arity(1)
+@named("MapFile")
+def map_file(args, env):
+    """
+    MapFile["data.bin"]     => a `Vec` of the bytes of the file, mapped
+                               into memory rather than read
+    """
+    [path] = args
+    return files.map_file(path_of(path, "MapFile"))
+
+@builtin
+@procedure
+@arity(2)
+@named("WriteLines")
+def write_lines(args, env):
+    """
+    WriteLines["out.txt" Map[f OpenLines["in.txt"]]]
+    Writes each item on a line of its own, and returns how many it wrote.
+    """
+    path, seq = args
+    path = path_of(path, "WriteLines")
+    lines = iter(sequence(seq, "WriteLines"))
+    args.clear() # So that a `Seq` is written in constant memory
+    del seq
+    return Number(files.write_lines(path, lines))
+
+@builtin
+@arity(2)
+@named("With-File")
+def with_file(args, env):
+    """
+    With-File['(lines OpenLines["a.txt"]) WriteLines["b.txt" Map[f lines]]]
+    Binds variables as `Let` does, and closes the files opened while it
+    runs once it is done. A variable bound to a file's lines keeps those
+    read in memory: walk them where they are opened to stream the file.
+    """
+    with files.closing():
+        return let.apply(args, env)
+
+@compiles(with_file)
+def compile_with_file(args, scope, tail):
+    # Not in tail position: a tail call would run after the files closed
+    let_code = compile_let(args, scope, False)
+    if let_code is None:
+        return None
+
+    def code(env):
+        with files.closing():
+            return let_code(env)
+    return code
+
 @builtin
 @procedure
 @arity(1)
@@ -307,6 +1275,14 @@ def dec(args, env):
     [n] = args
     return n - 1
 
+VECTOR_OPS.update({plus: add, minus: sub, times: mul, divide: truediv})
+REDUCTIONS.update({plus: add, times: mul})
+PURE.update({plus, minus, times, divide, all_eq, less, greater, not_, type_,
+             inc, dec, dict_, get, contains, assoc, dissoc, keys})
+seq_walkers.update({map_, filter_, reduce_, take, drop, write_lines})
+seq_makers.update({map_, filter_, take, drop, range_, iterate, open_lines,
+                   read_chunks})
+
 builtins = collect_builtins(locals())
 builtins.locals[Symbol("Nil")] = nil
 
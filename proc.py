@@ -1,20 +1,222 @@
-from env import Env
+from env import Env, Frame
+from scope import Scope
 from AST import Expression, Symbol
-from typing import Collection
+from collections import OrderedDict
+from collections.abc import Collection
 
 class Procedure(Expression):
-    def __init__(self, formals: Collection[Symbol], body, creation_env: Env):
+    __slots__ = ("formals", "body", "creation_env", "code", "scope", "memo",
+                 "name")
+
+    # When set, procedure bodies are run by the reference tree-walker
+    # (`Expression.evaluate`) instead of their compiled closures.
+    tree_walk = False
+
+    def __init__(self, formals: "Collection[Symbol]", body, creation_env: Env,
+                 code=None, scope: Scope = None, name=None):
         self.formals = formals # The names of the formal parameters
         self.body = body # The body AST
         self.creation_env = creation_env # A ref to the env where the proc was defined
+        self.code = code # The compiled body, built on first application if not given
+        self.scope = scope # The layout of the frames `code` runs in
+        self.memo = None # The `Memo` of past results, if memoized
+        self.name = name # The name given by `Defn`, if any
 
     def apply(self, args):
+        proc = self
+
+        # Calls in tail position return a `TailCall` instead of making
+        # the call themselves, so they run here in constant stack space
+        if proc.memo is None and not Procedure.tree_walk:
+            while True:
+                frame = proc.frame(args) # Compiles `code` if need be
+                res = proc.code(frame)
+
+                if type(res) is not TailCall:
+                    return res
+
+                proc, args = res.proc, res.args
+
+                if proc.memo is not None:
+                    break
+
+        return proc.apply_memoized(args)
+
+    def apply_memoized(self, args):
+        """
+        `apply`, for when memoized procedures may be called (or the
+        tree-walker or `profiler` is in use). Stores the result of each
+        memoized call made along the way, tail calls included.
+        """
+        proc = self
+        waiting = None # Memoized calls whose result is this call's result
+
+        while True:
+            memo = proc.memo
+            if memo is not None:
+                key = tuple(args)
+                res = memo.lookup(key)
+                if res is not None:
+                    break
+                if waiting is None:
+                    waiting = []
+                waiting.append((memo, key))
+
+            res = proc.step(args)
+
+            if type(res) is not TailCall:
+                break
+
+            proc, args = res.proc, res.args
+
+        if waiting is not None:
+            for memo, key in waiting:
+                memo.store(key, res)
+        return res
+
+    def step(self, args):
+        """
+        Runs the body once, returning its value or the `TailCall` it ends
+        with.
+        """
+        if Procedure.tree_walk:
+            return self.walk(args)
+        frame = self.frame(args) # Compiles `code` if need be
+        return self.code(frame)
+
+    def walk(self, args):
+        """
+        Applies the procedure with the reference tree-walker.
+        """
         if len(self.formals) != len(args):
             raise Exception("Wrong number of arguments!")
-
         local_bindings = dict(zip(self.formals, args))
         env = Env(locals_=local_bindings, parent=self.creation_env)
         return self.body.evaluate(env)
 
+    def frame(self, args):
+        """
+        Returns the `Frame` that `code` runs in when applied to `args`.
+        """
+        if len(self.formals) != len(args):
+            raise Exception("Wrong number of arguments!")
+
+        if self.code is None:
+            self.compile_body()
+
+        slots = args if type(args) is list else list(args)
+        missing = len(self.scope.names) - len(slots)
+        if missing:
+            slots.extend([None] * missing)
+
+        return Frame(self.scope, slots, self.creation_env)
+
+    def compile_body(self):
+        """
+        Compiles `body` for procedures created without going through the
+        compiler (eg. by the tree-walker), resolving its variables against
+        the frames it was created in.
+        """
+        parent = self.creation_env
+        parent_scope = parent.scope if type(parent) is Frame else None
+        self.scope = Scope(self.formals, parent_scope)
+        self.scope.declare_definitions(self.body)
+        self.code = self.body.compile(self.scope, tail=True)
+
+    def memoized(self, size=None):
+        """
+        Returns a copy of the procedure that remembers its results in a
+        new `Memo` of `size` entries.
+        """
+        proc = Procedure(self.formals, self.body, self.creation_env,
+                         code=self.code, scope=self.scope, name=self.name)
+        proc.memo = Memo(size)
+        return proc
+
+    def __getstate__(self):
+        # The compiled body is made of closures, which can't be pickled,
+        # so it is compiled again where it is unpickled, when first applied
+        state = {name: getattr(self, name) for name in Procedure.__slots__}
+        state["code"] = state["scope"] = None
+        return None, state # Of the instance's dict (it has none), and slots
+
+    def __str__(self):
+        if self.name is None:
+            return "<Procedure>"
+        return f"<Procedure {self.name}>"
+
     def evaluate(self, env):
         return self
+
+
+class TailCall:
+    """
+    A call to `proc` made from tail position, left for the caller's
+    `Procedure.apply` loop to perform.
+    """
+    __slots__ = ("proc", "args")
+
+    def __init__(self, proc, args):
+        self.proc = proc
+        self.args = args
+
+
+class Macro(Expression):
+    """
+    A procedure that a call applies to its unevaluated arguments, giving
+    the code to run in place of the call. Each call is expanded once, see
+    `SExpression.expand`.
+    """
+    __slots__ = ("proc", "name")
+
+    def __init__(self, proc):
+        self.proc = proc # Builds the expansion
+        self.name = proc.name
+
+    def expand(self, args):
+        return self.proc.apply(list(args))
+
+    def __str__(self):
+        return f"<Macro {self.name}>"
+
+    def evaluate(self, env):
+        return self
+
+
+class Memo:
+    """
+    The results of a memoized procedure, keyed on its argument tuples.
+    Holds at most `size` results (`DEFAULT_SIZE` if `None`), evicting
+    the least recently used first.
+    """
+    DEFAULT_SIZE = 1024
+
+    def __init__(self, size=None):
+        self.size = size if size is not None else Memo.DEFAULT_SIZE
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """
+        Returns the result remembered for `key`, or `None`.
+        """
+        try:
+            res = self.results[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        except TypeError: # Unhashable arguments, eg. a `Procedure`
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.results.move_to_end(key)
+        return res
+
+    def store(self, key, res):
+        try:
+            self.results[key] = res
+        except TypeError:
+            return
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
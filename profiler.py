@@ -0,0 +1,147 @@
+"""
+Profiles misp code by the procedures and builtins it calls, counting the
+calls to each and timing them, and records the time spent in each stack
+of misp calls for flamegraph tools.
+
+Nothing is instrumented until `enable` swaps in timed versions of the
+methods and builtins involved, so code runs at full speed otherwise.
+"""
+
+from time import perf_counter_ns
+
+from proc import Procedure
+from builtin import BuiltIn
+import vm
+
+
+class Stats:
+    def __init__(self):
+        self.calls = 0
+        self.self_ns = 0 # Not counting the calls it makes
+        self.cumulative_ns = 0 # Counting the calls it makes, once each
+
+
+class Profile:
+    """
+    The calls made while profiling. A procedure reached by a tail call
+    replaces its caller in the stack, as its frame does.
+    """
+    def __init__(self):
+        self.stats = {} # Name to `Stats`
+        self.stacks = {} # Stack of names, outermost first, to self time
+        self.active = {} # Name to how many calls to it are underway
+        self.frames = [] # [name, stack, start, time in callees] per call
+
+    def enter(self, name):
+        stack = self.frames[-1][1] + (name,) if self.frames else (name,)
+        self.active[name] = self.active.get(name, 0) + 1
+        self.frames.append([name, stack, perf_counter_ns(), 0])
+
+    def leave(self):
+        name, stack, start, callees_ns = self.frames.pop()
+        elapsed = perf_counter_ns() - start
+        if self.frames:
+            self.frames[-1][3] += elapsed
+
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = Stats()
+        stats.calls += 1
+        stats.self_ns += elapsed - callees_ns
+        self.stacks[stack] = self.stacks.get(stack, 0) + elapsed - callees_ns
+
+        self.active[name] -= 1
+        if not self.active[name]: # The outermost of recursive calls
+            stats.cumulative_ns += elapsed
+
+    def timed(self, name, fn):
+        """
+        Returns `fn`, counting each call to it as a call to `name`.
+        """
+        def timed_fn(*args):
+            self.enter(name)
+            try:
+                return fn(*args)
+            finally:
+                self.leave()
+        return timed_fn
+
+    def report(self):
+        """
+        Returns a table of the stats of each name, by descending self time.
+        """
+        lines = [f"{'calls':>10} {'self (ms)':>11} {'cumulative (ms)':>16}  name"]
+        by_self = sorted(self.stats.items(), key=lambda item: -item[1].self_ns)
+        for name, stats in by_self:
+            lines.append(f"{stats.calls:>10} {stats.self_ns / 1e6:>11.3f} "
+                         f"{stats.cumulative_ns / 1e6:>16.3f}  {name}")
+        return "\n".join(lines)
+
+    def collapsed(self):
+        """
+        Returns the self time of each stack in microseconds, in the
+        collapsed format read by eg. `flamegraph.pl` and speedscope.
+        """
+        return "\n".join(f"{';'.join(stack)} {ns // 1000}"
+                         for stack, ns in sorted(self.stacks.items()))
+
+
+def name_of(proc):
+    return proc.name if proc.name is not None else "<fn>"
+
+BUILTIN_ATTRS = ("fn", "proc_fn", "primitive")
+
+# The state `disable` restores
+_original = None
+
+
+def enable(builtins):
+    """
+    Starts profiling calls to procedures and to the `BuiltIn`s in the
+    `Env` `builtins`, returning the `Profile` they are recorded in.
+    """
+    global _original
+    assert _original is None, "Already profiling"
+
+    profile = Profile()
+    step = Procedure.step
+
+    def timed_step(proc, args):
+        profile.enter(name_of(proc))
+        try:
+            return step(proc, args)
+        finally:
+            profile.leave()
+
+    _original = (Procedure.apply, step, vm.inline_calls, [])
+
+    # Every call goes through `step` once `apply` is the general loop
+    Procedure.apply = Procedure.apply_memoized
+    Procedure.step = timed_step
+    vm.inline_calls = False
+
+    for b in builtins.locals.values():
+        if type(b) is not BuiltIn:
+            continue
+        saved = {attr: getattr(b, attr) for attr in BUILTIN_ATTRS}
+        _original[3].append((b, saved))
+        for attr, fn in saved.items():
+            if fn is not None:
+                setattr(b, attr, profile.timed(b.name, fn))
+
+    return profile
+
+
+def disable():
+    """
+    Stops profiling, restoring everything `enable` instrumented.
+    """
+    global _original
+    apply, step, inline_calls, builtins = _original
+    Procedure.apply = apply
+    Procedure.step = step
+    vm.inline_calls = inline_calls
+    for b, saved in builtins:
+        for attr, fn in saved.items():
+            setattr(b, attr, fn)
+    _original = None
@@ -0,0 +1,73 @@
+"""
+Reads top-level forms from a stream of lines one at a time, so a program
+can be evaluated as it is read without holding all of it in memory.
+"""
+
+OPENERS = {"LPAREN", "LBRACK", "LBRACE", "HASHBRACE"}
+CLOSERS = {"RPAREN", "RBRACK", "RBRACE"}
+# Need an expression after them
+PREFIXES = {"QUOTE", "QUASIQUOTE", "UNQUOTE", "UNQUOTE_SPLICING"}
+
+
+def chunks(lines):
+    """
+    Joins lines into chunks that can be tokenized separately, ie. that
+    don't split a string literal (which may span lines).
+    """
+    chunk = []
+    quotes = 0
+    for line in lines:
+        chunk.append(line)
+        quotes += line.count('"')
+        if quotes % 2 == 0:
+            yield "".join(chunk)
+            chunk = []
+            quotes = 0
+    if chunk:
+        yield "".join(chunk)
+
+
+def read_forms(lines, lexer, parser, interactive=False):
+    """
+    Yields the AST of each top-level form in `lines` as soon as it is
+    complete. A form is complete once its brackets are balanced and the
+    next token isn't a `[` applying it (as in `f[x]`), so it is yielded
+    when the token after it is read, or at the end of the stream.
+
+    If `interactive` is set, as when `lines` are typed in, a form that is
+    complete at the end of a line is yielded then rather than once the
+    next line is read, so it can't be applied by a `[` on the next line.
+    """
+    pending = []
+    depth = 0
+    complete = False
+
+    for chunk in chunks(lines):
+        for tok in lexer.tokenize(chunk):
+            if complete and tok.type != "LBRACK":
+                yield from parse_form(pending, parser)
+                pending = []
+
+            pending.append(tok)
+
+            if tok.type in OPENERS:
+                depth += 1
+            elif tok.type in CLOSERS:
+                depth -= 1
+
+            complete = depth == 0 and tok.type not in PREFIXES
+
+        if interactive and complete:
+            yield from parse_form(pending, parser)
+            pending = []
+            complete = False
+
+    if pending:
+        yield from parse_form(pending, parser)
+
+
+def parse_form(toks, parser):
+    ast_list = parser.parse(iter(toks))
+    if ast_list is None:
+        raise SyntaxError("Could not parse: " + " ".join(str(t.value) for t in toks))
+    return ast_list
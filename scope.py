@@ -0,0 +1,73 @@
+from AST import Symbol, SExpression, Guarded
+
+# Forms whose arguments are not compiled in the enclosing scope, so
+# definitions inside them don't belong to it
+OPAQUE_FORMS = {Symbol("Fn"), Symbol("Let"), Symbol("Quote"), Symbol("Quasiquote")}
+
+
+class Scope:
+    """
+    The compile-time layout of a `Frame`: assigns each local variable of
+    a procedure (or `Let`) a slot. Scopes nest like the frames they
+    describe, so the compiler can resolve a symbol to (depth, slot)
+    coordinates once instead of searching for it by name at runtime.
+    `level` is the number of scopes this one is nested in, which indexes
+    its frames in the display of the frames nested in them (see
+    `Frame.display`).
+    """
+
+    def __init__(self, names, parent=None):
+        self.names = []
+        self.slots = {}
+        self.parent = parent
+        self.level = parent.level + 1 if parent is not None else 0
+        for name in names:
+            self.declare(name)
+
+    def declare(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.names)
+            self.names.append(name)
+        return self.slots[name]
+
+    def resolve(self, name):
+        """
+        Returns the (depth, slot) coordinates of `name`, or `None` if it
+        isn't a local variable of any enclosing scope.
+        """
+        depth, scope = 0, self
+        while scope is not None:
+            slot = scope.slots.get(name)
+            if slot is not None:
+                return depth, slot
+            depth, scope = depth + 1, scope.parent
+        return None
+
+    def declare_definitions(self, expr):
+        """
+        Reserves slots for the variables that `Def` and `Defn` forms in
+        `expr` will define, so references compiled before the definition
+        (eg. in mutually recursive helpers) still resolve to the local.
+        """
+        if type(expr) is Guarded:
+            self.declare_definitions(expr.original)
+            return
+        if type(expr) is not SExpression or len(expr) == 0:
+            return
+
+        head, *args = expr
+
+        if head == Symbol("Def") and args and type(args[0]) is Symbol:
+            self.declare(args[0])
+        elif head == Symbol("Defn") and args and type(args[0]) is SExpression \
+                and len(args[0]) > 0 and type(args[0][0]) is Symbol:
+            self.declare(args[0][0])
+            return
+        elif type(head) is Symbol and head in OPAQUE_FORMS:
+            return
+
+        for e in expr:
+            self.declare_definitions(e)
+
+    def __repr__(self):
+        return "Scope({}, parent: {})".format(self.names, self.parent)
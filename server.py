@@ -0,0 +1,223 @@
+"""
+Serves misp to many clients at once over a local socket (`misp --serve`).
+
+Each connection is a session with its own `Env`, whose parent is a
+read-only view of the global environment shared by every session. Each
+line a client sends is a request: misp source whose forms are evaluated
+in turn. The reply is a line holding `--> ` and the value of the last
+form, or `ERROR: ` and what went wrong, as in the REPL. A request of
+`%metrics` is instead answered with the server's metrics, as JSON.
+
+Requests are evaluated in threads of their own, so a slow request holds
+up neither the event loop nor other sessions. One that runs for longer
+than the timeout has `RequestTimeout` raised in its thread, and the
+client is told it timed out.
+"""
+
+import asyncio
+import ctypes
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from env import Env, ReadOnly
+
+METRICS_COMMAND = "%metrics"
+
+# The most recent latencies kept for percentiles
+LATENCY_WINDOW = 10000
+
+
+class RequestTimeout(Exception):
+    pass
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0 # Including timeouts
+        self.timeouts = 0
+        self.sessions = 0
+        self.active_sessions = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, seconds, error=False, timeout=False):
+        self.requests += 1
+        self.errors += error or timeout
+        self.timeouts += timeout
+        self.latencies.append(seconds)
+
+    def snapshot(self):
+        uptime = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1,
+                                 int(p / 100 * len(latencies)))] * 1e3
+
+        return {
+            "uptime_s": round(uptime, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "sessions": self.sessions,
+            "active_sessions": self.active_sessions,
+            "requests_per_s": round(self.requests / uptime, 3),
+            "latency_ms": {f"p{p}": round(percentile(p), 3)
+                           for p in (50, 90, 99)} |
+                          {"max": round(latencies[-1] * 1e3, 3)
+                           if latencies else 0.0},
+        }
+
+
+class Job:
+    """
+    Evaluates a request's forms in a thread of its own, which `cancel`
+    can interrupt.
+    """
+    def __init__(self, execute, forms, env, loop):
+        self.execute = execute
+        self.forms = forms
+        self.env = env
+        self.loop = loop
+        self.result = loop.create_future()
+        self.lock = threading.Lock()
+        self.thread = None # The id of the thread, while it evaluates
+        self.abandoned = False # Whether the result is no longer awaited
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        with self.lock:
+            self.thread = threading.get_ident()
+        try:
+            value = None
+            for ast in self.forms:
+                value = self.execute(ast, self.env)
+            outcome = (self.result.set_result, value)
+        except BaseException as e: # Including `RequestTimeout`
+            outcome = (self.result.set_exception, e)
+        finally:
+            with self.lock:
+                self.thread = None
+        if not self.abandoned:
+            try:
+                self.loop.call_soon_threadsafe(self.settle, *outcome)
+            except RuntimeError: # The loop has closed, eg. on shutdown
+                pass
+
+    def settle(self, set_outcome, outcome):
+        if not self.abandoned:
+            set_outcome(outcome)
+
+    def cancel(self):
+        """
+        Raises `RequestTimeout` in the thread, if it is still evaluating,
+        at the next Python instruction it runs.
+        """
+        self.abandoned = True
+        with self.lock:
+            if self.thread is not None:
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                    ctypes.c_ulong(self.thread),
+                    ctypes.py_object(RequestTimeout))
+
+
+class Server:
+    """
+    Evaluates requests with `execute(ast, env)` after parsing them with
+    `parse(source)`, in sessions over the global environment `env`.
+    """
+    def __init__(self, execute, parse, env, timeout=5.0):
+        self.execute = execute
+        self.parse = parse
+        self.shared = ReadOnly(env)
+        self.timeout = timeout
+        self.metrics = Metrics()
+
+    async def start(self, address):
+        """
+        Starts serving on `address`: a port of the loopback interface if
+        it is a number, otherwise the path of a Unix socket.
+        """
+        if str(address).isdigit():
+            return await asyncio.start_server(self.session, "127.0.0.1",
+                                              int(address))
+        return await asyncio.start_unix_server(self.session, address)
+
+    async def session(self, reader, writer):
+        env = Env(parent=self.shared)
+        self.metrics.sessions += 1
+        self.metrics.active_sessions += 1
+        try:
+            while line := await reader.readline():
+                source = line.decode().strip()
+                if not source:
+                    continue
+                if source == METRICS_COMMAND:
+                    reply = json.dumps(self.metrics.snapshot())
+                else:
+                    reply = await self.request(source, env)
+                writer.write(reply.encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError): # Eg. a line over the limit
+            pass
+        finally:
+            self.metrics.active_sessions -= 1
+            writer.close()
+
+    async def request(self, source, env):
+        start = time.perf_counter()
+        error = timeout = False
+        try:
+            # The parser isn't thread-safe, so this stays on the loop
+            forms = self.parse(source)
+            value = await self.evaluate(forms, env)
+            reply = "--> " + str(value)
+        except RequestTimeout:
+            timeout = True
+            reply = f"ERROR: timed out after {self.timeout}s"
+        except Exception as e:
+            error = True
+            reply = "ERROR: " + str(e)
+        self.metrics.record(time.perf_counter() - start, error, timeout)
+        return reply.replace("\n", "\\n") # Keep the reply to one line
+
+    async def evaluate(self, forms, env):
+        job = Job(self.execute, forms, env, asyncio.get_running_loop())
+        job.start()
+        try:
+            return await asyncio.wait_for(asyncio.shield(job.result),
+                                          self.timeout)
+        except asyncio.TimeoutError:
+            job.cancel()
+            raise RequestTimeout()
+
+
+def serve(address, execute, parse, env, timeout=5.0):
+    """
+    Serves until interrupted, then prints the metrics to stderr.
+    """
+    server = Server(execute, parse, env, timeout)
+
+    async def main():
+        listener = await server.start(address)
+        print(f"misp: serving on {address}", file=sys.stderr)
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if not str(address).isdigit() and os.path.exists(address):
+            os.remove(address)
+        print(json.dumps(server.metrics.snapshot(), indent=2), file=sys.stderr)
@@ -1,13 +1,40 @@
 from AST import SExpression, BuiltIn, Keyword, Expression, Number, Symbol
+from AST import TRUE, FALSE, NIL, Seq
+from builtin import special_forms, registry, arity_error
 from env import Env
-
-from functools import wraps
+from decimal import Decimal
 
 FLAG = "misp_intermediate_fn"
+PROCEDURE = "misp_procedure"
+ARITY = "misp_arity"
+NUMERIC = "misp_numeric"
 
 def builtin(f):
-    named = FLAG in f.__dict__.keys()
-    return BuiltIn(f, name=f.__name__ if named else None)
+    """
+    Makes the `BuiltIn` described by the decorators below it, which only
+    mark `f` (see `named`, `procedure`, `arity` and `number_map`). Each
+    way of calling it then gets a single function specialized to them,
+    rather than a wrapper per decorator:
+        `primitive`, for evaluated arguments known to be the right number
+        `proc_fn`, for evaluated arguments
+        `fn`, for unevaluated arguments, as special forms take them
+    """
+    meta = f.__dict__
+    name = f.__name__ if FLAG in meta else None
+    arity = meta.get(ARITY)
+    numeric = NUMERIC in meta
+    primitive = number_fn(f, name) if numeric else f
+
+    if PROCEDURE in meta:
+        b = BuiltIn(evaluating_fn(primitive, name, arity), name=name,
+                    proc_fn=checked_fn(primitive, name, arity), arity=arity,
+                    primitive=primitive, numeric=numeric)
+    else:
+        b = BuiltIn(checked_fn(primitive, name, arity), name=name,
+                    arity=arity)
+
+    registry[b.name] = b
+    return b
 
 def named(name):
     """
@@ -20,68 +47,162 @@ def named(name):
     return decorated_fn
 
 def procedure(f):
-    @wraps(f)
-    def wrapper(args, env):
-        args = [a.evaluate(env) for a in args]
-        return f(args, env)
-    return wrapper
+    """
+    Marks a builtin that evaluates its arguments before it is applied.
+    """
+    f.__dict__[PROCEDURE] = True
+    return f
 
-def arity(argc, ellipsis=None):
+def compiles(b):
+    """
+    Registers the decorated function as the compiler for the special
+    form `b`. It receives the form's unevaluated arguments and returns
+    a closure `code(env)`, or `None` if the form should instead be left
+    to `b` at runtime (eg. to report a malformed call).
+    """
     def decorated_fn(f):
-        @wraps(f)
-        def wrapper(args, env):
-
-            lt = len(args) < argc
-            gt = len(args) > argc
-            eq = len(args) == argc
-
-            if not eq and (ellipsis is not ... or not gt):
-                addendum = "at least " if lt and ellipsis is ... else ""
-                msg = f"Wrong number of arguments to `{f.__name__}`. " + \
-                      f"Expected {addendum}{argc}, got {len(args)}"
-                raise AssertionError(msg)
+        special_forms[Symbol(b.name)] = f
+        return f
+    return decorated_fn
 
-            return f(args, env)
-        return wrapper
+def arity(argc, ellipsis=None):
+    """
+    Marks a builtin that takes `argc` arguments, or at least `argc` if
+    `ellipsis` is `...`.
+    """
+    def decorated_fn(f):
+        f.__dict__[ARITY] = (argc, ellipsis)
+        return f
     return decorated_fn
 
 def number_map(f):
     """
-    Decorator that accepts a function with signature:
+    Marks a builtin accepting a function with signature:
         *PythonNumber -> PythonNumber
-    Returns a function with signature:
+    as one with signature:
         *Number -> Number
     """
-    @wraps(f)
-    def wrapper(args, env):
-        numbers = args
+    f.__dict__[NUMERIC] = True
+    return f
+
+def checked_fn(f, name, arity):
+    """
+    Returns `f`, checking that it is called with `arity` arguments.
+    """
+    if arity is None:
+        return f
+
+    argc, ellipsis = arity
+    if ellipsis is ...:
+        def variadic_fn(args, env):
+            if len(args) < argc:
+                raise arity_error(name, arity, len(args))
+            return f(args, env)
+        return variadic_fn
+
+    def fixed_fn(args, env):
+        if len(args) != argc:
+            raise arity_error(name, arity, len(args))
+        return f(args, env)
+    return fixed_fn
+
+def evaluating_fn(f, name, arity):
+    """
+    Returns `f`, checking that it is called with `arity` arguments and
+    evaluating them first.
+    """
+    argc, ellipsis = arity if arity is not None else (0, ...)
+    if ellipsis is ...:
+        def variadic_fn(args, env):
+            if len(args) < argc:
+                raise arity_error(name, arity, len(args))
+            return f([a.evaluate(env) for a in args], env)
+        return variadic_fn
+
+    def fixed_fn(args, env):
+        if len(args) != argc:
+            raise arity_error(name, arity, len(args))
+        return f([a.evaluate(env) for a in args], env)
+    return fixed_fn
+
+def number_fn(f, name):
+    """
+    Returns `f`, unwrapping the `Number`s it is called with and wrapping
+    the number it returns.
+    """
+    def numeric_fn(args, env):
+        numbers = number_values(args)
 
-        if any(type(n) is not Number for n in numbers):
-            msg = f"Arguments to `{f.__name__}` must all be numbers: {numbers}"
+        if numbers is None:
+            msg = f"Arguments to `{name}` must all be numbers: {args}"
             raise AssertionError(msg)
 
-        numbers = [n.value for n in numbers]
-        py_num = f(numbers, env)
-        
-        return Number(py_num)
-    return wrapper
+        return Number(f(numbers, env))
+    return numeric_fn
+
+def number_values(args):
+    """
+    Returns the Python numbers held by `args` if they are all `Number`s,
+    otherwise `None`.
+    """
+    values = [n.value for n in args if type(n) is Number]
+    if len(values) != len(args):
+        return None
+    for v in values:
+        if type(v) is float:
+            return exact_values(values)
+    return values
+
+def exact_values(values):
+    """
+    Returns the Python numbers `values`, with any `float`s (such as those
+    read from a `Vec`) made `Decimal`s if there are `Decimal`s among them,
+    which can't be mixed with `float`s.
+    """
+    if not any(type(v) is Decimal for v in values):
+        return values
+    return [Decimal(repr(v)) if type(v) is float else v for v in values]
+
+def integer(n):
+    """
+    Returns the value of the `Number` `n` as an `int` if it is a whole
+    number, which in `--numeric float` mode is a `float`, or `None`.
+    """
+    if type(n) is not Number:
+        return None
+    value = n.value
+    if type(value) is int:
+        return value
+    if type(value) is float and value.is_integer():
+        return int(value)
+    return None
+
+def integers(args):
+    """
+    Returns the `int` values of the `Number`s `args` as `integer` does, or
+    `None` if any of them isn't a whole number.
+    """
+    values = [integer(n) for n in args]
+    return None if None in values else values
 
 def truthy(expr: Expression) -> bool:
-    non_null = not expr == SExpression()
-    non_false = not expr == Keyword(":F")
-    return non_null and non_false
+    # `:F` and `Nil` are singletons, see `AST.InternedAtom`. A `Seq` is
+    # false once it is used up, as the empty list it stands for would be
+    if type(expr) is Seq:
+        return expr.force()
+    return expr is not NIL and expr is not FALSE
 
 def pybool_into_kwbool(e: bool) -> Keyword:
     if e:
-        return Keyword(":T")
+        return TRUE
     else:
-        return Keyword(":F")
+        return FALSE
 
 def expr_into_kwbool(e: Expression) -> Keyword:
     if truthy(e):
-        return Keyword(":T")
+        return TRUE
     else:
-        return Keyword(":F")
+        return FALSE
 
 
 def collect_builtins(locs):
@@ -0,0 +1,707 @@
+"""
+A bytecode compiler and stack-based virtual machine for misp.
+
+`compile_vm` lowers a parsed expression into a `Code` object, a list of
+`(opcode, argument)` instructions plus a constants pool, and `run`
+executes it. Calls between VM-compiled procedures push onto the VM's own
+call stack instead of recursing in Python, and tail calls replace the
+caller's frame. Builtins that evaluate their arguments are called as
+primitives, with their arity checked here, or, where the call's head is
+a global known to be bound to one when compiled, checked then and called
+without looking at the callee again (see `BUILTIN`).
+
+The VM is experimental: its dispatch loop still costs more than the
+closures `Expression.compile` builds, so `--vm` runs most programs a
+little slower than the default compiler.
+"""
+
+from AST import (Atom, Symbol, SExpression, Procedure, BuiltIn, TailCall,
+                 Macro, Guarded, known_builtin, global_value, unchecked,
+                 compiled_when_run)
+from env import Frame
+from scope import Scope
+from utils import truthy, arity_error, pybool_into_kwbool
+from prelude import (quoted_symbols, quoted_pairs, all_type,
+                     compile_quasiquote, compile_with_file)
+
+OPNAMES = [
+    "CONST",         # Push `consts[arg]`
+    "LOAD_LOCAL",    # Push slot `arg` of the current frame
+    "LOAD_OUTER",    # Push slot `arg[1]` of the frame at level `arg[0]`
+    "LOAD_GLOBAL",   # Push the global `arg`
+    "LOAD_NAME",     # Push the variable `arg`, looked up by name
+    "STORE_LOCAL",   # Store the top of stack in slot `arg`
+    "STORE_OUTER",   # Store the top of stack in slot `arg[1]`, at level `arg[0]`
+    "STORE_GLOBAL",  # Store the top of stack in the global `arg`
+    "STORE_NAME",    # Store the top of stack in the variable `arg`, by name
+    "DECLARE_NAME",  # Declare `arg` in the current environment
+    "POP",           # Discard the top of stack
+    "JUMP",          # Jump to `arg`
+    "JUMP_IF_FALSE", # Pop, and jump to `arg` if falsy
+    "JUMP_IF_FALSE_OR_POP", # Jump to `arg` if the top is falsy, else pop it
+    "JUMP_IF_TRUE_OR_POP",  # Jump to `arg` if the top is truthy, else pop it
+    "CALLABLE",      # Check the callee on top of stack, or the global `arg[0]`
+    "CALL",          # Call the callee under the top `arg` values with them
+    "TAIL_CALL",     # `CALL`, then return its value
+    "RETURN",        # Return the top of stack to the caller
+    "MAKE_PROC",     # Push a closure over the current frame of `consts[arg]`
+    "ENTER",         # Pop `arg[1]` values into a new frame laid out by `arg[0]`
+    "LEAVE",         # Return to the frame the current one was `ENTER`ed from
+    "CLOSURE",       # Push the value of the closure-compiled code `arg`
+    "BUILTIN",       # Check the global `arg[0]` is still `arg[1]`; see `run`
+    "CALL_BUILTIN",  # Push the primitive of `arg[0]` called on the top `arg[1]`
+    "BUILTIN_ON",    # `BUILTIN` and `CALL_BUILTIN` on locals and constants
+]
+
+(CONST, LOAD_LOCAL, LOAD_OUTER, LOAD_GLOBAL, LOAD_NAME, STORE_LOCAL,
+ STORE_OUTER, STORE_GLOBAL, STORE_NAME, DECLARE_NAME, POP, JUMP,
+ JUMP_IF_FALSE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP, CALLABLE, CALL,
+ TAIL_CALL, RETURN, MAKE_PROC, ENTER, LEAVE, CLOSURE, BUILTIN,
+ CALL_BUILTIN, BUILTIN_ON) = range(len(OPNAMES))
+
+
+class Code:
+    def __init__(self, name):
+        self.name = name
+        self.instructions = []
+        self.consts = []
+
+    def emit(self, op, arg=None):
+        self.instructions.append((op, arg))
+        return len(self.instructions) - 1
+
+    def const(self, value):
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def here(self):
+        return len(self.instructions)
+
+    def patch(self, index, arg):
+        op, _ = self.instructions[index]
+        self.instructions[index] = (op, arg)
+
+
+class ProcTemplate:
+    """
+    Everything `MAKE_PROC` needs to build a `Procedure`, bar the frame
+    it closes over.
+    """
+    def __init__(self, name, formals, body, scope, code):
+        self.name = name # `None` for anonymous procedures
+        self.formals = formals
+        self.body = body
+        self.scope = scope
+        self.code = code
+
+
+class VMBody:
+    """
+    The `code` of a VM-compiled `Procedure`, so it can still be applied
+    from Python (eg. by builtins) like any other.
+    """
+    def __init__(self, code):
+        self.code = code
+        # For `run` to switch to without going through `code`
+        self.instructions = code.instructions
+        self.consts = code.consts
+
+    def __call__(self, frame):
+        return run(self.code, frame, in_proc=True)
+
+
+def compile_vm(expr, name="<top-level>"):
+    """
+    Compiles a top-level expression into `Code` that returns its value.
+    """
+    code = Code(name)
+    emit_expr(code, expr, None, tail=True)
+    return code
+
+
+def emit_expr(code, expr, scope, tail):
+    """
+    Emits instructions that push the value of `expr` or, if `tail` is set,
+    return it.
+    """
+    if type(expr) is Symbol:
+        emit_load(code, expr, scope)
+    elif type(expr) is SExpression and len(expr) > 0:
+        head = expr.head()
+        known_builtin(head, expr.body(), scope) # Reports bad calls now
+        if type(head) is Symbol and head in FORMS and \
+                (scope is None or scope.resolve(head) is None):
+            if FORMS[head](code, expr.body(), scope, tail):
+                return
+        emit_call(code, expr, scope, tail)
+        return
+    elif type(expr) is Guarded:
+        emit_guarded(code, expr, scope, tail)
+        return
+    elif isinstance(expr, Atom) or type(expr) in (Procedure, BuiltIn):
+        code.emit(CONST, code.const(expr))
+    else:
+        code.emit(CLOSURE, expr.compile(scope))
+
+    if tail:
+        code.emit(RETURN)
+
+
+def emit_load(code, sym, scope):
+    address = scope.resolve(sym) if scope is not None else None
+    if scope is None:
+        code.emit(LOAD_NAME, sym)
+    elif address is None:
+        code.emit(LOAD_GLOBAL, sym)
+    elif address[0] == 0:
+        code.emit(LOAD_LOCAL, address[1])
+    else:
+        code.emit(LOAD_OUTER, (scope.level - address[0], address[1]))
+
+
+def emit_store(code, sym, scope):
+    address = scope.resolve(sym) if scope is not None else None
+    if scope is None:
+        code.emit(STORE_NAME, sym)
+    elif address is None:
+        code.emit(STORE_GLOBAL, sym)
+    elif address[0] == 0:
+        code.emit(STORE_LOCAL, address[1])
+    else:
+        code.emit(STORE_OUTER, (scope.level - address[0], address[1]))
+
+
+def emit_call(code, form, scope, tail):
+    args = form.body()
+    head = form.head()
+    known = known_builtin(head, args, scope)
+    if known is not None and known.primitive is not None:
+        emit_builtin_call(code, known, form, scope, tail)
+        return
+    # A global callee is loaded by `CALLABLE` itself
+    loaded = global_head(head, scope)
+    if loaded is None:
+        emit_expr(code, head, scope, tail=False)
+    callable_ = code.emit(CALLABLE)
+    if type(global_value(head, scope)) is Macro or \
+            known is not None and known.proc_fn is None:
+        # The arguments are data for the macro or special form, not code
+        # to compile
+        for arg in args:
+            code.emit(CLOSURE, compiled_when_run(arg, scope))
+    elif known is None:
+        for arg in args:
+            emit_unchecked(code, arg, scope)
+    else:
+        for arg in args:
+            emit_expr(code, arg, scope, tail=False)
+    code.emit(TAIL_CALL if tail else CALL, len(args))
+    # With the macro last called here, and its expansion, see `expand`
+    code.patch(callable_,
+               (loaded, code.here(), args, form, tail, [None, None]))
+    if tail:
+        code.emit(RETURN) # Only reached when `CALLABLE` skips the call
+
+
+def global_head(head, scope):
+    """
+    Returns `head` if it is a global variable, looked up in `top` as by
+    `LOAD_GLOBAL`, otherwise `None`.
+    """
+    if type(head) is Symbol and scope is not None and \
+            scope.resolve(head) is None:
+        return head
+    return None
+
+
+def emit_builtin_call(code, builtin, form, scope, tail):
+    """
+    Emits a call to the global `builtin`, checked against it here, that
+    calls its primitive directly, as `AST.builtin_call` does. `BUILTIN`
+    leaves `form` to the tree-walker instead if the global has been bound
+    to something else since.
+    """
+    args = form.body()
+    check = code.emit(BUILTIN)
+    for arg in args:
+        emit_expr(code, arg, scope, tail=False)
+
+    loads = code.instructions[check + 1:]
+    if scope is not None and len(loads) == len(args) and \
+            all(op in (LOAD_LOCAL, CONST) for op, _ in loads):
+        # Each argument is a single load, done by the call instead, as
+        # the (slot, constant) pairs `operands`
+        operands = tuple((arg, None) if op == LOAD_LOCAL
+                         else (None, code.consts[arg]) for op, arg in loads)
+        del code.instructions[check:]
+        code.emit(BUILTIN_ON, (form.head(), builtin, form, operands))
+    else:
+        code.emit(CALL_BUILTIN, (builtin, len(args)))
+        # Looked up by name, like `LOAD_NAME`, outside of any scope
+        code.patch(check, (form.head(), builtin, code.here(), form,
+                           scope is None))
+    emit_return_if(code, tail)
+
+
+def emit_unchecked(code, arg, scope):
+    """
+    Emits `arg`, or, if compiling it reports a bad call, code raising that
+    error once run (see `AST.unchecked`), as a call's head may still turn
+    out to be a macro taking `arg` as data.
+    """
+    start = code.here()
+    try:
+        emit_expr(code, arg, scope, tail=False)
+    except AssertionError:
+        del code.instructions[start:]
+        code.emit(CLOSURE, unchecked(arg, scope))
+
+
+def emit_guarded(code, guarded, scope, tail):
+    holds = guarded.compile_check(scope)
+    code.emit(CLOSURE, lambda env: pybool_into_kwbool(holds(env)))
+    jump_original = code.emit(JUMP_IF_FALSE)
+    emit_expr(code, guarded.optimized, scope, tail)
+    if not tail:
+        jump_end = code.emit(JUMP)
+    code.patch(jump_original, code.here())
+    emit_expr(code, guarded.original, scope, tail)
+    if not tail:
+        code.patch(jump_end, code.here())
+
+
+def emit_proc(code, name, params, body, scope):
+    fn_scope = Scope(params, scope)
+    fn_scope.declare_definitions(body)
+    fn_code = Code(name if name is not None else "<fn>")
+    emit_expr(fn_code, body, fn_scope, tail=True)
+    template = ProcTemplate(name, params, body, fn_scope, fn_code)
+    code.emit(MAKE_PROC, code.const(template))
+
+
+# Emitters for special forms, mirroring the closure compilers in `prelude`.
+# Each returns `False` if the form is malformed and should be left to the
+# builtin at runtime.
+FORMS = {}
+
+def form(name):
+    def decorated_fn(f):
+        FORMS[Symbol(name)] = f
+        return f
+    return decorated_fn
+
+def emit_return_if(code, tail):
+    if tail:
+        code.emit(RETURN)
+
+@form("Quote")
+def emit_quote(code, args, scope, tail):
+    if len(args) != 1:
+        return False
+    code.emit(CONST, code.const(args[0]))
+    emit_return_if(code, tail)
+    return True
+
+@form("Quasiquote")
+def emit_quasiquote(code, args, scope, tail):
+    template = compile_quasiquote(args, scope, tail)
+    if template is None:
+        return False
+    code.emit(CLOSURE, template)
+    emit_return_if(code, tail)
+    return True
+
+@form("If")
+def emit_if(code, args, scope, tail):
+    if len(args) != 3:
+        return False
+    condition, consequent, alternative = args
+    emit_expr(code, condition, scope, tail=False)
+    jump_alternative = code.emit(JUMP_IF_FALSE)
+    emit_expr(code, consequent, scope, tail)
+    if not tail:
+        jump_end = code.emit(JUMP)
+    code.patch(jump_alternative, code.here())
+    emit_expr(code, alternative, scope, tail)
+    if not tail:
+        code.patch(jump_end, code.here())
+    return True
+
+@form("Do")
+def emit_do(code, args, scope, tail):
+    if len(args) < 1:
+        return False
+    *init, last = args
+    for arg in init:
+        emit_expr(code, arg, scope, tail=False)
+        code.emit(POP)
+    emit_expr(code, last, scope, tail)
+    return True
+
+def emit_short_circuit(code, args, scope, tail, jump_op):
+    if len(args) < 1:
+        return False
+    *init, last = args
+    jumps = []
+    for arg in init:
+        emit_expr(code, arg, scope, tail=False)
+        jumps.append(code.emit(jump_op))
+    emit_expr(code, last, scope, tail)
+    for jump in jumps:
+        code.patch(jump, code.here())
+    if jumps:
+        emit_return_if(code, tail)
+    return True
+
+@form("And")
+def emit_and(code, args, scope, tail):
+    return emit_short_circuit(code, args, scope, tail, JUMP_IF_FALSE_OR_POP)
+
+@form("Or")
+def emit_or(code, args, scope, tail):
+    return emit_short_circuit(code, args, scope, tail, JUMP_IF_TRUE_OR_POP)
+
+@form("Fn")
+def emit_fn(code, args, scope, tail):
+    if len(args) != 2 or not quoted_symbols(args[0]):
+        return False
+    [quote, params], body = args
+    emit_proc(code, None, params, body, scope)
+    emit_return_if(code, tail)
+    return True
+
+@form("Def")
+def emit_def(code, args, scope, tail):
+    if len(args) != 2 or type(args[0]) is not Symbol:
+        return False
+    sym, val = args
+    if scope is None:
+        code.emit(DECLARE_NAME, sym)
+    else:
+        scope.declare(sym)
+    emit_expr(code, val, scope, tail=False)
+    emit_store(code, sym, scope)
+    emit_return_if(code, tail)
+    return True
+
+@form("Defn")
+def emit_defn(code, args, scope, tail):
+    if len(args) != 2:
+        return False
+    header, body = args
+    if type(header) is not SExpression or len(header) == 0 \
+            or not all_type(header, Symbol):
+        return False
+    name, *params = header
+    if scope is None:
+        code.emit(DECLARE_NAME, name)
+    else:
+        scope.declare(name)
+    emit_proc(code, str(name), SExpression(*params), body, scope)
+    emit_store(code, name, scope)
+    emit_return_if(code, tail)
+    return True
+
+@form("Set!")
+def emit_set_bang(code, args, scope, tail):
+    if len(args) != 2 or type(args[0]) is not Symbol:
+        return False
+    sym, val = args
+    emit_expr(code, val, scope, tail=False)
+    emit_store(code, sym, scope)
+    emit_return_if(code, tail)
+    return True
+
+@form("Let")
+def emit_let(code, args, scope, tail):
+    if len(args) != 2 or not quoted_pairs(args[0]):
+        return False
+    [quote, defs], body = args
+    let_scope = Scope(defs[::2], scope)
+    let_scope.declare_definitions(body)
+    for val in defs[1::2]:
+        emit_expr(code, val, scope, tail=False)
+    code.emit(ENTER, (let_scope, len(defs) // 2))
+    emit_expr(code, body, let_scope, tail)
+    if not tail:
+        code.emit(LEAVE)
+    return True
+
+@form("With-File")
+def emit_with_file(code, args, scope, tail):
+    # Closes its files in a `finally`, which the VM has no ops for
+    with_file = compile_with_file(args, scope, tail)
+    if with_file is None:
+        return False
+    code.emit(CLOSURE, with_file)
+    emit_return_if(code, tail)
+    return True
+
+
+def expand(form, macro, tail, expanded, env):
+    """
+    Returns the value of `form`, a call to `macro`, compiling its expansion
+    to closures (as `Eval` does) only the first time. If `tail` is set, the
+    value may be a `TailCall`.
+    """
+    if expanded[0] is not macro:
+        scope = env.scope if type(env) is Frame else None
+        expanded[:] = macro, form.expand(macro).compile(scope, tail)
+    if type(env) is Frame:
+        env.fit() # The expansion may have declared new locals
+    return expanded[1](env)
+
+
+# Whether calls to VM-compiled procedures run in `run`'s own loop rather
+# than through `Procedure.apply` (which `profiler` needs to see them)
+inline_calls = True
+
+def run(code, env, in_proc=False):
+    """
+    Executes `code` in `env`, returning the value it returns. If `in_proc`
+    is set, `code` is a procedure body, and may return a `TailCall`.
+    """
+    inline = inline_calls
+    instructions = code.instructions
+    consts = code.consts
+    pc = 0
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    calls = [] # The (instructions, consts, pc, env) to return to
+
+    while True:
+        op, arg = instructions[pc]
+        pc += 1
+
+        if op == LOAD_LOCAL:
+            push(env.slots[arg])
+
+        elif op == BUILTIN_ON:
+            name, fn, form, operands = arg
+            if env.top[name] is fn:
+                slots = env.slots
+                args = []
+                for slot, value in operands:
+                    args.append(value if slot is None else slots[slot])
+                push(fn.primitive(args, env))
+                args = None # As for `CALL`
+            else:
+                push(form.evaluate(env))
+
+        elif op == BUILTIN:
+            name, fn, target, form, by_name = arg
+            if (env[name] if by_name else env.top[name]) is not fn:
+                push(form.evaluate(env))
+                pc = target
+
+        elif op == CALL_BUILTIN:
+            fn, argc = arg
+            if argc == 2:
+                args = stack[-2:]
+                del stack[-2:]
+            else:
+                split = len(stack) - argc
+                args = stack[split:]
+                del stack[split:]
+            push(fn.primitive(args, env))
+            args = None # As for `CALL`
+
+        elif op == CONST:
+            push(consts[arg])
+
+        elif op == LOAD_GLOBAL:
+            try:
+                push(env.top[arg])
+            except KeyError:
+                push(env[arg]) # See `Symbol.compile`
+
+        elif op == CALLABLE:
+            # Special forms need their arguments unevaluated, and other
+            # values are re-evaluated or rejected, as by the tree-walker
+            name = arg[0]
+            if name is None:
+                fn = stack[-1]
+            else:
+                try:
+                    fn = env.top[name]
+                except KeyError:
+                    fn = env[name] # See `Symbol.compile`
+                push(fn)
+            if type(fn) is not Procedure and \
+                    (type(fn) is not BuiltIn or fn.proc_fn is None):
+                _, target, args, form, tail, expanded = arg
+                pop()
+                if type(fn) is Macro:
+                    value = expand(form, fn, tail, expanded, env)
+                    if type(value) is TailCall:
+                        if not calls and in_proc:
+                            return value
+                        value = value.proc.apply(value.args)
+                    push(value)
+                    value = None
+                else:
+                    push(SExpression(fn, *args).evaluate(env))
+                pc = target
+
+        elif op == CALL or op == TAIL_CALL:
+            split = len(stack) - arg
+            args = stack[split:]
+            del stack[split:]
+            fn = pop()
+
+            if type(fn) is Procedure:
+                if inline and type(fn.code) is VMBody and fn.memo is None:
+                    if op == CALL:
+                        calls.append((instructions, consts, pc, env))
+                    env = fn.frame(args)
+                    instructions = fn.code.instructions
+                    consts = fn.code.consts
+                    pc = 0
+                    continue
+                if op == TAIL_CALL and not calls and in_proc:
+                    # Leave it to the `Procedure.apply` running this code
+                    return TailCall(fn, args)
+                value = fn.apply(args)
+
+            elif fn.primitive is not None:
+                argc, ellipsis = fn.arity
+                if arg != argc and (ellipsis is not ... or arg < argc):
+                    raise arity_error(fn.name, fn.arity, arg)
+                value = fn.primitive(args, env)
+
+            else:
+                value = fn.proc_fn(args, env)
+
+            if op == CALL:
+                push(value)
+            elif not calls:
+                return value
+            else:
+                instructions, consts, pc, env = calls.pop()
+                push(value)
+            # Only the stack may hold on to the value, which can be the
+            # head of a `Seq` that a later call walks in constant memory
+            value = args = None
+
+        elif op == RETURN:
+            if not calls:
+                return pop()
+            # The caller's stack continues this one, value on top
+            instructions, consts, pc, env = calls.pop()
+
+        elif op == JUMP_IF_FALSE:
+            if not truthy(pop()):
+                pc = arg
+
+        elif op == JUMP:
+            pc = arg
+
+        elif op == LOAD_OUTER:
+            level, slot = arg
+            push(env.parent.display()[level].slots[slot])
+
+        elif op == POP:
+            pop()
+
+        elif op == JUMP_IF_FALSE_OR_POP:
+            if truthy(stack[-1]):
+                pop()
+            else:
+                pc = arg
+
+        elif op == JUMP_IF_TRUE_OR_POP:
+            if truthy(stack[-1]):
+                pc = arg
+            else:
+                pop()
+
+        elif op == ENTER:
+            scope, count = arg
+            split = len(stack) - count
+            slots = stack[split:]
+            del stack[split:]
+            missing = len(scope.names) - count
+            if missing:
+                slots.extend([None] * missing)
+            env = Frame(scope, slots, env)
+
+        elif op == LEAVE:
+            env = env.parent
+
+        elif op == MAKE_PROC:
+            template = consts[arg]
+            push(Procedure(formals=template.formals, body=template.body,
+                           creation_env=env, code=VMBody(template.code),
+                           scope=template.scope, name=template.name))
+
+        elif op == LOAD_NAME:
+            push(env[arg])
+
+        elif op == STORE_LOCAL:
+            env.slots[arg] = stack[-1]
+
+        elif op == STORE_OUTER:
+            level, slot = arg
+            env.parent.display()[level].slots[slot] = stack[-1]
+
+        elif op == STORE_GLOBAL:
+            try:
+                env.top[arg] = stack[-1]
+            except KeyError:
+                env[arg] = stack[-1] # See `Symbol.compile`
+
+        elif op == STORE_NAME:
+            env[arg] = stack[-1]
+
+        elif op == DECLARE_NAME:
+            env.declare(arg)
+
+        elif op == CLOSURE:
+            push(arg(env))
+
+        else:
+            raise Exception(f"Unknown opcode: {op}")
+
+
+def disassemble(code, level=0):
+    """
+    Returns a listing of `code` and, indented under it, the code of the
+    procedures it creates.
+    """
+    indent = " " * 4 * level
+    lines = [f"{indent}{code.name}:"]
+    nested = []
+
+    for pc, (op, arg) in enumerate(code.instructions):
+        if op == CONST:
+            shown = f"{arg} ({code.consts[arg]})"
+        elif op == MAKE_PROC:
+            template = code.consts[arg]
+            nested.append(template.code)
+            shown = f"{arg} ({template.code.name})"
+        elif op == CALLABLE:
+            shown = str(arg[1]) if arg[0] is None else f"{arg[0]} -> {arg[1]}"
+        elif op == BUILTIN:
+            shown = f"{arg[0]} -> {arg[2]}"
+        elif op == CALL_BUILTIN:
+            shown = f"{arg[1]} ({arg[0].name})"
+        elif op == BUILTIN_ON:
+            shown = f"{arg[0]} " + " ".join(
+                f"@{slot}" if slot is not None else str(value)
+                for slot, value in arg[3])
+        elif op == ENTER:
+            shown = f"{arg[1]} ({' '.join(map(str, arg[0].names))})"
+        elif op == CLOSURE:
+            shown = "<closure>"
+        elif arg is None:
+            shown = ""
+        else:
+            shown = str(arg)
+        lines.append(f"{indent}    {pc:>4} {OPNAMES[op]:<22}{shown}".rstrip())
+
+    for inner in nested:
+        lines.append(disassemble(inner, level + 1))
+
+    return "\n".join(lines)
+